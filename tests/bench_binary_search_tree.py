@@ -0,0 +1,116 @@
+from typing import Iterator
+import argparse
+import random
+import time
+
+from test_binary_search_tree import AVLTree, BinarySearchTree, BinarySearchTreeNode
+
+
+def _height(tree: BinarySearchTree) -> int:
+    # without recursion, an unbalanced tree can be as tall as it has nodes
+    height = 0
+    level = [tree.root] if tree.root is not None else []
+    while level:
+        height += 1
+        level = [c for node in level for c in (node.left, node.right) if c is not None]
+    return height
+
+
+def bench_orders(n: int, impls: list[str]) -> None:
+    print(f"inserting and looking up {n} keys, per key")
+    print(f"{'order':>9} {'impl':>6} {'insert':>12} {'search':>12} {'height':>8}")
+    orders = {
+        "sorted": list(range(n)),
+        "reversed": list(range(n, 0, -1)),
+        "random": random.sample(range(n * 10), n),
+    }
+    classes = {"bst": BinarySearchTree, "avl": AVLTree}
+    for order, keys in orders.items():
+        lookups = random.sample(keys, len(keys))
+        for name in impls:
+            if name == "bst" and order != "random" and n > 20_000:
+                # the plain tree degenerates into a list, quadratic
+                print(f"{order:>9} {name:>6} {'-':>12}")
+                continue
+            tree = classes[name]()
+            t0 = time.perf_counter()
+            for k in keys:
+                tree.insert(k, k)
+            t1 = time.perf_counter()
+            for k in lookups:
+                tree.search(k)
+            t2 = time.perf_counter()
+            print(
+                f"{order:>9} {name:>6} {(t1 - t0) / n * 1e9:>10.0f}ns"
+                f" {(t2 - t1) / n * 1e9:>10.0f}ns {_height(tree):>8}"
+            )
+
+
+def _recursive_inorder(node) -> Iterator[BinarySearchTreeNode]:
+    # the original nested generators, every node is passed up through one frame per
+    # level, kept as the baseline
+    if node is not None:
+        for n in _recursive_inorder(node.left):
+            yield n
+        yield node
+        for n in _recursive_inorder(node.right):
+            yield n
+
+
+def bench_scan(n: int, impls: list[str]) -> None:
+    print(f"scanning a tree of {n} random keys, per node")
+    print(
+        f"{'impl':>6} {'recursive':>12} {'inorder':>12} {'range 1%':>12}"
+        f" {'successor':>12}"
+    )
+    classes = {"bst": BinarySearchTree, "avl": AVLTree}
+    keys = random.sample(range(n * 10), n)
+    for name in impls:
+        tree = classes[name]()
+        for k in keys:
+            tree.insert(k, k)
+        row = []
+        for scan in [
+            lambda: sum(1 for _ in _recursive_inorder(tree.root)),
+            lambda: sum(1 for _ in tree.inorder()),
+        ]:
+            t0 = time.perf_counter()
+            scan()
+            row.append(f"{(time.perf_counter() - t0) / n * 1e9:>10.0f}ns")
+
+        # 100 windows of 1% of the key space each
+        count = 0
+        t0 = time.perf_counter()
+        for lo in random.sample(range(n * 10), 100):
+            for _ in tree.range(lo, lo + n // 10):
+                count += 1
+        row.append(f"{(time.perf_counter() - t0) / max(1, count) * 1e9:>10.0f}ns")
+
+        lookups = random.sample(range(n * 10), min(n, 100_000))
+        t0 = time.perf_counter()
+        for k in lookups:
+            tree.successor(k)
+        row.append(f"{(time.perf_counter() - t0) / len(lookups) * 1e9:>10.0f}ns")
+        print(f"{name:>6} " + " ".join(row))
+
+
+BENCHES = {
+    "orders": lambda args: bench_orders(args.n, args.impls),
+    "scan": lambda args: bench_scan(args.n, args.impls),
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="BinarySearchTree benchmarks")
+    parser.add_argument(
+        "bench", nargs="*", help=f"any of {sorted(BENCHES)}, default: all"
+    )
+    parser.add_argument("-n", type=int, default=1_000_000, help="number of keys")
+    parser.add_argument("--impls", nargs="+", default=["bst", "avl"])
+    args = parser.parse_args()
+    for name in args.bench:
+        if name not in BENCHES:
+            parser.error(f"unknown benchmark {name!r}")
+    random.seed(0)
+    for name in args.bench or sorted(BENCHES):
+        BENCHES[name](args)
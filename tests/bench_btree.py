@@ -0,0 +1,338 @@
+from __future__ import annotations
+
+from math import inf
+from typing import Any, Optional
+import argparse
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+
+from sortedcontainers import SortedList
+
+from test_btree import BTree, PagedBTree
+
+
+class LegacyBTreeNode:
+    # the original SortedList + dict node, kept as the baseline for benchmarks
+    def __init__(self, order: int, is_leaf: bool) -> None:
+        self.order = order
+        self.is_leaf = is_leaf
+
+        self.keys: SortedList[float] = SortedList()
+        self.values: dict[float, Any] = {}
+        self.children: dict[float, Optional[LegacyBTreeNode]] = {}
+
+        self.add(inf, None, None)
+
+    def is_full(self) -> bool:
+        return len(self.keys) == self.order * 2
+
+    def has(self, key: float) -> bool:
+        return key in self.keys
+
+    def add(self, key: float, value: Any, child: Optional[LegacyBTreeNode]) -> None:
+        self.keys.add(key)
+        self.values[key] = value
+        self.children[key] = child
+
+    def update(self, key: float, value: Any, child: Optional[LegacyBTreeNode]) -> None:
+        self.values[key] = value
+        self.children[key] = child
+
+    def pop(self, key: float) -> tuple[Any, Optional[LegacyBTreeNode]]:
+        v = self.values[key]
+        c = self.children[key]
+        self.keys.remove(key)
+        del self.values[key]
+        del self.children[key]
+        return (v, c)
+
+
+class LegacyBTree:
+    # trace logging is left out, its eager formatting would dominate the numbers
+    def __init__(self, order: int):
+        self.order: int = order
+        self.root: LegacyBTreeNode = LegacyBTreeNode(self.order, True)
+
+    def insert(self, key: int, data: Any):
+        if self.root.is_full():
+            t = LegacyBTreeNode(self.order, False)
+            t.children[inf] = self.root
+            self.root = t
+            self._split_child(self.root, inf)
+        self._insert_not_full(self.root, key, data)
+
+    def _insert_not_full(self, node: LegacyBTreeNode, key: int, value: Any) -> None:
+        if node.is_leaf:
+            if node.has(key):
+                return node.update(key, value, None)
+            return node.add(key, value, None)
+        if node.has(key):
+            return node.update(key, value, None)
+        for k in node.keys:
+            if key < k:
+                break
+        child = node.children[k]
+        if child.is_full():
+            self._split_child(node, k)
+            return self._insert_not_full(node, key, value)
+        return self._insert_not_full(child, key, value)
+
+    def _split_child(self, root: LegacyBTreeNode, key: float) -> None:
+        child = root.children[key]
+        mid_index = self.order - 1
+        new_child = LegacyBTreeNode(self.order, child.is_leaf)
+        keys = [k for k in child.keys]
+        for i, k in enumerate(keys):
+            if i < mid_index:
+                v, c = child.pop(k)
+                new_child.add(k, v, c)
+            elif i == mid_index:
+                v, c = child.pop(k)
+                new_child.update(inf, None, c)
+                root.add(k, v, new_child)
+            else:
+                break
+
+    def search(self, key: float) -> Any:
+        node = self._search(self.root, key)
+        if node is not None:
+            return node.values[key]
+        return None
+
+    def _search(self, node: LegacyBTreeNode, key: float) -> Optional[LegacyBTreeNode]:
+        if node.has(key):
+            return node
+        if node.is_leaf:
+            return None
+        for k in node.keys:
+            if key < k:
+                break
+        return self._search(node.children[k], key)
+
+
+def _rate(n: int, seconds: float) -> str:
+    return f"{n / seconds / 1e3:10.1f}k/s"
+
+
+def bench_insert_search(n: int, orders: list[int]) -> None:
+    keys = random.sample(range(n * 10), n)
+    print(f"insert / search throughput, {n} random keys")
+    print(f"{'order':>6} {'impl':>8} {'insert':>14} {'search':>14}")
+    for order in orders:
+        for name, cls in [("legacy", LegacyBTree), ("array", BTree)]:
+            tree = cls(order)
+            t0 = time.perf_counter()
+            for k in keys:
+                tree.insert(k, k)
+            t1 = time.perf_counter()
+            for k in keys:
+                tree.search(k)
+            t2 = time.perf_counter()
+            print(f"{order:>6} {name:>8} {_rate(n, t1 - t0)} {_rate(n, t2 - t1)}")
+
+
+def bench_bulk_load(n: int, orders: list[int]) -> None:
+    print(f"building from {n} sorted keys")
+    print(f"{'order':>6} {'insert':>14} {'bulk_load':>14}")
+    for order in orders:
+        tree = BTree(order)
+        t0 = time.perf_counter()
+        for k in range(n):
+            tree.insert(k, k)
+        t1 = time.perf_counter()
+        tree = BTree(order)
+        tree.bulk_load((k, k) for k in range(n))
+        t2 = time.perf_counter()
+        print(f"{order:>6} {_rate(n, t1 - t0)} {_rate(n, t2 - t1)}")
+
+
+def bench_range(n: int, orders: list[int]) -> None:
+    print(f"scanning a tree of {n} keys, entries per second")
+    print(
+        f"{'order':>6} {'share':>6} {'lookups':>14} {'range':>14} {'leaf-linked':>14}"
+    )
+    for order in orders:
+        trees = [BTree(order), BTree(order, leaf_linked=True)]
+        for tree in trees:
+            tree.bulk_load(((k, k) for k in range(n)), fill_factor=0.7)
+        for share in [0.01, 1.0]:
+            count = int(n * share)
+            lo = (n - count) // 2
+            hi = lo + count
+            t0 = time.perf_counter()
+            for k in range(lo, hi):
+                trees[0].search(k)
+            t1 = time.perf_counter()
+            timings = []
+            for tree in trees:
+                t = time.perf_counter()
+                for _ in tree.range(lo, hi):
+                    pass
+                timings.append(time.perf_counter() - t)
+            rates = " ".join(_rate(count, t) for t in [t1 - t0] + timings)
+            print(f"{order:>6} {share:>6.0%} {rates}")
+
+
+def bench_search_many(n: int, orders: list[int]) -> None:
+    print(f"batched lookups in a tree of {n} keys, half of the lookups miss")
+    print(
+        f"{'order':>6} {'batch':>7} {'search':>14} {'search_many':>14} {'speedup':>8}"
+    )
+    for order in orders:
+        tree = BTree(order)
+        tree.bulk_load(((k, k) for k in range(0, 2 * n, 2)), fill_factor=0.7)
+        for size in [100, 1000, 10_000, 100_000]:
+            batches = [
+                [random.randrange(2 * n) for _ in range(size)]
+                for _ in range(max(1, n // size))
+            ]
+            count = size * len(batches)
+            t0 = time.perf_counter()
+            for batch in batches:
+                [tree.search(k) for k in batch]
+            t1 = time.perf_counter()
+            for batch in batches:
+                tree.search_many(batch)
+            t2 = time.perf_counter()
+            speedup = (t1 - t0) / (t2 - t1)
+            print(
+                f"{order:>6} {size:>7} {_rate(count, t1 - t0)} {_rate(count, t2 - t1)}"
+                f" {speedup:>7.2f}x"
+            )
+
+
+def bench_paged(n: int, orders: list[int]) -> None:
+    keys = random.sample(range(n * 10), n)
+    print(f"disk-resident tree of {n} random keys, cache sizes in pages")
+    print(
+        f"{'order':>6} {'cache':>6} {'pages':>6} {'insert':>14} {'search':>14}"
+        f" {'hit rate':>9} {'faults':>8} {'os faults':>10} {'reopen':>9}"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        for order in orders:
+            for cache_pages in [16, 256, 4096]:
+                path = os.path.join(tmp, f"{order}-{cache_pages}.db")
+                tree = PagedBTree(path, order, cache_pages=cache_pages)
+                t0 = time.perf_counter()
+                for k in keys:
+                    tree.insert(k, k)
+                tree.flush()
+                t1 = time.perf_counter()
+                tree.close()
+                del tree
+
+                t2 = time.perf_counter()
+                tree = PagedBTree(path, cache_pages=cache_pages)
+                t3 = time.perf_counter()
+                os_faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+                for k in keys:
+                    tree.search(k)
+                t4 = time.perf_counter()
+                os_faults = (
+                    resource.getrusage(resource.RUSAGE_SELF).ru_minflt - os_faults
+                )
+                stats = tree.stats()
+                tree.close()
+                print(
+                    f"{order:>6} {cache_pages:>6} {stats['pages']:>6}"
+                    f" {_rate(n, t1 - t0)} {_rate(n, t4 - t3)}"
+                    f" {stats['hit_rate']:>9.1%} {stats['faults']:>8} {os_faults:>10}"
+                    f" {(t3 - t2) * 1e3:>7.2f}ms"
+                )
+
+
+def _read_write(
+    tree: BTree, n: int, readers: int, seconds: float, lock
+) -> tuple[int, int]:
+    # one writer inserts new keys while readers look up random existing ones
+    # lock is None for copy-on-write, where readers search a snapshot instead
+    stop = threading.Event()
+    reads = [0] * readers
+    writes = [0]
+
+    def reader(r: int) -> None:
+        rng = random.Random(r)
+        count = 0
+        while not stop.is_set():
+            if lock is None:
+                view = tree.snapshot()
+                for _ in range(100):
+                    view.search(rng.randrange(n))
+            else:
+                for _ in range(100):
+                    with lock:
+                        tree.search(rng.randrange(n))
+            count += 100
+        reads[r] = count
+
+    def writer() -> None:
+        k = n
+        while not stop.is_set():
+            if lock is None:
+                tree.insert(k, k)
+            else:
+                with lock:
+                    tree.insert(k, k)
+            k += 1
+        writes[0] = k - n
+
+    threads = [threading.Thread(target=reader, args=(r,)) for r in range(readers)]
+    threads.append(threading.Thread(target=writer))
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return sum(reads), writes[0]
+
+
+def bench_copy_on_write(n: int, orders: list[int], seconds: float = 1.0) -> None:
+    print(f"1 writer and N readers on a tree of {n} keys, {seconds}s per run")
+    print(
+        f"{'order':>6} {'readers':>7} {'locked reads':>14} {'writes':>14}"
+        f" {'cow reads':>14} {'writes':>14}"
+    )
+    for order in orders:
+        for readers in [1, 2, 4, 8]:
+            rates = []
+            for cow in [False, True]:
+                tree = BTree(order, copy_on_write=cow)
+                tree.bulk_load((k, k) for k in range(n))
+                reads, writes = _read_write(
+                    tree, n, readers, seconds, None if cow else threading.Lock()
+                )
+                rates += [_rate(reads, seconds), _rate(writes, seconds)]
+            print(f"{order:>6} {readers:>7} {' '.join(rates)}")
+
+
+BENCHES = {
+    "insert": lambda args: bench_insert_search(args.n, args.orders),
+    "bulk": lambda args: bench_bulk_load(args.n, args.orders),
+    "range": lambda args: bench_range(args.n, args.orders),
+    "batch": lambda args: bench_search_many(args.n, args.orders),
+    "disk": lambda args: bench_paged(args.n, args.orders),
+    "cow": lambda args: bench_copy_on_write(args.n, args.orders),
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="BTree benchmarks")
+    parser.add_argument(
+        "bench", nargs="*", help=f"any of {sorted(BENCHES)}, default: all"
+    )
+    parser.add_argument("-n", type=int, default=50_000, help="number of keys")
+    parser.add_argument(
+        "--orders", type=int, nargs="+", default=[2, 4, 8, 16, 32, 64, 128]
+    )
+    args = parser.parse_args()
+    for name in args.bench:
+        if name not in BENCHES:
+            parser.error(f"unknown benchmark {name!r}")
+    random.seed(0)
+    for name in args.bench or sorted(BENCHES):
+        BENCHES[name](args)
@@ -0,0 +1,243 @@
+import argparse
+import random
+import threading
+import time
+
+from test_buddy_allocator import (
+    AllocationTrace,
+    BuddyAllocator,
+    SlabAllocator,
+    ThreadCachedBuddyAllocator,
+    lifo_trace,
+    power_law_trace,
+    random_lifetime_trace,
+    replay,
+    uniform_trace,
+)
+
+
+class LegacyBuddyAllocator:
+    # the original list-based free lists, kept as the baseline for benchmarks
+    # only the index of the merged block is corrected so that churn does not corrupt it
+    def __init__(self, capacity: int, degree: int) -> None:
+        self.C = capacity
+        self.N = capacity.bit_length() - 1
+        self.D = degree
+        self.free_blocks: dict[int, list[int]] = {}
+        for d in range(self.N, self.N - self.D - 1, -1):
+            self.free_blocks[d] = []
+        self.free_blocks[self.N].append(0)
+        self.used_blocks: dict[int, tuple[int, int]] = {}
+
+    def alloc(self, size: int) -> int:
+        d = (size - 1).bit_length()
+        d = self.N - self.D if d < self.N - self.D else d
+        if len(self.free_blocks[d]) == 0:
+            nd = d + 1
+            while nd <= self.N and len(self.free_blocks[nd]) == 0:
+                nd += 1
+            if nd > self.N:
+                raise RuntimeError(f"Out of memory. requested-degree={d}")
+            self._split(nd, d)
+        i = self.free_blocks[d].pop(0)
+        a = i * (2**d)
+        self.used_blocks[a] = (d, i)
+        return a
+
+    def free(self, address: int) -> None:
+        degree, index = self.used_blocks[address]
+        del self.used_blocks[address]
+        self.free_blocks[degree].append(index)
+        self._merge(degree, index)
+
+    def _split(self, large_block_degree: int, requested_degree: int) -> None:
+        index = self.free_blocks[large_block_degree].pop(0)
+        self.free_blocks[large_block_degree - 1].append(index * 2)
+        self.free_blocks[large_block_degree - 1].append(index * 2 + 1)
+        if (large_block_degree - 1) == requested_degree:
+            return
+        self._split(large_block_degree - 1, requested_degree)
+
+    def _merge(self, degree: int, index: int) -> None:
+        if degree == self.N:
+            return
+        buddy = index + 1 if index % 2 == 0 else index - 1
+        if index in self.free_blocks[degree] and buddy in self.free_blocks[degree]:
+            self.free_blocks[degree].remove(index)
+            self.free_blocks[degree].remove(buddy)
+            degree += 1
+            index = index >> 1
+            self.free_blocks[degree].append(index)
+            self._merge(degree, index)
+
+
+def bench_churn(live_counts: list[int], ops: int, impls: list[str]) -> None:
+    # fragment the heap so that half of the small blocks are live and every other
+    # one is free, then free a random live block and allocate a new one over and over
+    print(f"churn of {ops} free+alloc pairs with 16..64 byte blocks")
+    print(f"{'live':>8} " + " ".join(f"{name:>14}" for name in impls))
+    classes = {"legacy": LegacyBuddyAllocator, "buddy": BuddyAllocator}
+    for live in live_counts:
+        row = []
+        for name in impls:
+            if name == "legacy" and live > 20_000:
+                # quadratic, it would take minutes
+                row.append(f"{'-':>13}")
+                continue
+            rng = random.Random(live)
+            ba = classes[name](1 << 30, 26)
+            addresses = [ba.alloc(16) for _ in range(2 * live)]
+            for a in addresses[1::2]:
+                ba.free(a)
+            addresses = addresses[::2]
+            sizes = [rng.choice([16, 32, 64]) for _ in range(ops)]
+            victims = [rng.randrange(live) for _ in range(ops)]
+            t0 = time.perf_counter()
+            for size, victim in zip(sizes, victims):
+                ba.free(addresses[victim])
+                addresses[victim] = ba.alloc(size)
+            t1 = time.perf_counter()
+            row.append(f"{(t1 - t0) / ops * 1e9:>11.0f}ns")
+        print(f"{live:>8} " + " ".join(row))
+
+
+class LockedBuddyAllocator:
+    # one global lock around BuddyAllocator, the baseline for the thread cache
+    def __init__(self, core: BuddyAllocator) -> None:
+        self.core = core
+        self.lock = threading.Lock()
+
+    def alloc(self, size: int) -> int:
+        with self.lock:
+            return self.core.alloc(size)
+
+    def free(self, address: int) -> None:
+        with self.lock:
+            self.core.free(address)
+
+    def flush(self) -> None:
+        pass
+
+
+def bench_threads(thread_counts: list[int], ops: int) -> None:
+    # every thread keeps up to 64 small blocks and allocs or frees at random
+    print(f"{ops} small alloc/free per thread, total throughput")
+    print(f"{'threads':>8} {'locked':>14} {'magazines':>14}")
+
+    def worker(allocator, seed: int) -> None:
+        rng = random.Random(seed)
+        sizes = [rng.choice([16, 32, 48, 64, 100]) for _ in range(ops)]
+        blocks: list[int] = []
+        for size in sizes:
+            if len(blocks) == 64 or (blocks and rng.random() < 0.5):
+                allocator.free(blocks.pop())
+            else:
+                blocks.append(allocator.alloc(size))
+        for a in blocks:
+            allocator.free(a)
+        allocator.flush()
+
+    for count in thread_counts:
+        row = []
+        for front in [LockedBuddyAllocator, ThreadCachedBuddyAllocator]:
+            allocator = front(BuddyAllocator(1 << 24, 20))
+            threads = [
+                threading.Thread(target=worker, args=(allocator, i))
+                for i in range(count)
+            ]
+            t0 = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            t1 = time.perf_counter()
+            row.append(f"{count * ops / (t1 - t0) / 1e3:>10.1f}k/s")
+        print(f"{count:>8} " + " ".join(row))
+
+
+def bench_replay(ops: int, impls: list[str], trace_path: str = "") -> None:
+    # replay the synthetic workloads, or a recorded trace, on each allocator
+    if trace_path:
+        traces = {trace_path: AllocationTrace.load(trace_path)}
+    else:
+        traces = {
+            "uniform": uniform_trace(ops, 16, 4096, live=2000),
+            "power-law": power_law_trace(ops, 16, 1 << 16, live=2000),
+            "lifo": lifo_trace(ops, 16, 4096, burst=500),
+            "lifetimes": random_lifetime_trace(ops, 16, 4096, mean_lifetime=2000),
+        }
+    classes = {"legacy": LegacyBuddyAllocator, "buddy": BuddyAllocator}
+    print("replay on a 16MiB heap with 16 byte min blocks")
+    print(
+        f"{'trace':>10} {'impl':>8} {'ops':>8} {'ops/s':>12} {'peak req':>10}"
+        f" {'peak used':>10} {'oom':>5}  fragmentation at peak, 1KiB..64KiB blocks"
+    )
+    for name, trace in traces.items():
+        for impl in impls:
+            report = replay(trace, lambda: classes[impl](1 << 24, 20))
+            fragmentation = " ".join(
+                f"{report.fragmentation.get(d, 0.0):.2f}" for d in range(10, 17)
+            )
+            print(
+                f"{name:>10} {impl:>8} {report.ops:>8} {report.ops_per_sec:>12.0f}"
+                f" {report.peak_requested:>10} {report.peak_used:>10}"
+                f" {len(report.oom):>5}  {fragmentation}"
+            )
+
+
+def bench_slab(live: int, ops: int) -> None:
+    # keep live objects of one size, then free a random one and allocate another
+    # memory is what the core has handed out, overhead is the share of it not asked for
+    print(f"{live} live objects and {ops} free+alloc pairs, 64MiB heap")
+    print(
+        f"{'size':>6} {'impl':>6} {'fill':>10} {'churn':>10} {'memory':>10}"
+        f" {'overhead':>9}"
+    )
+    for size in [24, 48, 200]:
+        for name in ["buddy", "slab"]:
+            rng = random.Random(size)
+            core = BuddyAllocator(1 << 26, 22)
+            allocator = core if name == "buddy" else SlabAllocator(core)
+            victims = [rng.randrange(live) for _ in range(ops)]
+            t0 = time.perf_counter()
+            addresses = [allocator.alloc(size) for _ in range(live)]
+            t1 = time.perf_counter()
+            for victim in victims:
+                allocator.free(addresses[victim])
+                addresses[victim] = allocator.alloc(size)
+            t2 = time.perf_counter()
+            memory = sum(1 << d for d, _ in core.used_blocks.values())
+            print(
+                f"{size:>6} {name:>6} {(t1 - t0) / live * 1e9:>8.0f}ns"
+                f" {(t2 - t1) / ops * 1e9:>8.0f}ns {memory:>10}"
+                f" {1 - live * size / memory:>9.1%}"
+            )
+
+
+BENCHES = {
+    "churn": lambda args: bench_churn(args.live, args.ops, args.impls),
+    "threads": lambda args: bench_threads(args.threads, args.ops * 10),
+    "slab": lambda args: bench_slab(args.live[-1], args.ops * 20),
+    "replay": lambda args: bench_replay(args.ops * 20, args.impls, args.trace),
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="BuddyAllocator benchmarks")
+    parser.add_argument(
+        "bench", nargs="*", help=f"any of {sorted(BENCHES)}, default: all"
+    )
+    parser.add_argument("--ops", type=int, default=5000, help="operations per run")
+    parser.add_argument(
+        "--live", type=int, nargs="+", default=[100, 1000, 10_000, 100_000]
+    )
+    parser.add_argument("--impls", nargs="+", default=["legacy", "buddy"])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--trace", default="", help="replay this trace file instead")
+    args = parser.parse_args()
+    for name in args.bench:
+        if name not in BENCHES:
+            parser.error(f"unknown benchmark {name!r}")
+    random.seed(0)
+    for name in args.bench or sorted(BENCHES):
+        BENCHES[name](args)
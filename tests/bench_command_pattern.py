@@ -0,0 +1,123 @@
+import argparse
+import random
+import threading
+import time
+
+from loguru import logger
+
+from test_command_pattern import (
+    BlockingRequestQueue,
+    BucketRequestQueue,
+    Command,
+    HeapRequestQueue,
+    ReceiverPool,
+    Request,
+    RequestQueue,
+    Sender,
+)
+
+QUEUES = {
+    "sorted": RequestQueue,
+    "bucket": BucketRequestQueue,
+    "heap": HeapRequestQueue,
+}
+
+
+def _rate(n: int, seconds: float) -> str:
+    return f"{n / seconds / 1e6:10.2f}M/s"
+
+
+def bench_queues(n: int, impls: list[str]) -> None:
+    # fill with n requests then drain, and a steady state where every add is
+    # followed by a sched on a queue that holds 1000 requests
+    print(f"{n} requests, priorities in range(levels)")
+    print(f"{'levels':>8} {'impl':>8} {'add':>12} {'drain':>12} {'add+sched':>12}")
+    for levels in [8, 64, 1 << 20]:
+        requests = [
+            Request(random.randrange(levels), Command.EXECUTE_MATMUL, [])
+            for _ in range(n)
+        ]
+        for impl in impls:
+            if impl == "bucket" and levels > 64:
+                # one deque per level, the heap is the fallback for wide ranges
+                continue
+            q = QUEUES[impl]() if impl != "bucket" else BucketRequestQueue(levels)
+            t0 = time.perf_counter()
+            for r in requests:
+                q.add(r)
+            t1 = time.perf_counter()
+            while q.sched() is not None:
+                pass
+            t2 = time.perf_counter()
+            for r in requests[:1000]:
+                q.add(r)
+            t3 = time.perf_counter()
+            for r in requests:
+                q.add(r)
+                q.sched()
+            t4 = time.perf_counter()
+            print(
+                f"{levels:>8} {impl:>8} {_rate(n, t1 - t0)} {_rate(n, t2 - t1)}"
+                f" {_rate(n, t4 - t3)}"
+            )
+
+
+def bench_threads(n: int, counts: list[int], capacity: int) -> None:
+    # producers send n requests in total through a bounded queue to a pool of
+    # receivers, timed from the first send until every receiver has exited
+    print(f"{n} requests through a BlockingRequestQueue of capacity {capacity}")
+    print(f"{'producers':>9} " + " ".join(f"{f'{c} rx':>12}" for c in counts))
+    for producers in counts:
+        row = []
+        for consumers in counts:
+            q = BlockingRequestQueue(capacity, BucketRequestQueue(8))
+            senders = [Sender(i, q) for i in range(producers)]
+            requests = [
+                Request(random.randrange(7), Command.EXECUTE_MATMUL, [])
+                for _ in range(n // producers)
+            ]
+
+            def produce(sender: Sender) -> None:
+                for r in requests:
+                    sender.send_request(r)
+
+            threads = [threading.Thread(target=produce, args=(s,)) for s in senders]
+            t0 = time.perf_counter()
+            pool = ReceiverPool(q, consumers)
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            pool.shutdown()
+            t1 = time.perf_counter()
+            row.append(_rate(pool.executed - consumers, t1 - t0))
+        print(f"{producers:>9} " + " ".join(row))
+
+
+BENCHES = {
+    "queues": lambda args: bench_queues(args.n, args.impls),
+    "threads": lambda args: bench_threads(args.n // 10, args.threads, args.capacity),
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RequestQueue benchmarks")
+    parser.add_argument(
+        "bench", nargs="*", help=f"any of {sorted(BENCHES)}, default: all"
+    )
+    parser.add_argument("-n", type=int, default=1_000_000, help="number of requests")
+    parser.add_argument("--impls", nargs="+", default=list(QUEUES))
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--capacity", type=int, default=16, help="queue capacity")
+    args = parser.parse_args()
+    for name in args.bench:
+        if name not in BENCHES:
+            parser.error(f"unknown benchmark {name!r}")
+    for name in args.impls:
+        if name not in QUEUES:
+            parser.error(f"unknown queue {name!r}")
+    # the per request debug logging would dominate the numbers
+    logger.remove()
+    random.seed(0)
+    for name in args.bench or sorted(BENCHES):
+        BENCHES[name](args)
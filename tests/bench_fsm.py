@@ -0,0 +1,123 @@
+import argparse
+import random
+import time
+import tracemalloc
+
+from test_fsm import State, ThreadStateMachine, ThreadStateMachineFleet, Trigger, np
+
+
+class LegacyThreadStateMachine:
+    # the original match on trigger strings, kept as the baseline for benchmarks
+    def __init__(self) -> None:
+        self.state = State.INIT
+
+    def _check_state(self, trigger: str, possible_states: list[State]):
+        if self.state not in possible_states:
+            raise RuntimeError(f"{trigger=} {self.state.name=} {possible_states=}")
+
+    def action(self, trigger: str) -> None:
+        match trigger:
+            case "start":
+                self._check_state(trigger, [State.INIT, State.SUSPENDED])
+                self.state = State.READY
+            case "schedule":
+                self._check_state(trigger, [State.READY])
+                self.state = State.RUNNING
+            case "wait":
+                self._check_state(trigger, [State.RUNNING])
+                self.state = State.WAITING
+            case "suspend":
+                self._check_state(
+                    trigger, [State.RUNNING, State.READY, State.INIT, State.WAITING]
+                )
+                self.state = State.SUSPENDED
+            case _:
+                raise RuntimeError(f"Unsupported trigger={trigger}")
+
+
+def bench_transitions(n: int) -> None:
+    # cycle INIT -> READY -> RUNNING -> WAITING -> SUSPENDED -> READY -> ...
+    print(f"{n} transitions, one machine")
+    print(f"{'impl':>8} {'trigger':>8} {'rate':>14}")
+    names = ["start", "schedule", "wait", "suspend"] * (n // 4)
+    enums = [Trigger[name.upper()] for name in names]
+    for impl, cls, triggers in [
+        ("legacy", LegacyThreadStateMachine, names),
+        ("table", ThreadStateMachine, names),
+        ("table", ThreadStateMachine, enums),
+    ]:
+        fsm = cls()
+        action = fsm.action
+        t0 = time.perf_counter()
+        for trigger in triggers:
+            action(trigger)
+        t1 = time.perf_counter()
+        assert fsm.state == State.SUSPENDED
+        kind = "enum" if triggers is enums else "str"
+        print(f"{impl:>8} {kind:>8} {len(triggers) / (t1 - t0) / 1e6:>12.2f}M/s")
+
+
+def bench_fleet(sizes: list[int]) -> None:
+    if np is None:
+        print("fleet needs numpy, skipped")
+        return
+    # every step fires a random trigger at a random half of the machines
+    steps = 20
+    print(f"{steps} steps, each one random trigger per machine on half of the fleet")
+    print(f"{'machines':>9} {'impl':>8} {'rate':>14} {'memory':>10}")
+    for n in sizes:
+        rng = np.random.default_rng(n)
+        batches = [
+            (rng.integers(len(Trigger), size=n // 2), rng.permutation(n)[: n // 2])
+            for _ in range(steps)
+        ]
+        for impl in ["objects", "fleet"]:
+            if impl == "objects" and n > 100_000:
+                # about 5s per million transitions
+                print(f"{n:>9} {impl:>8} {'-':>14} {'-':>10}")
+                continue
+            tracemalloc.start()
+            if impl == "objects":
+                machines = [ThreadStateMachine() for _ in range(n)]
+                triggers = list(Trigger)
+            else:
+                fleet = ThreadStateMachineFleet(n)
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            t0 = time.perf_counter()
+            for trigger, index in batches:
+                if impl == "objects":
+                    for t, i in zip(trigger.tolist(), index.tolist()):
+                        try:
+                            machines[i].action(triggers[t])
+                        except RuntimeError:
+                            pass
+                else:
+                    fleet.action(trigger, index)
+            t1 = time.perf_counter()
+            rate = steps * (n // 2) / (t1 - t0) / 1e6
+            print(f"{n:>9} {impl:>8} {rate:>12.2f}M/s {memory / n:>8.1f}B/m")
+
+
+BENCHES = {
+    "transitions": lambda args: bench_transitions(args.n),
+    "fleet": lambda args: bench_fleet(args.fleet_sizes),
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ThreadStateMachine benchmarks")
+    parser.add_argument(
+        "bench", nargs="*", help=f"any of {sorted(BENCHES)}, default: all"
+    )
+    parser.add_argument("-n", type=int, default=1_000_000, help="transitions per run")
+    parser.add_argument(
+        "--fleet-sizes", type=int, nargs="+", default=[1000, 100_000, 1_000_000]
+    )
+    args = parser.parse_args()
+    for name in args.bench:
+        if name not in BENCHES:
+            parser.error(f"unknown benchmark {name!r}")
+    random.seed(0)
+    for name in args.bench or sorted(BENCHES):
+        BENCHES[name](args)
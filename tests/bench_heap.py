@@ -0,0 +1,269 @@
+from typing import Any, Iterable
+import argparse
+import heapq
+import random
+import time
+
+from test_heap import Heap, IndexedHeap, merge, nlargest
+
+
+class LegacyHeap:
+    # the original list-shifting heap, kept as the baseline for benchmarks
+    # trace logging is left out, its eager formatting would dominate the numbers
+    def __init__(
+        self, keys: Iterable[Any], values: Iterable[Any], max_or_min: str = "max"
+    ) -> None:
+        self.keys: list[Any] = []
+        self.values: list[Any] = []
+        self.func = max if max_or_min == "max" else min
+        for k, v in zip(keys, values):
+            self.add(k, v)
+
+    def _heapify_one_node(self, index: int) -> int:
+        i = index
+        j = 2 * i + 1
+        k = 2 * i + 2
+        ls = [(i, self.keys[i])]
+        if j < len(self.keys):
+            ls.append((j, self.keys[j]))
+        if k < len(self.keys):
+            ls.append((k, self.keys[k]))
+        r, _ = self.func(ls, key=lambda x: x[1])
+        if r == i:
+            return 0
+        self.keys[i], self.keys[r] = self.keys[r], self.keys[i]
+        self.values[i], self.values[r] = self.values[r], self.values[i]
+        return 1 if r == j else 2
+
+    def add(self, key: Any, value: Any) -> None:
+        i = len(self.keys)
+        self.keys.append(key)
+        self.values.append(value)
+        if i == 0:
+            return
+        while True:
+            i = (i // 2 - 1) if (i % 2 == 0) else (i // 2)
+            if i < 0:
+                break
+            if self._heapify_one_node(i) == 0:
+                break
+
+    def pop(self) -> tuple[Any, Any]:
+        result_key = self.keys.pop(0)
+        result_value = self.values.pop(0)
+        if len(self.keys) <= 1:
+            return result_key, result_value
+        self.keys.insert(0, self.keys.pop(-1))
+        self.values.insert(0, self.values.pop(-1))
+        i = 0
+        while True:
+            r = self._heapify_one_node(i)
+            if r == 0:
+                break
+            i = i * 2 + r
+        return result_key, result_value
+
+
+class HeapqQueue:
+    # heapq on (key, value) tuples, the reference min heap
+    def __init__(self, keys: Iterable[Any], values: Iterable[Any]) -> None:
+        self.items = list(zip(keys, values))
+        heapq.heapify(self.items)
+
+    def add(self, key: Any, value: Any) -> None:
+        heapq.heappush(self.items, (key, value))
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def pop(self) -> tuple[Any, Any]:
+        return heapq.heappop(self.items)
+
+
+IMPLS = {
+    "legacy": lambda keys, values: LegacyHeap(keys, values, "min"),
+    "heap": lambda keys, values: Heap(keys, values, "min"),
+    "heapq": HeapqQueue,
+}
+
+
+def _skip(name: str, n: int) -> bool:
+    # the legacy heap is quadratic, large sizes would take minutes
+    return name == "legacy" and n > 20_000
+
+
+def bench_build(sizes: list[int], impls: list[str]) -> None:
+    print("building a heap from n random keys, then popping all of them")
+    print(f"{'n':>9} {'impl':>7} {'build':>12} {'pop':>12}")
+    for n in sizes:
+        keys = [random.random() for _ in range(n)]
+        values = list(range(n))
+        for name in impls:
+            if _skip(name, n):
+                continue
+            t0 = time.perf_counter()
+            hp = IMPLS[name](keys, values)
+            t1 = time.perf_counter()
+            for _ in range(n):
+                hp.pop()
+            t2 = time.perf_counter()
+            print(
+                f"{n:>9} {name:>7} {(t1 - t0) / n * 1e9:>10.0f}ns"
+                f" {(t2 - t1) / n * 1e9:>10.0f}ns"
+            )
+
+
+def bench_events(sizes: list[int], ops: int, impls: list[str]) -> None:
+    # the hold model of an event queue: pop the next event and schedule a new one
+    # a random time later, so the queue stays at n entries
+    print(f"event queue of n pending events, {ops} pop+add pairs")
+    print(f"{'n':>9} {'impl':>7} {'pop+add':>12}")
+    for n in sizes:
+        keys = [random.expovariate(1.0) for _ in range(n)]
+        delays = [random.expovariate(1.0 / n) for _ in range(ops)]
+        for name in impls:
+            if _skip(name, n):
+                continue
+            hp = IMPLS[name](keys, range(n))
+            t0 = time.perf_counter()
+            for i, delay in enumerate(delays):
+                now, _ = hp.pop()
+                hp.add(now + delay, i)
+            t1 = time.perf_counter()
+            print(f"{n:>9} {name:>7} {(t1 - t0) / ops * 1e9:>10.0f}ns")
+
+
+def _dijkstra_indexed(edges: list[list[tuple[int, float]]]) -> dict[int, float]:
+    dist = {0: 0.0}
+    hp = IndexedHeap([], [], max_or_min="min")
+    handles = {0: hp.add(0.0, 0)}
+    while len(hp):
+        d, u = hp.pop()
+        for v, w in edges[u]:
+            if v not in dist:
+                dist[v] = d + w
+                handles[v] = hp.add(d + w, v)
+            elif d + w < dist[v]:
+                dist[v] = d + w
+                hp.update(handles[v], d + w)
+    return dist
+
+
+def _dijkstra_lazy(edges: list[list[tuple[int, float]]], queue) -> dict[int, float]:
+    # no decrease-key, a better distance is pushed again and stale entries skipped
+    dist = {0: 0.0}
+    hp = queue([0.0], [0])
+    while len(hp):
+        d, u = hp.pop()
+        if d > dist[u]:
+            continue
+        for v, w in edges[u]:
+            if v not in dist or d + w < dist[v]:
+                dist[v] = d + w
+                hp.add(d + w, v)
+    return dist
+
+
+def bench_dijkstra(sizes: list[int]) -> None:
+    print("shortest paths on a random graph of n nodes and 8n edges")
+    print(f"{'n':>9} {'heapq lazy':>12} {'heap lazy':>12} {'decrease-key':>12}")
+    for n in sizes:
+        edges = [
+            [(random.randrange(n), random.random()) for _ in range(8)] for _ in range(n)
+        ]
+        row = []
+        for run in [
+            lambda: _dijkstra_lazy(edges, HeapqQueue),
+            lambda: _dijkstra_lazy(edges, IMPLS["heap"]),
+            lambda: _dijkstra_indexed(edges),
+        ]:
+            t0 = time.perf_counter()
+            run()
+            row.append(f"{(time.perf_counter() - t0) * 1e3:>10.0f}ms")
+        print(f"{n:>9} " + " ".join(row))
+
+
+def bench_reschedule(sizes: list[int], ops: int) -> None:
+    # n pending timers, each step moves a random timer to a new deadline
+    print(f"{ops} timer reschedules with n pending timers")
+    print(f"{'n':>9} {'pop+add all':>12} {'update':>12}")
+    for n in sizes:
+        keys = [random.random() for _ in range(n)]
+        moves = [(random.randrange(n), random.random()) for _ in range(ops)]
+        drain = f"{'-':>12}"
+        if n <= 100_000:
+            # without handles a timer can only be moved by draining the heap
+            rebuilds = min(ops, max(1, 100_000 // n))
+            hp = Heap(keys, range(n), "min")
+            t0 = time.perf_counter()
+            for timer, deadline in moves[:rebuilds]:
+                drained = [hp.pop() for _ in range(len(hp))]
+                for k, v in drained:
+                    hp.add(deadline if v == timer else k, v)
+            drain = f"{(time.perf_counter() - t0) / rebuilds * 1e9:>10.0f}ns"
+        hp = IndexedHeap(keys, range(n), "min")
+        t0 = time.perf_counter()
+        for timer, deadline in moves:
+            hp.update(timer, deadline)
+        t1 = time.perf_counter()
+        print(f"{n:>9} {drain} {(t1 - t0) / ops * 1e9:>10.0f}ns")
+
+
+def bench_merge(n: int, fan_ins: list[int]) -> None:
+    print(f"merging k sorted runs of {n} keys in total")
+    print(f"{'k':>6} {'heapq.merge':>12} {'merge':>12}")
+    for k in fan_ins:
+        runs = [sorted(random.random() for _ in range(n // k)) for _ in range(k)]
+        row = []
+        for fn in [heapq.merge, merge]:
+            t0 = time.perf_counter()
+            for _ in fn(*runs):
+                pass
+            row.append(f"{(time.perf_counter() - t0) / n * 1e9:>10.0f}ns")
+        print(f"{k:>6} " + " ".join(row))
+
+
+def bench_top(n: int, counts: list[int]) -> None:
+    print(f"the largest k of a stream of {n} keys")
+    print(f"{'k':>6} {'sorted':>12} {'heapq':>12} {'nlargest':>12}")
+    keys = [random.random() for _ in range(n)]
+    for k in counts:
+        row = []
+        for fn in [
+            lambda: sorted(keys, reverse=True)[:k],
+            lambda: heapq.nlargest(k, iter(keys)),
+            lambda: nlargest(k, iter(keys)),
+        ]:
+            t0 = time.perf_counter()
+            fn()
+            row.append(f"{(time.perf_counter() - t0) / n * 1e9:>10.0f}ns")
+        print(f"{k:>6} " + " ".join(row))
+
+
+BENCHES = {
+    "build": lambda args: bench_build(args.sizes, args.impls),
+    "events": lambda args: bench_events(args.sizes, args.ops, args.impls),
+    "dijkstra": lambda args: bench_dijkstra(args.sizes),
+    "reschedule": lambda args: bench_reschedule(args.sizes, args.ops),
+    "merge": lambda args: bench_merge(args.sizes[-1], [2, 16, 128, 1024]),
+    "top": lambda args: bench_top(args.sizes[-1], [10, 100, 1000, 10_000]),
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Heap benchmarks")
+    parser.add_argument(
+        "bench", nargs="*", help=f"any of {sorted(BENCHES)}, default: all"
+    )
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1000, 10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--ops", type=int, default=100_000, help="operations per run")
+    parser.add_argument("--impls", nargs="+", default=list(IMPLS))
+    args = parser.parse_args()
+    for name in args.bench:
+        if name not in BENCHES:
+            parser.error(f"unknown benchmark {name!r}")
+    random.seed(0)
+    for name in args.bench or sorted(BENCHES):
+        BENCHES[name](args)
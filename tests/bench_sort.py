@@ -0,0 +1,390 @@
+from typing import Any, Callable, Optional
+import argparse
+import json
+import platform
+import subprocess
+import random
+import sys
+import time
+import tracemalloc
+
+from test_mergesort import external_sort, mergesort
+from test_parallel_sort import np, parallel_sort, sort_pool
+from test_quicksort import quicksort
+
+
+def legacy_quicksort(arr, left_index=0, right_index=-1):
+    # the original last-item pivot quicksort, kept as the baseline for benchmarks
+    if right_index == -1:
+        right_index = len(arr) - 1
+    if left_index >= right_index:
+        return
+    pivot = arr[right_index]
+    j = left_index
+    i = j - 1
+    while True:
+        if arr[j] >= pivot:
+            j += 1
+        else:
+            i += 1
+            arr[i], arr[j] = arr[j], arr[i]
+            j += 1
+        if j == right_index:
+            i += 1
+            arr[i], arr[j] = arr[j], arr[i]
+            break
+    legacy_quicksort(arr, left_index, i - 1)
+    legacy_quicksort(arr, i + 1, right_index)
+
+
+def legacy_mergesort(arr, left_index=0, right_index=-1):
+    # the original top-down mergesort without its prints, kept as the baseline
+    if right_index == -1:
+        right_index = len(arr) - 1
+    if left_index >= right_index:
+        return
+    if left_index == right_index - 1:
+        if arr[left_index] > arr[right_index]:
+            arr[left_index], arr[right_index] = arr[right_index], arr[left_index]
+        return
+    mid_index = (left_index + right_index) // 2
+    legacy_mergesort(arr, left_index, mid_index)
+    legacy_mergesort(arr, mid_index + 1, right_index)
+    left_arr = arr[left_index : mid_index + 1]
+    right_arr = arr[mid_index + 1 : right_index + 1]
+    i = j = 0
+    k = left_index
+    while i < len(left_arr) and j < len(right_arr):
+        if left_arr[i] < right_arr[j]:
+            arr[k] = left_arr[i]
+            i += 1
+            k += 1
+        else:
+            arr[k] = right_arr[j]
+            j += 1
+            k += 1
+    if i < len(left_arr):
+        arr[k : k + len(left_arr) - i] = left_arr[i:]
+    if j < len(right_arr):
+        arr[k : k + len(right_arr) - j] = right_arr[j:]
+
+
+DISTRIBUTIONS: dict[str, Callable[[int], list]] = {
+    "random": lambda n: [random.random() for _ in range(n)],
+    "sorted": lambda n: list(range(n)),
+    "reversed": lambda n: list(range(n, 0, -1)),
+    "equal": lambda n: [0] * n,
+    "few-unique": lambda n: [random.randrange(8) for _ in range(n)],
+    "organ-pipe": lambda n: list(range(n // 2)) + list(range(n - n // 2, 0, -1)),
+    "sawtooth": lambda n: [i % 1000 for i in range(n)],
+    "nearly-sorted": lambda n: [i + random.randrange(10) for i in range(n)],
+}
+
+SORTS: dict[str, Callable[[list], None]] = {
+    "legacy": legacy_quicksort,
+    "quicksort": quicksort,
+    "legacy-merge": legacy_mergesort,
+    "mergesort": mergesort,
+    "list.sort": lambda arr: arr.sort(),
+}
+
+
+def bench_distributions(sizes: list[int], sorts: list[str]) -> None:
+    print("sorting n items, per item")
+    print(f"{'n':>9} {'distribution':>14} " + " ".join(f"{s:>12}" for s in sorts))
+    for n in sizes:
+        for name, make in DISTRIBUTIONS.items():
+            data = make(n)
+            row = []
+            for sort in sorts:
+                if sort == "legacy" and n > 2000:
+                    # quadratic and as deep as n on most inputs, it would take minutes
+                    row.append(f"{'-':>12}")
+                    continue
+                arr = list(data)
+                t0 = time.perf_counter()
+                try:
+                    SORTS[sort](arr)
+                except RecursionError:
+                    # the legacy sort reads right_index=-1 as the end of the list,
+                    # so a pivot that lands at index 0 restarts it on the whole list
+                    row.append(f"{'overflow':>12}")
+                    continue
+                t1 = time.perf_counter()
+                assert arr == sorted(data)
+                row.append(f"{(t1 - t0) / n * 1e9:>10.0f}ns")
+            print(f"{n:>9} {name:>14} " + " ".join(row))
+
+
+def bench_parallel(n: int, worker_counts: list[int]) -> None:
+    if np is None:
+        print("parallel sort needs numpy, skipped")
+        return
+    data = np.random.default_rng(0).random(n)
+    print(f"sorting {n} random float64, speedup over 1 process np.sort and mergesort")
+    t0 = time.perf_counter()
+    items = data.tolist()
+    mergesort(items)
+    merge_time = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    np.sort(data, kind="stable")
+    numpy_time = time.perf_counter() - t0
+    print(f"{'mergesort':>9} {merge_time:>9.3f}s")
+    print(f"{'np.sort':>9} {numpy_time:>9.3f}s")
+    print(f"{'workers':>9} {'time':>10} {'vs np.sort':>11} {'vs mergesort':>13}")
+    for workers in worker_counts:
+        with sort_pool(workers) as pool:
+            # start the workers outside of the timing
+            list(pool.map(abs, range(workers)))
+            t0 = time.perf_counter()
+            result = parallel_sort(data, workers, executor=pool, min_size=0)
+            t1 = time.perf_counter()
+        assert np.array_equal(result, np.sort(data))
+        print(
+            f"{workers:>9} {t1 - t0:>9.3f}s {numpy_time / (t1 - t0):>10.2f}x"
+            f" {merge_time / (t1 - t0):>12.1f}x"
+        )
+
+
+def bench_external(sizes: list[int], memory_budget: int, fan_in: int) -> None:
+    # the input is generated lazily and the output only counted, so the peak is what
+    # the sort itself holds, traced allocations run slower than untraced ones
+    print(
+        f"external sort of random float64 streams, {memory_budget >> 20}MiB budget,"
+        f" fan-in {fan_in}"
+    )
+    print(f"{'n':>10} {'time':>10} {'rate':>12} {'peak':>10}")
+    for n in sizes:
+        rng = random.Random(n)
+        stream = (rng.random() for _ in range(n))
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        count = 0
+        last = float("-inf")
+        for x in external_sort(stream, memory_budget=memory_budget, fan_in=fan_in):
+            assert last <= x
+            last = x
+            count += 1
+        t1 = time.perf_counter()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert count == n
+        print(
+            f"{n:>10} {t1 - t0:>9.2f}s {n / (t1 - t0) / 1e3:>10.0f}k/s"
+            f" {peak / (1 << 20):>8.1f}MiB"
+        )
+
+
+class Counted:
+    # wraps a key and counts the comparisons a sort makes, all of them use <
+    __slots__ = ("key",)
+    comparisons = 0
+
+    def __init__(self, key: Any) -> None:
+        self.key = key
+
+    def __lt__(self, other: "Counted") -> bool:
+        Counted.comparisons += 1
+        return self.key < other.key
+
+
+SUITE_SORTS: dict[str, Callable[[list], Any]] = {
+    "quicksort": quicksort,
+    "mergesort": mergesort,
+    "sorted": sorted,
+}
+
+
+def _measure(sort: Callable[[list], Any], data: list, repeat: int) -> dict[str, Any]:
+    # best wall time of repeat runs, each right after a run of sorted on the same
+    # data, relative is the time over the best sorted time, which cancels most of
+    # the speed of the machine and of slow phases of it
+    # then comparisons and peak traced memory in separate runs, so that neither the
+    # wrappers nor tracing skew the time
+    seconds = reference = float("inf")
+    for _ in range(repeat):
+        arr = list(data)
+        t0 = time.perf_counter()
+        sorted(arr)
+        t1 = time.perf_counter()
+        sort(arr)
+        t2 = time.perf_counter()
+        reference = min(reference, t1 - t0)
+        seconds = min(seconds, t2 - t1)
+
+    arr = [Counted(x) for x in data]
+    Counted.comparisons = 0
+    sort(arr)
+    comparisons = Counted.comparisons
+
+    arr = list(data)
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    sort(arr)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "seconds": seconds,
+        "relative": seconds / reference if reference else 1.0,
+        "comparisons": comparisons,
+        "peak_bytes": peak - base,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_suite(
+    sizes: list[int],
+    sorts: list[str],
+    repeat: int,
+    json_path: str,
+    baseline_path: str,
+    threshold: float,
+    fail_on_time: bool = False,
+) -> None:
+    # every sort on every distribution and size, optionally written to json_path and
+    # compared with the results in baseline_path
+    # a case that makes more comparisons is a regression and fails the run, counts
+    # are exact; a case of over 1ms whose time relative to sorted grew by more than
+    # threshold times is only reported as slower, unless fail_on_time is set, as
+    # wall times on a shared machine are too noisy to gate on by default
+    baseline = {}
+    if baseline_path:
+        with open(baseline_path) as f:
+            for r in json.load(f)["results"]:
+                baseline[(r["sort"], r["distribution"], r["n"])] = r
+
+    print(f"sort suite, best of {repeat} runs")
+    print(
+        f"{'n':>8} {'distribution':>14} {'sort':>10} {'time':>10} {'compares':>10}"
+        f" {'cmp/nlogn':>9} {'peak':>10}" + (f" {'vs base':>8}" if baseline else "")
+    )
+    results = []
+    regressions = []
+    slowdowns = []
+    for n in sizes:
+        for name, make in DISTRIBUTIONS.items():
+            # the same input for every run and commit
+            random.seed(f"{name}-{n}")
+            data = make(n)
+            for sort in sorts:
+                r = {"sort": sort, "distribution": name, "n": n}
+                r.update(_measure(SUITE_SORTS[sort], data, repeat))
+                results.append(r)
+                line = (
+                    f"{n:>8} {name:>14} {sort:>10} {r['seconds'] * 1e3:>8.2f}ms"
+                    f" {r['comparisons']:>10}"
+                    f" {r['comparisons'] / (n * max(1, n.bit_length() - 1)):>9.2f}"
+                    f" {r['peak_bytes'] / 1024:>8.0f}KB"
+                )
+                base = baseline.get((sort, name, n))
+                if base is not None:
+                    if "relative" in base:
+                        ratio = r["relative"] / base["relative"]
+                    else:
+                        ratio = r["seconds"] / base["seconds"]
+                    line += f" {ratio:>7.2f}x"
+                    # times of a few microseconds are mostly noise
+                    slower = ratio > threshold and base["seconds"] > 1e-3
+                    if r["comparisons"] > base["comparisons"]:
+                        regressions.append(r)
+                        line += " REGRESSION"
+                    elif slower:
+                        slowdowns.append(r)
+                        line += " SLOWER"
+                        if fail_on_time:
+                            regressions.append(r)
+                print(line)
+
+    if json_path:
+        meta = {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat": repeat,
+        }
+        with open(json_path, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=1)
+        print(f"results written to {json_path}")
+    if slowdowns:
+        print(f"{len(slowdowns)} cases slower than {baseline_path}, check with a rerun")
+    if regressions:
+        print(f"{len(regressions)} regressions against {baseline_path}")
+        sys.exit(1)
+
+
+BENCHES = {
+    "distributions": lambda args: bench_distributions(args.sizes, args.sorts),
+    "parallel": lambda args: bench_parallel(args.parallel_n, args.workers),
+    "suite": lambda args: bench_suite(
+        args.suite_sizes,
+        args.suite_sorts,
+        args.repeat,
+        args.json,
+        args.baseline,
+        args.threshold,
+        args.fail_on_time,
+    ),
+    "external": lambda args: bench_external(
+        args.external_sizes, args.memory_budget << 20, args.fan_in
+    ),
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="sorting benchmarks")
+    parser.add_argument(
+        "bench", nargs="*", help=f"any of {sorted(BENCHES)}, default: all"
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100_000])
+    parser.add_argument("--sorts", nargs="+", default=list(SORTS))
+    parser.add_argument("--parallel-n", type=int, default=4_000_000)
+    parser.add_argument(
+        "--memory-budget", type=int, default=16, help="external sort budget in MiB"
+    )
+    parser.add_argument("--fan-in", type=int, default=64)
+    parser.add_argument(
+        "--external-sizes", type=int, nargs="+", default=[10**5, 10**6, 10**7]
+    )
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument(
+        "--suite-sizes",
+        type=int,
+        nargs="+",
+        default=[10**2, 10**3, 10**4, 10**5, 10**6],
+    )
+    parser.add_argument("--suite-sorts", nargs="+", default=list(SUITE_SORTS))
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case")
+    parser.add_argument("--json", default="", help="write the suite results here")
+    parser.add_argument("--baseline", default="", help="compare the suite with this")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.5,
+        help="slowdown relative to sorted that counts as slower",
+    )
+    parser.add_argument(
+        "--fail-on-time",
+        action="store_true",
+        help="fail on slower cases too, not only on more comparisons",
+    )
+    args = parser.parse_args()
+    for name in args.bench:
+        if name not in BENCHES:
+            parser.error(f"unknown benchmark {name!r}")
+    # the legacy sort recurses once per item on sorted input
+    sys.setrecursionlimit(10_000)
+    random.seed(0)
+    for name in args.bench or sorted(BENCHES):
+        BENCHES[name](args)
@@ -1,4 +1,5 @@
 from typing import Any, Optional, TypeVar, Iterator
+import pytest
 
 TK = TypeVar("TK", int, str)
 
@@ -13,63 +14,218 @@ class BinarySearchTreeNode:
 
 
 class BinarySearchTree:
+    node_class = BinarySearchTreeNode
+
     def __init__(self) -> None:
         self.root: Optional[BinarySearchTreeNode] = None
 
     def insert(self, key: TK, data: Any) -> BinarySearchTreeNode:
-        node = BinarySearchTreeNode(key, data)
+        # insert a new node or update the data of an existing key, return the node
+        # that holds the key
         if self.root is None:
-            self.root = node
-            return node
+            self.root = self.node_class(key, data)
+            return self.root
 
         assert type(key) is type(self.root.key), f"{type(key)=} {type(self.root.key)=}"
         assert type(data) is type(
             self.root.data
         ), f"{type(data)=} {type(self.root.data)=}"
-        self._insert(self.root, node)
-        return node
 
-    def _insert(self, root: BinarySearchTreeNode, new: BinarySearchTreeNode) -> None:
-        if root.key == new.key:
-            root.data = new.data
-            return
-
-        if new.key < root.key:  # type: ignore[operator]
-            if root.left:
-                self._insert(root.left, new)
-            else:
-                root.left = new
-        elif new.key > root.key:  # type: ignore[operator]
-            if root.right:
-                self._insert(root.right, new)
+        # walk down without recursion, the new node becomes a leaf
+        parent = self.root
+        while True:
+            if key == parent.key:
+                parent.data = data
+                return parent
+            if key < parent.key:  # type: ignore[operator]
+                if parent.left is None:
+                    node = parent.left = self.node_class(key, data)
+                    break
+                parent = parent.left
             else:
-                root.right = new
+                if parent.right is None:
+                    node = parent.right = self.node_class(key, data)
+                    break
+                parent = parent.right
+        node.parent = parent
+        self._inserted(node)
+        return node
+
+    def _inserted(self, node: BinarySearchTreeNode) -> None:
+        # called after a new leaf is linked in, subclasses rebalance here
+        pass
 
     def search(self, key: TK) -> Optional[BinarySearchTreeNode]:
-        return self._search(self.root, key)
+        node = self.root
+        while node is not None:
+            if node.key == key:
+                return node
+            node = node.left if key < node.key else node.right  # type: ignore[operator]
+        return None
 
-    def _search(
-        self, root: Optional[BinarySearchTreeNode], key: TK
-    ) -> Optional[BinarySearchTreeNode]:
-        if root is None:
-            return None
-        if root.key == key:
-            return root
-        if key < root.key:  # type: ignore[operator]
-            return self._search(root.left, key)
-        return self._search(root.right, key)
+    def min(self) -> Optional[BinarySearchTreeNode]:
+        return self._first(self.root)
+
+    def max(self) -> Optional[BinarySearchTreeNode]:
+        node = self.root
+        if node is not None:
+            while node.right is not None:
+                node = node.right
+        return node
+
+    def successor(self, key: TK) -> Optional[BinarySearchTreeNode]:
+        # the node with the smallest key above key, key does not have to be in the tree
+        result = None
+        node = self.root
+        while node is not None:
+            if key < node.key:  # type: ignore[operator]
+                result = node
+                node = node.left
+            else:
+                node = node.right
+        return result
+
+    def predecessor(self, key: TK) -> Optional[BinarySearchTreeNode]:
+        # the node with the largest key below key, key does not have to be in the tree
+        result = None
+        node = self.root
+        while node is not None:
+            if node.key < key:  # type: ignore[operator]
+                result = node
+                node = node.right
+            else:
+                node = node.left
+        return result
 
     def inorder(self) -> Iterator[BinarySearchTreeNode]:
-        for node in self._inorder(self.root):
+        # the tree must not be modified while the iteration is in progress
+        node = self._first(self.root)
+        while node is not None:
             yield node
+            node = self._next(node)
 
-    def _inorder(self, node) -> Iterator[BinarySearchTreeNode]:
-        if node is not None:
-            for n in self._inorder(node.left):
-                yield n
+    def range(
+        self, lo: Optional[TK] = None, hi: Optional[TK] = None
+    ) -> Iterator[BinarySearchTreeNode]:
+        # lazily yield the nodes with lo <= key < hi in key order, None is unbounded
+        # the tree is descended once to lo, then walked along the parent links, so
+        # k nodes cost O(height + k) and no stack is kept
+        # the tree must not be modified while the iteration is in progress
+        if lo is None:
+            node = self._first(self.root)
+        else:
+            # the first node with a key not below lo
+            node = None
+            n = self.root
+            while n is not None:
+                if n.key < lo:  # type: ignore[operator]
+                    n = n.right
+                else:
+                    node = n
+                    n = n.left
+        while node is not None and (hi is None or node.key < hi):  # type: ignore[operator]
             yield node
-            for n in self._inorder(node.right):
-                yield n
+            node = self._next(node)
+
+    def _first(
+        self, node: Optional[BinarySearchTreeNode]
+    ) -> Optional[BinarySearchTreeNode]:
+        # the leftmost node of a subtree
+        if node is not None:
+            while node.left is not None:
+                node = node.left
+        return node
+
+    def _next(self, node: BinarySearchTreeNode) -> Optional[BinarySearchTreeNode]:
+        # the node after node in key order, the leftmost node of the right subtree,
+        # or else the first ancestor reached from a left subtree
+        if node.right is not None:
+            return self._first(node.right)
+        parent = node.parent
+        while parent is not None and node is parent.right:
+            node = parent
+            parent = node.parent
+        return parent
+
+
+class AVLTreeNode(BinarySearchTreeNode):
+    def __init__(self, key: TK, data: Any):
+        super().__init__(key, data)
+        # height of the subtree rooted here, a leaf has height 1
+        self.height: int = 1
+
+
+def _height(node: Optional[AVLTreeNode]) -> int:
+    return node.height if node is not None else 0
+
+
+class AVLTree(BinarySearchTree):
+    # a self-balancing BinarySearchTree, the heights of the two subtrees of every
+    # node differ by at most 1, so the tree is never taller than 1.44 log2(n)
+    node_class = AVLTreeNode
+
+    def _inserted(self, node: BinarySearchTreeNode) -> None:
+        self._rebalance(node.parent)
+
+    def _rebalance(self, node: Optional[AVLTreeNode]) -> None:
+        # walk up from node, fixing heights and rotating where a node is out of
+        # balance, until a height does not change
+        while node is not None:
+            balance = _height(node.left) - _height(node.right)
+            if balance > 1:
+                if _height(node.left.left) < _height(node.left.right):
+                    self._rotate_left(node.left)
+                node = self._rotate_right(node)
+            elif balance < -1:
+                if _height(node.right.right) < _height(node.right.left):
+                    self._rotate_right(node.right)
+                node = self._rotate_left(node)
+            else:
+                height = 1 + max(_height(node.left), _height(node.right))
+                if height == node.height:
+                    break
+                node.height = height
+            node = node.parent
+
+    def _replace_child(
+        self,
+        parent: Optional[BinarySearchTreeNode],
+        old: BinarySearchTreeNode,
+        new: BinarySearchTreeNode,
+    ) -> None:
+        new.parent = parent
+        if parent is None:
+            self.root = new
+        elif parent.left is old:
+            parent.left = new
+        else:
+            parent.right = new
+
+    def _rotate_left(self, node: AVLTreeNode) -> AVLTreeNode:
+        # the right child takes the place of node, return it
+        child = node.right
+        self._replace_child(node.parent, node, child)
+        node.right = child.left
+        if child.left is not None:
+            child.left.parent = node
+        child.left = node
+        node.parent = child
+        node.height = 1 + max(_height(node.left), _height(node.right))
+        child.height = 1 + max(_height(child.left), _height(child.right))
+        return child
+
+    def _rotate_right(self, node: AVLTreeNode) -> AVLTreeNode:
+        # the left child takes the place of node, return it
+        child = node.left
+        self._replace_child(node.parent, node, child)
+        node.left = child.right
+        if child.right is not None:
+            child.right.parent = node
+        child.right = node
+        node.parent = child
+        node.height = 1 + max(_height(node.left), _height(node.right))
+        child.height = 1 + max(_height(child.left), _height(child.right))
+        return child
 
 
 def test_basic():
@@ -89,3 +245,99 @@ def test_basic():
 
     keys = [n.key for n in bst.inorder()]
     assert keys == [2, 5, 10, 15]
+
+    assert bst.root.parent is None
+    assert bst.root.left.parent is bst.root
+    assert bst.root.left.left.parent is bst.root.left
+
+    # inserting an existing key updates it in place
+    node = bst.insert(5, None)
+    assert node is bst.root.left
+
+
+def test_ordered_queries():
+    import bisect
+    import random
+
+    # sorted keys make a degenerate tree, taller than the recursion limit
+    for keys in [list(range(0, 4000, 2)), random.sample(range(4000), 2000)]:
+        bst = BinarySearchTree()
+        for k in keys:
+            bst.insert(k, k)
+        ordered = sorted(keys)
+        assert [n.key for n in bst.inorder()] == ordered
+        assert bst.min().key == ordered[0]
+        assert bst.max().key == ordered[-1]
+        assert bst.search(keys[-1]).key == keys[-1]
+
+        for _ in range(200):
+            lo, hi = sorted(random.randrange(-10, 4010) for _ in range(2))
+            i = bisect.bisect_left(ordered, lo)
+            j = bisect.bisect_left(ordered, hi)
+            assert [n.key for n in bst.range(lo, hi)] == ordered[i:j]
+            assert [n.key for n in bst.range(None, hi)] == ordered[:j]
+            assert [n.key for n in bst.range(lo)] == ordered[i:]
+
+            k = random.randrange(-10, 4010)
+            i = bisect.bisect_right(ordered, k)
+            succ = bst.successor(k)
+            assert (succ.key if succ else None) == (
+                ordered[i] if i < len(ordered) else None
+            )
+            i = bisect.bisect_left(ordered, k)
+            pred = bst.predecessor(k)
+            assert (pred.key if pred else None) == (ordered[i - 1] if i > 0 else None)
+
+    empty = BinarySearchTree()
+    assert empty.min() is None and empty.max() is None
+    assert list(empty.inorder()) == list(empty.range(0, 10)) == []
+    assert empty.successor(0) is None and empty.predecessor(0) is None
+
+
+def _check_avl(tree: AVLTree) -> int:
+    # check order, parent links, heights and balance, return the height
+    def check(node, lo, hi) -> int:
+        if node is None:
+            return 0
+        assert lo is None or lo < node.key
+        assert hi is None or node.key < hi
+        for child in [node.left, node.right]:
+            if child is not None:
+                assert child.parent is node
+        lh = check(node.left, lo, node.key)
+        rh = check(node.right, node.key, hi)
+        assert abs(lh - rh) <= 1
+        assert node.height == 1 + max(lh, rh)
+        return node.height
+
+    assert tree.root is None or tree.root.parent is None
+    return check(tree.root, None, None)
+
+
+def test_avl():
+    import math
+    import random
+
+    n = 5000
+    for keys in [
+        list(range(n)),
+        list(range(n, 0, -1)),
+        random.sample(range(n * 10), n),
+    ]:
+        tree = AVLTree()
+        for k in keys:
+            tree.insert(k, str(k))
+        height = _check_avl(tree)
+        assert height <= 1.44 * math.log2(n + 2)
+        assert [node.key for node in tree.inorder()] == sorted(keys)
+        for k in keys:
+            assert tree.search(k).data == str(k)
+        assert tree.search(-1) is None
+
+    # inserting an existing key updates it in place
+    node = tree.insert(keys[0], "x")
+    assert node is tree.search(keys[0]) and node.data == "x"
+    _check_avl(tree)
+
+    with pytest.raises(AssertionError):
+        tree.insert("a", "a")
@@ -1,164 +1,850 @@
 from __future__ import annotations
 
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
 from math import inf
-from typing import Any, Optional
+from typing import Any, Iterable, Iterator, Optional
+import mmap
+import os
+import pickle
+import struct
 import sys
 
-from sortedcontainers import SortedList
 import pytest
-from loguru import logger
+
+# search_many pushes a batch down the tree together only when it has at least this
+# many keys per leaf, sparser batches share too few nodes to pay for the sort
+SEARCH_MANY_DENSITY = 1.0
 
 
 class BTreeNode:
+    __slots__ = ("order", "is_leaf", "keys", "values", "children", "next")
+
     def __init__(self, order: int, is_leaf: bool) -> None:
         self.order = order
         self.is_leaf = is_leaf
 
-        self.keys: SortedList[float] = SortedList()
-        self.values: dict[float, Any] = {}
-        self.children: dict[float, Optional[BTreeNode]] = {}
-
-        self.add(inf, None, None)
+        # keys are kept sorted and values are parallel to keys
+        # children are positional: children[i] holds the keys in (keys[i-1], keys[i])
+        # so a non-leaf node with n keys has n+1 children, and a leaf has none
+        self.keys: list[float] = []
+        self.values: list[Any] = []
+        self.children: list[BTreeNode] = []
+        # right sibling of a leaf, only linked in leaf-linked mode
+        self.next: Optional[BTreeNode] = None
 
     def __repr__(self):
         ls = self.repr()
         return "\n".join(ls)
 
     def repr(self, level: int = 0) -> list[str]:
-        logger.trace(f"{self.keys=} {self.values.keys()=} {self.children.keys()=}")
         s = "    " * level + f" {level=}"
         s += " keys=(" + ", ".join([str(k) for k in self.keys]) + ")"
-        s += " values=(" + ", ".join([str(self.values[k]) for k in self.keys]) + ")"
+        s += " values=(" + ", ".join([str(v) for v in self.values]) + ")"
         s += " leaf" if self.is_leaf else ""
-        s += " full" if len(self.keys) == 2 * self.order else ""
+        s += " full" if self.is_full() else ""
 
         result = [s]
-        for key in self.keys:
-            child = self.children[key]
-            if child is not None:
-                result += child.repr(level=level + 1)
+        for child in self.children:
+            result += child.repr(level=level + 1)
         return result
 
     def is_full(self) -> bool:
-        return len(self.keys) == self.order * 2
+        return len(self.keys) == self.order * 2 - 1
 
     def has(self, key: float) -> bool:
-        return key in self.keys
+        i = bisect_left(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
 
-    def add(self, key: float, value: Any, child: Optional[BTreeNode]) -> None:
-        assert not self.has(key)
-        self.keys.add(key)
-        self.values[key] = value
-        self.children[key] = child
+    def copy(self) -> BTreeNode:
+        # a shallow copy, the children are shared with the original
+        node = BTreeNode(self.order, self.is_leaf)
+        node.keys = self.keys[:]
+        node.values = self.values[:]
+        node.children = self.children[:]
+        node.next = self.next
+        return node
 
-    def update(self, key: float, value: Any, child: Optional[BTreeNode]) -> None:
-        assert self.has(key)
-        self.values[key] = value
-        self.children[key] = child
+    def split(self, copy_up: bool = False) -> tuple[float, Any, BTreeNode]:
+        # split a full node around its middle key
+        # the smaller half stays, the larger half goes to the returned new node,
+        # and the middle key and value are returned to be inserted into the parent
+        # with copy_up (leaves in leaf-linked mode) the middle entry stays in the new
+        # node and only a copy of its key goes up as separator
+        assert self.is_full()
+        mid_index = self.order - 1
+        key = self.keys[mid_index]
+        value = None if copy_up else self.values[mid_index]
 
-    def pop(self, key: float) -> tuple[Any, Optional[BTreeNode]]:
-        v = self.values[key]
-        c = self.children[key]
-        self.keys.remove(key)
-        del self.values[key]
-        del self.children[key]
-        return (v, c)
+        right = BTreeNode(self.order, self.is_leaf)
+        start = mid_index if copy_up else mid_index + 1
+        right.keys = self.keys[start:]
+        right.values = self.values[start:]
+        del self.keys[mid_index:]
+        del self.values[mid_index:]
+        if not self.is_leaf:
+            right.children = self.children[mid_index + 1 :]
+            del self.children[mid_index + 1 :]
+        return key, value, right
 
 
 class BTree:
-    def __init__(self, order: int):
+    def __init__(
+        self, order: int, leaf_linked: bool = False, copy_on_write: bool = False
+    ):
         assert order > 0, f"{order=}"
+        # leaf-linked (B+-tree) mode keeps all entries in the leaves and chains the
+        # leaves left to right, internal nodes only hold copies of keys as separators
+        assert (
+            not leaf_linked or order > 1
+        ), f"leaf-linked mode needs order > 1, {order=}"
+        # copy-on-write mode never changes a node reachable from the published root,
+        # an insert copies its root-to-leaf path and then swaps in the new root,
+        # so readers and snapshots need no lock while a single writer inserts
+        # (leaf links would have to be copied all the way along the leaf chain)
+        assert not (
+            leaf_linked and copy_on_write
+        ), "copy-on-write does not support leaf-linked mode"
         self.order: int = order
+        self.leaf_linked: bool = leaf_linked
+        self.copy_on_write: bool = copy_on_write
         self.root: BTreeNode = BTreeNode(self.order, True)
 
     def __repr__(self) -> str:
         ls = self.root.repr(0)
         return "\n".join(ls)
 
-    def insert(self, key: int, data: Any):
-        logger.trace(f"{key=} {data=}")
-        if self.root.is_full():
-            # grow the root
+    def snapshot(self) -> BTreeSnapshot:
+        assert self.copy_on_write, "snapshots need copy-on-write mode"
+        return BTreeSnapshot(self)
+
+    def insert(self, key: float, data: Any) -> None:
+        root = self.root
+        if self.copy_on_write:
+            root = root.copy()
+        if root.is_full():
+            # grow the root, then split the old root under it
             t = BTreeNode(self.order, False)
-            t.children[inf] = self.root
-            self.root = t
-            # split the node
-            self._split_child(self.root, inf)
-            # insert again
-            self._insert_not_full(self.root, key, data)
-        else:
-            self._insert_not_full(self.root, key, data)
+            t.children.append(root)
+            root = t
+            self._split_child(root, 0)
+        self._insert_not_full(root, key, data)
+        # publishing the new root is a single reference swap
+        self.root = root
 
-    def _insert_not_full(self, node: BTreeNode, key: int, value: Any) -> None:
-        if node.is_leaf:
-            # for leaf node, each key is corresponding to one data entry
-            # to add a new data entry, we need to add a new key
-            if node.has(key):
-                return node.update(key, value, None)
-            return node.add(key, value, None)
-        else:
-            # for none-leaf node, find if the key is matching its own
-            if node.has(key):
-                return node.update(key, value, None)
-            # if not its own, key then find the right child to insert
+    def _insert_not_full(self, node: BTreeNode, key: float, value: Any) -> None:
+        leaf_linked = self.leaf_linked
+        while True:
+            keys = node.keys
+            if leaf_linked and not node.is_leaf:
+                # separators are copies, a key equal to one lives in the right subtree
+                i = bisect_right(keys, key)
+            else:
+                i = bisect_left(keys, key)
+                if i < len(keys) and keys[i] == key:
+                    # the key is already stored in this node, update its value
+                    node.values[i] = value
+                    return
+                if node.is_leaf:
+                    # for leaf node, each key is corresponding to one data entry
+                    keys.insert(i, key)
+                    node.values.insert(i, value)
+                    return
             # e.g. if it has 3 keys [k0, k1, k2] (k0 < k1 < k2)
             # its children's range shall be (-inf, k0), (k0, k1), (k1, k2), (k2, +inf)
-            for k in node.keys:
-                if key < k:
-                    break
-            child = node.children[k]
-            assert child is not None
+            # and bisect gives the index of the child to descend into
+            child = node.children[i]
+            if self.copy_on_write:
+                # the path is private to this insert from the root down
+                child = node.children[i] = child.copy()
             if child.is_full():
-                # split it first, then retry the insertion
-                self._split_child(node, k)
-                return self._insert_not_full(node, key, value)
-            return self._insert_not_full(child, key, value)
-
-    def _split_child(self, root: BTreeNode, key: float) -> None:
-        logger.trace(f"{key=} root=\n{repr(root)}")
-        assert not root.is_full()
-        assert root.has(key)
-        child = root.children[key]
-        assert child is not None
-        assert child.is_full()
+                # split it first, the middle key is pulled up to keys[i]
+                self._split_child(node, i)
+                if not leaf_linked and keys[i] == key:
+                    node.values[i] = value
+                    return
+                child = node.children[i] if key < keys[i] else node.children[i + 1]
+            node = child
 
-        mid_index = self.order - 1
-        new_child = BTreeNode(self.order, child.is_leaf)
-        keys = [k for k in child.keys]
-        for i, k in enumerate(keys):
-            if i < mid_index:
-                v, c = child.pop(k)
-                # smaller keys goes to new child node
-                new_child.add(k, v, c)
-            elif i == mid_index:
-                v, c = child.pop(k)
-                # the middle child goes to new child node, but with inf key
-                # the middle value goes to root
-                # and insert new child to root's children with the middle key
-                new_child.update(inf, None, c)
-                root.add(k, v, new_child)
+    def _split_child(self, node: BTreeNode, index: int) -> None:
+        assert not node.is_full()
+        child = node.children[index]
+        if self.leaf_linked and child.is_leaf:
+            key, value, right = child.split(copy_up=True)
+            right.next = child.next
+            child.next = right
+        else:
+            key, value, right = child.split()
+        node.keys.insert(index, key)
+        node.values.insert(index, value)
+        node.children.insert(index + 1, right)
+
+    def search_many(self, keys: Iterable[float]) -> list[Any]:
+        # look up a batch of keys, the values come back in the order of the keys
+        # with None for missing ones, like search does
+        # the batch is sorted once and pushed down the tree together, split at the
+        # separators of every node, so each node is visited at most once per batch
+        keys = list(keys)
+        # the leaves are counted along the leftmost path, an estimate in O(height)
+        leaves = 1
+        node = self.root
+        while not node.is_leaf:
+            leaves *= len(node.children)
+            node = node.children[0]
+        if len(keys) < SEARCH_MANY_DENSITY * leaves:
+            root = self.root
+            return [self._search(root, k) for k in keys]
+
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        batch = [keys[i] for i in order]
+        result: list[Any] = [None] * len(keys)
+
+        # each entry is a node and the slice batch[lo:hi] of keys under it
+        stack = [(self.root, 0, len(batch))] if batch else []
+        while stack:
+            node, lo, hi = stack.pop()
+            if hi - lo == 1:
+                # a lone key, finish it with a plain descent from here
+                result[order[lo]] = self._search(node, batch[lo])
+                continue
+            node_keys = node.keys
+            values = node.values
+            n = len(node_keys)
+
+            if node.is_leaf:
+                # the batch is sorted, so each bisect can start where the last one ended
+                i = 0
+                for j in range(lo, hi):
+                    key = batch[j]
+                    i = bisect_left(node_keys, key, i)
+                    if i < n and node_keys[i] == key:
+                        result[order[j]] = values[i]
+                continue
+
+            # in leaf-linked mode internal nodes only route, entries are in the leaves
+            routing = self.leaf_linked
+            children = node.children
+            j = lo
+            while j < hi:
+                key = batch[j]
+                if routing:
+                    i = bisect_right(node_keys, key)
+                else:
+                    i = bisect_left(node_keys, key)
+                    if i < n and node_keys[i] == key:
+                        result[order[j]] = values[i]
+                        j += 1
+                        continue
+                # all keys of the batch below the next separator go to the same child
+                end = hi if i == n else bisect_left(batch, node_keys[i], j, hi)
+                stack.append((children[i], j, end))
+                j = end
+        return result
+
+    def bulk_load(
+        self, pairs: Iterable[tuple[float, Any]], fill_factor: float = 1.0
+    ) -> None:
+        # build the tree bottom-up from (key, value) pairs sorted by strictly increasing key
+        # only the rightmost node of every level is kept open, so the input is consumed
+        # as a stream; fill_factor is the share of the max keys put into each node,
+        # but never less than the minimum occupancy of a B-tree node
+        assert 0 < fill_factor <= 1, f"{fill_factor=}"
+        assert self.root.is_leaf and not self.root.keys, "bulk_load needs an empty tree"
+        max_keys = 2 * self.order - 1
+        cap = max(1, self.order - 1, int(fill_factor * max_keys))
+
+        # spine[h] is the open node at height h, spine[0] is the current leaf
+        spine = [BTreeNode(self.order, True)]
+        first = True
+        last = None
+        for key, value in pairs:
+            assert (
+                first or last < key
+            ), f"keys must be strictly increasing, {last=} {key=}"
+            first = False
+            last = key
+            leaf = spine[0]
+            if len(leaf.keys) < cap:
+                leaf.keys.append(key)
+                leaf.values.append(value)
+            elif self.leaf_linked:
+                # the leaf is packed, the key starts a new leaf and a copy goes up
+                right = BTreeNode(self.order, True)
+                right.keys.append(key)
+                right.values.append(value)
+                leaf.next = right
+                self._bulk_push(spine, cap, key, None, right)
             else:
-                # the larger keys stays
-                break
-        logger.trace(f"root=\n{repr(root)}")
+                # the leaf is packed, the key goes up as a separator before a new leaf
+                self._bulk_push(spine, cap, key, value, BTreeNode(self.order, True))
+
+        self._bulk_fix_spine(spine)
+        self.root = spine[-1]
+
+    def _bulk_push(
+        self, spine: list[BTreeNode], cap: int, key: float, value: Any, right: BTreeNode
+    ) -> None:
+        # add a separator at height 1 with the new node right after it at height 0,
+        # a packed node moves the separator one level up and opens a new node instead
+        h = 1
+        while True:
+            if h == len(spine):
+                # grow a new root above the open node
+                root = BTreeNode(self.order, False)
+                root.children.append(spine[h - 1])
+                spine.append(root)
+            node = spine[h]
+            spine[h - 1] = right
+            if len(node.keys) < cap:
+                node.keys.append(key)
+                node.values.append(value)
+                node.children.append(right)
+                return
+            new = BTreeNode(self.order, False)
+            new.children.append(right)
+            right = new
+            h += 1
+
+    def _bulk_fix_spine(self, spine: list[BTreeNode]) -> None:
+        # the open nodes on the right edge can be under-filled when the stream ends,
+        # top-down, each of them borrows from or merges with its left sibling
+        min_keys = self.order - 1
+        h = len(spine) - 2
+        while h >= 0:
+            node = spine[h]
+            parent = spine[h + 1]
+            if len(node.keys) >= min_keys:
+                h -= 1
+                continue
+
+            left = parent.children[-2]
+            if self._bulk_rebalance(parent, left, node):
+                h -= 1
+                continue
+
+            # node was merged into left, which is now the open node at this height
+            spine[h] = left
+            if h + 1 < len(spine) - 1:
+                # re-check the parent, it lost a separator
+                h += 1
+            else:
+                if not parent.keys:
+                    # the root ran out of keys, its only child becomes the root
+                    spine.pop()
+                h -= 1
+
+    def _bulk_rebalance(
+        self, parent: BTreeNode, left: BTreeNode, node: BTreeNode
+    ) -> bool:
+        # even out node with its left sibling, both being the last two children of parent
+        # return True if they were redistributed, or False if node was merged into left
+        min_keys = self.order - 1
+        if self.leaf_linked and node.is_leaf:
+            # leaves own all entries, the separator in parent is only a copy of a key
+            keys = left.keys + node.keys
+            values = left.values + node.values
+            if len(keys) >= 2 * min_keys:
+                mid = len(keys) // 2
+                left.keys, node.keys = keys[:mid], keys[mid:]
+                left.values, node.values = values[:mid], values[mid:]
+                parent.keys[-1] = node.keys[0]
+                return True
+            left.next = node.next
+        else:
+            keys = left.keys + [parent.keys[-1]] + node.keys
+            values = left.values + [parent.values[-1]] + node.values
+            children = left.children + node.children
+            if len(keys) >= 2 * min_keys + 1:
+                # enough keys for two nodes, redistribute around a new separator
+                mid = len(keys) // 2
+                left.keys, node.keys = keys[:mid], keys[mid + 1 :]
+                left.values, node.values = values[:mid], values[mid + 1 :]
+                parent.keys[-1], parent.values[-1] = keys[mid], values[mid]
+                if not node.is_leaf:
+                    left.children, node.children = (
+                        children[: mid + 1],
+                        children[mid + 1 :],
+                    )
+                return True
+            left.children = children
+
+        # merge into the left sibling, the parent loses its last separator
+        left.keys, left.values = keys, values
+        parent.keys.pop()
+        parent.values.pop()
+        parent.children.pop()
+        return False
 
     def search(self, key: float) -> Any:
-        node = self._search(self.root, key)
-        if node is not None:
-            return node.values[key]
-        return None
+        return self._search(self.root, key)
 
-    def _search(self, node: BTreeNode, key: float) -> Optional[BTreeNode]:
-        if node.has(key):
-            return node
-        if node.is_leaf:
+    def _search(self, node: BTreeNode, key: float) -> Any:
+        # look up key in the subtree under node
+        if self.leaf_linked:
+            while not node.is_leaf:
+                node = node.children[bisect_right(node.keys, key)]
+            i = bisect_left(node.keys, key)
+            if i < len(node.keys) and node.keys[i] == key:
+                return node.values[i]
             return None
-        for k in node.keys:
-            if key < k:
+        while True:
+            keys = node.keys
+            i = bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                return node.values[i]
+            if node.is_leaf:
+                return None
+            node = node.children[i]
+
+    def items(self) -> Iterator[tuple[float, Any]]:
+        return self.range(None, None)
+
+    def range(
+        self, lo: Optional[float] = None, hi: Optional[float] = None
+    ) -> Iterator[tuple[float, Any]]:
+        # lazily yield (key, value) for lo <= key < hi in key order, None is unbounded
+        # the tree is descended once to lo, then walked with a stack of O(height)
+        # the tree must not be modified while the iteration is in progress
+        if self.leaf_linked:
+            yield from self._range_linked(lo, hi)
+            return
+
+        stack: list[tuple[BTreeNode, int]] = []
+        node = self.root
+        while True:
+            i = 0 if lo is None else bisect_left(node.keys, lo)
+            if node.is_leaf:
                 break
-        child = node.children[k]
-        assert child is not None
-        return self._search(child, key)
+            stack.append((node, i))
+            node = node.children[i]
+
+        while True:
+            keys = node.keys
+            end = len(keys) if hi is None else bisect_left(keys, hi, i)
+            yield from zip(keys[i:end], node.values[i:end])
+            if end < len(keys):
+                return
+
+            # climb up to the next separator on the right
+            while stack:
+                node, i = stack.pop()
+                if i < len(node.keys):
+                    break
+            else:
+                return
+            key = node.keys[i]
+            if hi is not None and not key < hi:
+                return
+            yield key, node.values[i]
+
+            # then walk down to the leftmost leaf right of the separator
+            stack.append((node, i + 1))
+            node = node.children[i + 1]
+            while not node.is_leaf:
+                stack.append((node, 0))
+                node = node.children[0]
+            i = 0
+
+    def _range_linked(
+        self, lo: Optional[float], hi: Optional[float]
+    ) -> Iterator[tuple[float, Any]]:
+        node = self.root
+        while not node.is_leaf:
+            node = node.children[0 if lo is None else bisect_right(node.keys, lo)]
+        i = 0 if lo is None else bisect_left(node.keys, lo)
+
+        # a sequential walk over the chained leaves
+        while node is not None:
+            keys = node.keys
+            end = len(keys) if hi is None else bisect_left(keys, hi, i)
+            yield from zip(keys[i:end], node.values[i:end])
+            if end < len(keys):
+                return
+            node = node.next
+            i = 0
+
+
+class BTreeSnapshot(BTree):
+    # a read-only view of a copy-on-write BTree as it was when the snapshot was taken
+    # it shares all nodes with the tree, so taking one costs O(1)
+    def __init__(self, tree: BTree) -> None:
+        self.order = tree.order
+        self.leaf_linked = tree.leaf_linked
+        self.copy_on_write = True
+        self.root = tree.root
+
+    def insert(self, key: float, data: Any) -> None:
+        raise RuntimeError("BTree snapshot is read-only")
+
+    def bulk_load(
+        self, pairs: Iterable[tuple[float, Any]], fill_factor: float = 1.0
+    ) -> None:
+        raise RuntimeError("BTree snapshot is read-only")
+
+
+class BTreePager:
+    # fixed-size pages of a file, read through mmap and kept decoded in an LRU cache
+    # page 0 is the header, every other page holds one node whose children and next
+    # are page ids instead of objects (0 for no page)
+    # keys are stored as int64 if all keys of the node are ints, otherwise as float64,
+    # values are pickled, a node has to fit in a page
+    MAGIC = b"BTREEPG1"
+    HEADER = struct.Struct(
+        "<8sIIIIBB"
+    )  # magic page_size order root page_count leaf_linked key_kinds
+    NODE = struct.Struct("<BBHI")  # is_leaf, key type, number of keys, next
+    KEY_TYPES = "dq"  # float64, int64; files from before the key type read as float64
+    # key_kinds bits, float keys and int keys that are not exact as float64 must not
+    # meet in one node, so they are not allowed in one tree
+    FLOAT_KEYS = 1
+    INEXACT_INT_KEYS = 2
+
+    def __init__(self, path: str, page_size: int, cache_pages: int) -> None:
+        assert cache_pages >= 2, f"{cache_pages=}"
+        self.path = path
+        self.page_size = page_size
+        self.cache_pages = cache_pages
+        self.file = open(path, "r+b" if os.path.exists(path) else "w+b")
+        if os.fstat(self.file.fileno()).st_size == 0:
+            self.file.truncate(page_size)
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+
+        # written into the header page on flush
+        self.order = 0
+        self.root = 0
+        self.page_count = 1
+        self.leaf_linked = False
+        self.key_kinds = 0
+
+        self.cache: OrderedDict[int, BTreeNode] = OrderedDict()
+        self.dirty: set[int] = set()
+        self.hits = 0
+        self.faults = 0
+        self.evictions = 0
+        self.writebacks = 0
+
+    def read_header(self) -> None:
+        # the page size of the file wins over the one the pager was opened with
+        magic, page_size, order, root, page_count, leaf_linked, key_kinds = (
+            self.HEADER.unpack_from(self.mm, 0)
+        )
+        assert magic == self.MAGIC, f"{self.path} is not a B-tree page file"
+        self.page_size = page_size
+        self.order, self.root, self.page_count = order, root, page_count
+        self.leaf_linked = bool(leaf_linked)
+        self.key_kinds = key_kinds
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.faults
+        return {
+            "hits": self.hits,
+            "faults": self.faults,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "writebacks": self.writebacks,
+            "pages": self.page_count,
+        }
+
+    def get(self, pid: int) -> BTreeNode:
+        node = self.cache.get(pid)
+        if node is not None:
+            self.hits += 1
+            self.cache.move_to_end(pid)
+            return node
+        # page fault, decode the node from the mapped file
+        self.faults += 1
+        node = self._decode(pid)
+        self.cache[pid] = node
+        self._evict()
+        return node
+
+    def put(self, pid: int, node: BTreeNode) -> None:
+        # a node must be put back after every change, which marks its page dirty
+        self.cache[pid] = node
+        self.cache.move_to_end(pid)
+        self.dirty.add(pid)
+        self._evict()
+
+    def alloc(self, node: BTreeNode) -> int:
+        pid = self.page_count
+        self.page_count += 1
+        if self.page_count * self.page_size > len(self.mm):
+            # grow the file by doubling, then map it again
+            self.mm.close()
+            self.file.truncate(2 * self.page_count * self.page_size)
+            self.mm = mmap.mmap(self.file.fileno(), 0)
+        self.put(pid, node)
+        return pid
+
+    def flush(self) -> None:
+        for pid in sorted(self.dirty):
+            self._write(pid, self.cache[pid])
+        self.dirty.clear()
+        self.HEADER.pack_into(
+            self.mm,
+            0,
+            self.MAGIC,
+            self.page_size,
+            self.order,
+            self.root,
+            self.page_count,
+            self.leaf_linked,
+            self.key_kinds,
+        )
+        self.mm.flush()
+
+    def close(self) -> None:
+        self.flush()
+        self.mm.close()
+        self.file.close()
+
+    def _evict(self) -> None:
+        # a dirty page leaves the cache only once it is written, if the write fails
+        # the node stays cached and dirty and its changes are not lost
+        while len(self.cache) > self.cache_pages:
+            pid, node = next(iter(self.cache.items()))
+            if pid in self.dirty:
+                self._write(pid, node)
+                self.dirty.remove(pid)
+            del self.cache[pid]
+            self.evictions += 1
+
+    def _write(self, pid: int, node: BTreeNode) -> None:
+        n = len(node.keys)
+        key_type = 1 if all(type(k) is int for k in node.keys) else 0
+        if key_type == 0 and any(float(k) != k for k in node.keys):
+            raise RuntimeError(
+                "Node mixes float keys with int keys that are not exact as float64"
+            )
+        parts = [
+            self.NODE.pack(node.is_leaf, key_type, n, node.next or 0),
+            struct.pack(f"<{n}{self.KEY_TYPES[key_type]}", *node.keys),
+        ]
+        if not node.is_leaf:
+            parts.append(struct.pack(f"<{n + 1}I", *node.children))
+        values = pickle.dumps(node.values, pickle.HIGHEST_PROTOCOL)
+        parts += [struct.pack("<I", len(values)), values]
+        data = b"".join(parts)
+        if len(data) > self.page_size:
+            raise RuntimeError(
+                f"Node does not fit in a page, {len(data)=} {self.page_size=}"
+            )
+        offset = pid * self.page_size
+        self.mm[offset : offset + len(data)] = data
+        self.writebacks += 1
+
+    def _decode(self, pid: int) -> BTreeNode:
+        offset = pid * self.page_size
+        is_leaf, key_type, n, next_pid = self.NODE.unpack_from(self.mm, offset)
+        offset += self.NODE.size
+        node = BTreeNode(self.order, bool(is_leaf))
+        key_fmt = f"<{n}{self.KEY_TYPES[key_type]}"
+        node.keys = list(struct.unpack_from(key_fmt, self.mm, offset))
+        offset += 8 * n
+        if not is_leaf:
+            node.children = list(struct.unpack_from(f"<{n + 1}I", self.mm, offset))
+            offset += 4 * (n + 1)
+        (size,) = struct.unpack_from("<I", self.mm, offset)
+        offset += 4
+        node.values = pickle.loads(self.mm[offset : offset + size])
+        node.next = next_pid or None
+        return node
+
+
+class PagedBTree:
+    # a disk-resident BTree, each node lives in a fixed-size page of the file at path
+    # an existing file is reopened by reading its header only, nodes are paged in
+    # on demand; changes reach the file on flush, close, or when evicted from the cache
+    def __init__(
+        self,
+        path: str,
+        order: Optional[int] = None,
+        page_size: Optional[int] = None,
+        cache_pages: int = 64,
+        leaf_linked: bool = False,
+    ) -> None:
+        # page_size defaults to 4096 for a new file, a reopened file keeps its own
+        reopen = os.path.exists(path) and os.path.getsize(path) > 0
+        self.pager = BTreePager(path, page_size or 4096, cache_pages)
+        if reopen:
+            self.pager.read_header()
+            assert order is None or order == self.pager.order, f"{order=}"
+            assert (
+                page_size is None or page_size == self.pager.page_size
+            ), f"{page_size=} {self.pager.page_size=}"
+        else:
+            page_size = self.pager.page_size
+            assert order is not None and order > 0, f"{order=}"
+            assert not leaf_linked or order > 1, f"{order=} {leaf_linked=}"
+            # make sure a node with the max number of keys leaves room for values
+            max_keys = 2 * order - 1
+            fixed = BTreePager.NODE.size + 8 * max_keys + 4 * (max_keys + 1) + 4
+            assert fixed < page_size, f"{order=} does not fit {page_size=}"
+            self.pager.order = order
+            self.pager.leaf_linked = leaf_linked
+            self.pager.root = self.pager.alloc(BTreeNode(order, True))
+        self.order: int = self.pager.order
+        self.leaf_linked: bool = self.pager.leaf_linked
+        # the space left for pickled values in a node with the most keys
+        max_keys = 2 * self.order - 1
+        self.value_space = self.pager.page_size - (
+            BTreePager.NODE.size + 8 * max_keys + 4 * (max_keys + 1) + 4
+        )
+
+    def __enter__(self) -> PagedBTree:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def flush(self) -> None:
+        self.pager.flush()
+
+    def close(self) -> None:
+        self.pager.close()
+
+    def stats(self) -> dict[str, float]:
+        return self.pager.stats()
+
+    def insert(self, key: float, data: Any) -> None:
+        # int keys are kept exact as long as they fit in int64
+        assert type(key) is not int or -(1 << 63) <= key < 1 << 63, f"{key=}"
+        pager = self.pager
+        # fail before anything changes on what can never be written back
+        if type(key) is not int:
+            kind = BTreePager.FLOAT_KEYS
+        elif float(key) != key:
+            kind = BTreePager.INEXACT_INT_KEYS
+        else:
+            kind = 0
+        if kind and not pager.key_kinds & kind:
+            if pager.key_kinds:
+                raise RuntimeError(
+                    "Float keys and int keys that are not exact as float64 cannot"
+                    f" be mixed, {key=}"
+                )
+            pager.key_kinds = kind
+        size = len(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+        if size > self.value_space:
+            raise RuntimeError(
+                f"Value does not fit in a page, {size=} {self.value_space=}"
+            )
+
+        pid = pager.root
+        node = pager.get(pid)
+        if node.is_full():
+            # grow the root, then split the old root under it
+            t = BTreeNode(self.order, False)
+            t.children.append(pid)
+            pid = pager.alloc(t)
+            pager.root = pid
+            node = t
+            self._split_child(pid, node, 0)
+
+        while True:
+            keys = node.keys
+            if self.leaf_linked and not node.is_leaf:
+                i = bisect_right(keys, key)
+            else:
+                i = bisect_left(keys, key)
+                if i < len(keys) and keys[i] == key:
+                    node.values[i] = data
+                    pager.put(pid, node)
+                    return
+                if node.is_leaf:
+                    keys.insert(i, key)
+                    node.values.insert(i, data)
+                    pager.put(pid, node)
+                    return
+            child_pid = node.children[i]
+            child = pager.get(child_pid)
+            if child.is_full():
+                self._split_child(pid, node, i)
+                continue
+            pid, node = child_pid, child
+
+    def _split_child(self, pid: int, node: BTreeNode, index: int) -> None:
+        pager = self.pager
+        child_pid = node.children[index]
+        child = pager.get(child_pid)
+        copy_up = self.leaf_linked and child.is_leaf
+        key, value, right = child.split(copy_up)
+        right_pid = pager.alloc(right)
+        if copy_up:
+            right.next = child.next
+            child.next = right_pid
+        node.keys.insert(index, key)
+        node.values.insert(index, value)
+        node.children.insert(index + 1, right_pid)
+        pager.put(right_pid, right)
+        pager.put(child_pid, child)
+        pager.put(pid, node)
+
+    def search(self, key: float) -> Any:
+        pager = self.pager
+        node = pager.get(pager.root)
+        while True:
+            keys = node.keys
+            if self.leaf_linked and not node.is_leaf:
+                node = pager.get(node.children[bisect_right(keys, key)])
+                continue
+            i = bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                return node.values[i]
+            if node.is_leaf:
+                return None
+            node = pager.get(node.children[i])
+
+    def items(self) -> Iterator[tuple[float, Any]]:
+        return self.range(None, None)
+
+    def range(
+        self, lo: Optional[float] = None, hi: Optional[float] = None
+    ) -> Iterator[tuple[float, Any]]:
+        # same as BTree.range, pages are faulted in as the scan reaches them
+        pager = self.pager
+        stack: list[tuple[BTreeNode, int]] = []
+        node = pager.get(pager.root)
+        while not node.is_leaf:
+            if self.leaf_linked:
+                i = 0 if lo is None else bisect_right(node.keys, lo)
+            else:
+                i = 0 if lo is None else bisect_left(node.keys, lo)
+                stack.append((node, i))
+            node = pager.get(node.children[i])
+        i = 0 if lo is None else bisect_left(node.keys, lo)
+
+        while True:
+            keys = node.keys
+            end = len(keys) if hi is None else bisect_left(keys, hi, i)
+            yield from zip(keys[i:end], node.values[i:end])
+            if end < len(keys):
+                return
+
+            if self.leaf_linked:
+                if node.next is None:
+                    return
+                node = pager.get(node.next)
+                i = 0
+                continue
+
+            while stack:
+                node, i = stack.pop()
+                if i < len(node.keys):
+                    break
+            else:
+                return
+            key = node.keys[i]
+            if hi is not None and not key < hi:
+                return
+            yield key, node.values[i]
+
+            stack.append((node, i + 1))
+            node = pager.get(node.children[i + 1])
+            while not node.is_leaf:
+                stack.append((node, 0))
+                node = pager.get(node.children[0])
+            i = 0
 
 
 @pytest.fixture
@@ -276,6 +962,347 @@ def test_float_keys(btree):
         assert btree.search(key) == value
 
 
+def _check_tree(tree: BTree) -> list[float]:
+    # verify the B-tree invariants and return all keys in order
+    keys: list[float] = []
+    leaves: list[BTreeNode] = []
+
+    def walk(node: BTreeNode, depth: int, lo: float, hi: float) -> None:
+        assert len(node.keys) == len(node.values)
+        assert node is tree.root or len(node.keys) >= tree.order - 1
+        assert len(node.keys) <= 2 * tree.order - 1
+        assert node.keys == sorted(set(node.keys))
+        if tree.leaf_linked:
+            assert all(lo <= k < hi for k in node.keys)
+        else:
+            assert all(lo < k < hi for k in node.keys)
+        if node.is_leaf:
+            assert node.children == []
+            leaves.append(node)
+            keys.extend(node.keys)
+            assert len(leaves) == 1 or depth == leaf_depth[0]
+            leaf_depth[0] = depth
+            return
+        assert len(node.children) == len(node.keys) + 1
+        bounds = [lo] + node.keys + [hi]
+        for i, child in enumerate(node.children):
+            walk(child, depth + 1, bounds[i], bounds[i + 1])
+            if i < len(node.keys) and not tree.leaf_linked:
+                keys.append(node.keys[i])
+
+    leaf_depth = [0]
+    walk(tree.root, 0, -inf, inf)
+    if tree.leaf_linked:
+        for leaf, right in zip(leaves, leaves[1:] + [None]):
+            assert leaf.next is right
+    else:
+        assert all(leaf.next is None for leaf in leaves)
+    assert keys == sorted(set(keys))
+    return keys
+
+
+def test_random_inserts():
+    """Test random inserts keep the tree balanced and sorted"""
+    import random
+
+    for order in [1, 2, 3, 5, 16]:
+        tree = BTree(order)
+        values = random.sample(range(1000), 300)
+        for val in values:
+            tree.insert(val, f"val{val}")
+        assert _check_tree(tree) == sorted(values)
+        for val in values:
+            assert tree.search(val) == f"val{val}"
+        assert tree.search(1000) is None
+
+
+def test_bulk_load():
+    """Test bulk loading sorted streams of different sizes"""
+    for order in [1, 2, 3, 5]:
+        for fill_factor in [0.5, 0.75, 1.0]:
+            for n in [0, 1, 2, 3, 7, 10, 33, 100, 257]:
+                tree = BTree(order)
+                tree.bulk_load(((i, f"val{i}") for i in range(n)), fill_factor)
+                assert _check_tree(tree) == list(range(n))
+                for i in range(n):
+                    assert tree.search(i) == f"val{i}"
+                assert tree.search(n) is None
+
+
+def test_bulk_load_then_insert():
+    """Test inserting into a bulk loaded tree"""
+    tree = BTree(3)
+    tree.bulk_load((i, i) for i in range(0, 200, 2))
+    for i in range(1, 200, 2):
+        tree.insert(i, i)
+    tree.insert(0, "zero")
+    assert _check_tree(tree) == list(range(200))
+    assert tree.search(0) == "zero"
+    assert tree.search(199) == 199
+
+
+def test_bulk_load_errors():
+    """Test bulk loading unsorted input or into a non-empty tree"""
+    with pytest.raises(AssertionError):
+        BTree(2).bulk_load([(2, "b"), (1, "a")])
+
+    with pytest.raises(AssertionError):
+        BTree(2).bulk_load([(1, "a"), (1, "a")])
+
+    tree = BTree(2)
+    tree.insert(1, "a")
+    with pytest.raises(AssertionError):
+        tree.bulk_load([(2, "b")])
+
+
+def test_leaf_linked():
+    """Test the leaf-linked mode with random inserts and bulk loading"""
+    import random
+
+    for order in [2, 3, 5]:
+        tree = BTree(order, leaf_linked=True)
+        values = random.sample(range(1000), 300)
+        for val in values:
+            tree.insert(val, f"val{val}")
+        tree.insert(values[0], "updated")
+        assert _check_tree(tree) == sorted(values)
+        assert tree.search(values[0]) == "updated"
+        for val in values[1:]:
+            assert tree.search(val) == f"val{val}"
+        assert tree.search(1000) is None
+
+        for n in [0, 1, 10, 33, 257]:
+            tree = BTree(order, leaf_linked=True)
+            tree.bulk_load(((i, i) for i in range(n)), fill_factor=0.7)
+            assert _check_tree(tree) == list(range(n))
+            tree.insert(n, n)
+            assert _check_tree(tree) == list(range(n + 1))
+            assert all(tree.search(i) == i for i in range(n + 1))
+
+    with pytest.raises(AssertionError):
+        BTree(1, leaf_linked=True)
+
+
+@pytest.mark.parametrize("leaf_linked", [False, True])
+def test_range(leaf_linked):
+    """Test range scans and ordered iteration"""
+    import random
+
+    tree = BTree(3, leaf_linked=leaf_linked)
+    assert list(tree.items()) == []
+    assert list(tree.range(1, 5)) == []
+
+    values = random.sample(range(0, 400, 2), 150)
+    for val in values:
+        tree.insert(val, str(val))
+    expected = sorted(values)
+    assert list(tree.items()) == [(k, str(k)) for k in expected]
+    for lo, hi in [
+        (0, 400),
+        (-10, 10),
+        (51, 51),
+        (51, 52),
+        (50, 51),
+        (100, 199),
+        (398, 500),
+    ]:
+        got = [k for k, _ in tree.range(lo, hi)]
+        assert got == [k for k in expected if lo <= k < hi]
+    assert [k for k, _ in tree.range(300)] == [k for k in expected if k >= 300]
+    assert [k for k, _ in tree.range(hi=21)] == [k for k in expected if k < 21]
+
+    # lazy, a partial read does not walk the rest
+    it = tree.range(100)
+    assert next(it)[0] == min(k for k in expected if k >= 100)
+
+
+@pytest.mark.parametrize("leaf_linked", [False, True])
+def test_search_many(leaf_linked):
+    """Test batched lookups against single lookups"""
+    import random
+
+    tree = BTree(3, leaf_linked=leaf_linked)
+    assert tree.search_many([]) == []
+    assert tree.search_many([1, 2]) == [None, None]
+
+    for val in random.sample(range(0, 1000, 2), 300):
+        tree.insert(val, f"val{val}")
+    batch = [random.randint(-10, 1010) for _ in range(500)]
+    batch += batch[:50]  # duplicates
+    assert tree.search_many(batch) == [tree.search(k) for k in batch]
+    # a batch this sparse is looked up key by key
+    assert tree.search_many(iter([4, 2, 3])) == [tree.search(k) for k in [4, 2, 3]]
+
+
+@pytest.mark.parametrize("leaf_linked", [False, True])
+def test_paged(tmp_path, leaf_linked):
+    """Test a disk-resident tree with a cache smaller than the tree, then reopen it"""
+    import random
+
+    path = str(tmp_path / "tree.db")
+    values = random.sample(range(5000), 2000)
+    with PagedBTree(path, 4, cache_pages=8, leaf_linked=leaf_linked) as tree:
+        for val in values:
+            tree.insert(val, f"val{val}")
+        tree.insert(values[0], ["updated"])
+        for val in values[1:]:
+            assert tree.search(val) == f"val{val}"
+        assert tree.search(values[0]) == ["updated"]
+        assert tree.search(5000) is None
+
+        stats = tree.stats()
+        assert stats["pages"] > 8
+        assert stats["evictions"] > 0 and stats["writebacks"] > 0
+        assert stats["faults"] > 0 and 0 < stats["hit_rate"] < 1
+
+    with PagedBTree(path, cache_pages=4) as tree:
+        assert tree.order == 4
+        assert tree.leaf_linked == leaf_linked
+        # only the header has been read so far
+        assert tree.stats()["faults"] == 0
+        assert tree.search(values[0]) == ["updated"]
+        keys = [k for k, _ in tree.items()]
+        assert keys == sorted(values)
+        assert [k for k, _ in tree.range(100, 200)] == [
+            k for k in keys if 100 <= k < 200
+        ]
+        tree.insert(5000, "new")
+
+    with PagedBTree(path) as tree:
+        assert tree.search(5000) == "new"
+
+
+def test_paged_large_int_keys(tmp_path):
+    """Test int keys above 2**53 stay distinct and int through eviction and reopen"""
+    path = str(tmp_path / "tree.db")
+    keys = [2**53 + i for i in range(200)] + [2**63 - 1, -(2**63)]
+    with PagedBTree(path, 4, cache_pages=4) as tree:
+        for k in keys:
+            tree.insert(k, k)
+        assert tree.stats()["evictions"] > 0
+        assert all(tree.search(k) == k for k in keys)
+        with pytest.raises(AssertionError):
+            tree.insert(2**63, None)
+
+    with PagedBTree(path) as tree:
+        items = list(tree.items())
+        assert items == [(k, k) for k in sorted(keys)]
+        assert all(type(k) is int for k, _ in items)
+        assert tree.search(2**53 + 1) == 2**53 + 1
+
+        # a float key cannot join inexact ints, the insert fails before any change
+        with pytest.raises(RuntimeError, match=r"Float keys and int keys.*"):
+            tree.insert(0.5, None)
+        assert tree.search(0.5) is None
+
+    # float keys still round trip, also after reopening, and exact ints may join
+    with PagedBTree(str(tmp_path / "float.db"), 4) as tree:
+        for k in [0.5, 1, 2.25]:
+            tree.insert(k, k)
+    with PagedBTree(str(tmp_path / "float.db")) as tree:
+        assert list(tree.items()) == [(0.5, 0.5), (1, 1), (2.25, 2.25)]
+        with pytest.raises(RuntimeError, match=r"Float keys and int keys.*"):
+            tree.insert(2**53 + 1, None)
+        assert list(tree.items()) == [(0.5, 0.5), (1, 1), (2.25, 2.25)]
+
+
+def test_paged_errors(tmp_path):
+    """Test values that do not fit in a page and bad page files"""
+    with pytest.raises(AssertionError):
+        PagedBTree(str(tmp_path / "a.db"), 1000, page_size=4096)
+
+    # a value too large for any page fails the insert, nothing changes
+    path = str(tmp_path / "b.db")
+    tree = PagedBTree(path, 2, page_size=256, cache_pages=2)
+    for k in range(20):
+        tree.insert(k, k)
+    with pytest.raises(RuntimeError, match=r"Value does not fit in a page.*"):
+        tree.insert(3, "x" * 1000)
+    for k in range(20, 60):
+        tree.insert(k, k)
+    assert [tree.search(k) for k in range(60)] == list(range(60))
+
+    # values that only overflow together fail on write-back, the page stays
+    # cached and dirty until it fits again
+    pages = [tree.pager.get(pid) for pid in range(1, tree.pager.page_count)]
+    keys = next(node.keys[:2] for node in pages if len(node.keys) > 1)
+    for k in keys:
+        tree.insert(k, f"{k:x>150}")
+    with pytest.raises(RuntimeError, match=r"Node does not fit in a page.*"):
+        tree.flush()
+    assert [tree.search(k) for k in keys] == [f"{k:x>150}" for k in keys]
+    tree.insert(keys[1], keys[1])
+    tree.close()
+
+    # the page size is read back from the file
+    with PagedBTree(path, cache_pages=2) as tree:
+        assert tree.pager.page_size == 256
+        assert [tree.search(k) for k in range(60)] == [
+            f"{k:x>150}" if k == keys[0] else k for k in range(60)
+        ]
+    with pytest.raises(AssertionError):
+        PagedBTree(path, page_size=4096)
+
+    path = tmp_path / "c.db"
+    path.write_bytes(b"not a b-tree" * 1000)
+    with pytest.raises(AssertionError):
+        PagedBTree(str(path))
+
+
+def test_copy_on_write():
+    """Test copy-on-write inserts leave snapshots untouched"""
+    import random
+
+    tree = BTree(2, copy_on_write=True)
+    snapshots = [(tree.snapshot(), [])]
+    values = random.sample(range(1000), 300)
+    for i, val in enumerate(values):
+        tree.insert(val, f"val{val}")
+        if i % 50 == 0:
+            snapshots.append((tree.snapshot(), sorted(values[: i + 1])))
+    tree.insert(values[0], "updated")
+    assert _check_tree(tree) == sorted(values)
+    assert tree.search(values[0]) == "updated"
+
+    for snapshot, keys in snapshots:
+        assert _check_tree(snapshot) == keys
+        assert [k for k, _ in snapshot.items()] == keys
+        assert snapshot.search_many(keys) == [f"val{k}" for k in keys]
+        with pytest.raises(RuntimeError, match=r".*read-only"):
+            snapshot.insert(1, "x")
+
+    with pytest.raises(AssertionError):
+        BTree(2).snapshot()
+    with pytest.raises(AssertionError):
+        BTree(2, leaf_linked=True, copy_on_write=True)
+
+
+def test_copy_on_write_threads():
+    """Test readers on snapshots while one writer keeps inserting"""
+    import threading
+
+    tree = BTree(3, copy_on_write=True)
+    tree.bulk_load((k, k) for k in range(0, 2000, 2))
+    errors = []
+
+    def reader():
+        for _ in range(20):
+            snapshot = tree.snapshot()
+            keys = [k for k, _ in snapshot.items()]
+            if keys != sorted(set(keys)) or snapshot.search_many(keys) != keys:
+                errors.append(keys)
+
+    readers = [threading.Thread(target=reader) for _ in range(4)]
+    for t in readers:
+        t.start()
+    for k in range(1, 2000, 2):
+        tree.insert(k, k)
+    for t in readers:
+        t.join()
+    assert errors == []
+    assert _check_tree(tree) == list(range(2000))
+
+
 def test_error_cases():
     """Test error cases"""
     with pytest.raises(AssertionError):
@@ -1,11 +1,23 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, Iterator, Optional, Union
+import ctypes
+import heapq
 import pprint
+import random
+import struct
+import sys
+import threading
+import time
+import weakref
 import pytest
 
 from loguru import logger
 
 
 class BuddyAllocator:
-    def __init__(self, capacity: int, degree: int) -> None:
+    def __init__(self, capacity: int, degree: int, arena: Optional[Any] = None) -> None:
         # make sure the capacity is 2^n
         assert (
             capacity & (capacity - 1) == 0
@@ -16,62 +28,112 @@ class BuddyAllocator:
         self.D = degree
 
         # a data structure to hold current free blocks of different size
+        # each list is used as a stack, and free_positions maps every free block index
+        # to its position in the list, so taking, finding and removing a block are O(1)
         self.free_blocks: dict[int, list[int]] = {}
+        self.free_positions: dict[int, dict[int, int]] = {}
         for d in range(self.N, self.N - self.D - 1, -1):
             self.free_blocks[d] = []
-        self.free_blocks[self.N].append(0)
+            self.free_positions[d] = {}
+        self._push(self.N, 0)
 
         # a data structure that maps returned address to block's degree and index
         self.used_blocks: dict[int, tuple[int, int]] = {}
 
+        # optional memory behind the addresses, any writable buffer of at least
+        # capacity bytes, e.g. a bytearray, an anonymous mmap or a file-backed mmap
+        self.arena: Optional[memoryview] = None
+        self.arena_address = 0
+        if arena is not None:
+            view = memoryview(arena).cast("B")
+            assert not view.readonly, "arena must be writable"
+            assert len(view) >= self.C, f"{len(view)=} {self.C=}"
+            self.arena = view[: self.C]
+            self.arena_address = self._view_address(self.arena)
+
     def __repr__(self):
         return f"capacity={self.C} degree={self.D}, max-degree={self.N} free-blocks={pprint.pformat(self.free_blocks)} used-blocks={pprint.pformat(self.used_blocks)}"
 
-    def alloc(self, size: int) -> int:
+    def degree(self, size: int) -> int:
+        # the degree of the block that holds size bytes
         assert size < self.C, f"{size=} {self.C=}"
         assert size > 0, f"{size=}"
 
-        d = size.bit_length() - 1
-        d = (
+        # round up to the next power of 2
+        d = (size - 1).bit_length()
+        return (
             self.N - self.D if d < self.N - self.D else d
         )  # requested size is smaller than min size
 
-        # memory is available
-        if len(self.free_blocks[d]) > 0:
-            i = self.free_blocks[d].pop(0)
-            a = self._get_address(d, i)
-            assert a not in self.used_blocks.keys()
-            self.used_blocks[a] = (d, i)
-            return a
-
-        # find the next best fit block
-        nd = d + 1
-        while nd <= self.N and len(self.free_blocks[nd]) == 0:
-            nd += 1
-        if nd > self.N:
-            raise RuntimeError(
-                f"Out of memory. requested-degree={d} free-blocks={pprint.pformat(self.free_blocks)}"
-            )
-        # split the larger block into the right size
-        self._split(nd, d)
-
-        i = self.free_blocks[d].pop(0)
+    def alloc(self, size: int) -> int:
+        d = self.degree(size)
+        if not self.free_blocks[d]:
+            # find the next best fit block
+            nd = d + 1
+            while nd <= self.N and not self.free_blocks[nd]:
+                nd += 1
+            if nd > self.N:
+                raise RuntimeError(
+                    f"Out of memory. requested-degree={d} free-blocks={pprint.pformat(self.free_blocks)}"
+                )
+            # split the larger block into the right size
+            self._split(nd, d)
+
+        i = self._pop(d)
         a = self._get_address(d, i)
-        assert a not in self.used_blocks.keys()
+        assert a not in self.used_blocks
         self.used_blocks[a] = (d, i)
         return a
 
-    def _get_address(self, degree: int, index: int) -> int:
-        return index * (2**degree)
+    def alloc_view(self, size: int) -> memoryview:
+        # allocate and return a memoryview of size bytes onto the arena, no copy is made
+        # the view must not be used once the block is freed
+        assert self.arena is not None, "alloc_view needs an arena"
+        a = self.alloc(size)
+        return self.arena[a : a + size]
 
-    def free(self, address: int) -> None:
-        assert address in self.used_blocks.keys(), f"{address=} {repr(self)}"
-        degree, index = self.used_blocks[address]
-        del self.used_blocks[address]
+    def close(self) -> None:
+        # release the arena, so that e.g. its mmap can be closed
+        if self.arena is not None:
+            self.arena.release()
+            self.arena = None
+
+    def _view_address(self, view: memoryview) -> int:
+        # the memory address of the first byte of view
+        return ctypes.addressof(ctypes.c_char.from_buffer(view))
+
+    def _get_address(self, degree: int, index: int) -> int:
+        return index << degree
 
-        self.free_blocks[degree].append(index)
+    def free(self, address: Union[int, memoryview]) -> None:
+        if isinstance(address, memoryview):
+            # a view from alloc_view, find its offset in the arena
+            assert self.arena is not None, "freeing a view needs an arena"
+            address = self._view_address(address) - self.arena_address
+        assert address in self.used_blocks, f"{address=} {repr(self)}"
+        degree, index = self.used_blocks.pop(address)
         self._merge(degree, index)
 
+    def _push(self, degree: int, index: int) -> None:
+        blocks = self.free_blocks[degree]
+        self.free_positions[degree][index] = len(blocks)
+        blocks.append(index)
+
+    def _pop(self, degree: int) -> int:
+        index = self.free_blocks[degree].pop()
+        del self.free_positions[degree][index]
+        return index
+
+    def _remove(self, degree: int, index: int) -> None:
+        # move the last free block into the hole left by the removed one
+        blocks = self.free_blocks[degree]
+        positions = self.free_positions[degree]
+        position = positions.pop(index)
+        last = blocks.pop()
+        if last != index:
+            blocks[position] = last
+            positions[last] = position
+
     def _split(self, large_block_degree: int, requested_degree: int) -> None:
         assert (
             large_block_degree > requested_degree
@@ -79,27 +141,518 @@ class BuddyAllocator:
         assert self.free_blocks[
             large_block_degree
         ], f"{large_block_degree=} {repr(self)}"
-        index = self.free_blocks[large_block_degree].pop(0)
+        index = self._pop(large_block_degree)
+
+        # split in half level by level, the upper halves become free blocks
+        # and the lower half is split further
+        for d in range(large_block_degree - 1, requested_degree - 1, -1):
+            index *= 2
+            self._push(d, index + 1)
+        # the lower half goes on top of the stack, so it is allocated first
+        self._push(requested_degree, index)
+
+    def _merge(self, degree: int, index: int) -> None:
+        # merge with the buddy as long as it is free, then free the resulting block
+        while degree < self.N:
+            buddy = index ^ 1
+            if buddy not in self.free_positions[degree]:
+                break
+            self._remove(degree, buddy)
+            degree += 1
+            index >>= 1
+        self._push(degree, index)
+
+
+class ThreadMagazines:
+    # the magazines of one thread, one list of free block addresses per small degree
+    # a finalizer hands the blocks back when the thread exits and drops its local state
+    def __init__(self, owner: ThreadCachedBuddyAllocator) -> None:
+        self.magazines: dict[int, list[int]] = {
+            d: [] for d in range(owner.min_degree, owner.max_degree + 1)
+        }
+        # the allocator is only weakly referenced, it may go before the thread does
+        weakref.finalize(
+            self, _reclaim_magazines, weakref.WeakMethod(owner._reclaim), self.magazines
+        )
+
 
-        # split in half
-        self.free_blocks[large_block_degree - 1].append(index * 2)
-        self.free_blocks[large_block_degree - 1].append(index * 2 + 1)
+def _reclaim_magazines(
+    reclaim: weakref.WeakMethod, magazines: dict[int, list[int]]
+) -> None:
+    # nothing to hand back to if the allocator is gone
+    method = reclaim()
+    if method is not None:
+        method(magazines)
 
-        if (large_block_degree - 1) == requested_degree:
+
+class ThreadCachedBuddyAllocator:
+    # a thread-safe front end of BuddyAllocator, one lock guards the shared core and
+    # every thread keeps a magazine of free blocks for each small degree, so most
+    # small allocs and frees never touch the lock
+    # blocks in a magazine stay allocated in the core, so they are not available to
+    # other threads until flushed, or until the thread that cached them exits
+    def __init__(
+        self, core: BuddyAllocator, depth: int = 32, cached_degrees: int = 4
+    ) -> None:
+        assert depth > 0, f"{depth=}"
+        self.core = core
+        self.lock = threading.Lock()
+        self.depth = depth
+        self.min_degree = core.N - core.D
+        self.max_degree = min(core.N, self.min_degree + cached_degrees - 1)
+        self.local = threading.local()
+        # the addresses in any magazine, to catch double frees the core cannot see
+        # set add, discard and membership are atomic under the GIL
+        self.cached: set[int] = set()
+
+    def _magazines(self) -> dict[int, list[int]]:
+        magazines = getattr(self.local, "magazines", None)
+        if magazines is None:
+            self.local.state = ThreadMagazines(self)
+            magazines = self.local.magazines = self.local.state.magazines
+        return magazines
+
+    def alloc(self, size: int) -> int:
+        d = self.core.degree(size)
+        if d > self.max_degree:
+            with self.lock:
+                return self.core.alloc(size)
+
+        magazine = self._magazines()[d]
+        if not magazine:
+            # refill half a magazine in one go
+            with self.lock:
+                for _ in range(max(1, self.depth // 2)):
+                    try:
+                        magazine.append(self.core.alloc(1 << d))
+                    except RuntimeError:
+                        if not magazine:
+                            raise
+                        break
+                self.cached.update(magazine)
+        address = magazine.pop()
+        self.cached.discard(address)
+        return address
+
+    def free(self, address: int) -> None:
+        # a dict lookup is atomic under the GIL, no need to lock for it
+        d, _ = self.core.used_blocks[address]
+        if d > self.max_degree:
+            with self.lock:
+                self.core.free(address)
             return
 
-        # recursively split the block
-        self._split(large_block_degree - 1, requested_degree)
+        assert address not in self.cached, f"double free of {address=}"
+        magazine = self._magazines()[d]
+        magazine.append(address)
+        self.cached.add(address)
+        if len(magazine) > self.depth:
+            # the magazine overflows, return its older half to the core
+            half = len(magazine) // 2
+            with self.lock:
+                for a in magazine[:half]:
+                    self.cached.discard(a)
+                    self.core.free(a)
+            del magazine[:half]
 
-    def _merge(self, degree: int, index: int) -> None:
-        buddy = index + 1 if index % 2 == 0 else index - 1
-        if index in self.free_blocks[degree] and buddy in self.free_blocks[degree]:
-            self.free_blocks[degree].remove(index)
-            self.free_blocks[degree].remove(buddy)
-            degree += 1
-            index = (index >> 1) << 1
-            self.free_blocks[degree].append(index)
-            self._merge(degree, index)
+    def flush(self) -> None:
+        # return all blocks cached by the calling thread to the core
+        self._reclaim(self._magazines())
+
+    def _reclaim(self, magazines: dict[int, list[int]]) -> None:
+        with self.lock:
+            for magazine in magazines.values():
+                for a in magazine:
+                    self.cached.discard(a)
+                    self.core.free(a)
+                magazine.clear()
+
+
+class Slab:
+    # one buddy block carved into slots of a single size
+    # free is a bitmap with bit i set when slot i is free
+    __slots__ = ("base", "size", "slots", "free", "used", "position")
+
+    def __init__(self, base: int, size: int, slots: int) -> None:
+        self.base = base
+        self.size = size
+        self.slots = slots
+        self.free = (1 << slots) - 1
+        self.used = 0
+        # index in the list of slabs of its class with free slots, -1 when full
+        self.position = -1
+
+
+class SlabAllocator:
+    # a front end of BuddyAllocator for small objects, every size class has its own
+    # slabs, each a buddy block of slab_size bytes cut into equal slots
+    # slabs are aligned to their size, so the slab of an address is found by masking
+    # sizes above the largest class go straight to the core
+    SIZE_CLASSES = (16, 24, 32, 48, 64, 96, 128, 192, 256, 384, 512, 768, 1024)
+
+    def __init__(
+        self,
+        core: BuddyAllocator,
+        slab_size: int = 4096,
+        size_classes: Iterable[int] = SIZE_CLASSES,
+    ) -> None:
+        assert slab_size & (slab_size - 1) == 0, f"{slab_size=}"
+        assert (
+            1 << (core.N - core.D) <= slab_size < core.C
+        ), f"{slab_size=} {core.C=} {core.D=}"
+        classes = sorted(size_classes)
+        assert classes and 0 < classes[0] and classes[-1] <= slab_size, f"{classes=}"
+        self.core = core
+        self.slab_size = slab_size
+        self.mask = ~(slab_size - 1)
+        self.max_size = classes[-1]
+
+        # the class of every size up to the largest one, so a lookup is O(1)
+        self.class_of: list[int] = [classes[0]] * (self.max_size + 1)
+        size = 1
+        for c in classes:
+            while size <= c:
+                self.class_of[size] = c
+                size += 1
+
+        # slabs of each class that have free slots, used as a stack
+        self.partial: dict[int, list[Slab]] = {c: [] for c in classes}
+        # every slab by its base address
+        self.slabs: dict[int, Slab] = {}
+        # the requested size of every object handed out
+        self.used_sizes: dict[int, int] = {}
+
+    def alloc(self, size: int) -> int:
+        if size > self.max_size:
+            return self.core.alloc(size)
+        assert size > 0, f"{size=}"
+
+        partial = self.partial[self.class_of[size]]
+        if partial:
+            slab = partial[-1]
+        else:
+            slab = self._new_slab(self.class_of[size])
+        free = slab.free
+        low = free & -free
+        slab.free = free ^ low
+        slab.used += 1
+        if not slab.free:
+            # the slab is full, it is always the top of the stack
+            partial.pop()
+            slab.position = -1
+
+        a = slab.base + (low.bit_length() - 1) * slab.size
+        self.used_sizes[a] = size
+        return a
+
+    def free(self, address: int) -> None:
+        slab = self.slabs.get(address & self.mask)
+        if slab is None:
+            self.core.free(address)
+            return
+        assert address in self.used_sizes, f"{address=}"
+        del self.used_sizes[address]
+
+        bit = 1 << ((address - slab.base) // slab.size)
+        partial = self.partial[slab.size]
+        if not slab.free:
+            slab.position = len(partial)
+            partial.append(slab)
+        slab.free |= bit
+        slab.used -= 1
+        if not slab.used and len(partial) > 1:
+            # keep the last slab with free slots, so that one object being
+            # allocated and freed over and over does not split and merge every time
+            self._release(slab)
+
+    def trim(self) -> None:
+        # return every empty slab to the core
+        for partial in self.partial.values():
+            for slab in [slab for slab in partial if not slab.used]:
+                self._release(slab)
+
+    def _new_slab(self, size: int) -> Slab:
+        slab = Slab(self.core.alloc(self.slab_size), size, self.slab_size // size)
+        self.slabs[slab.base] = slab
+        partial = self.partial[size]
+        slab.position = len(partial)
+        partial.append(slab)
+        return slab
+
+    def _release(self, slab: Slab) -> None:
+        # move the last slab into the hole left by the released one
+        partial = self.partial[slab.size]
+        last = partial.pop()
+        if last is not slab:
+            partial[slab.position] = last
+            last.position = slab.position
+        del self.slabs[slab.base]
+        self.core.free(slab.base)
+
+    def stats(self) -> dict[str, Any]:
+        # occupancy is the share of slots in use, internal fragmentation the share
+        # of the bytes in used slots that were not asked for
+        classes = {
+            c: {"slabs": 0, "slots": 0, "used": 0, "requested": 0} for c in self.partial
+        }
+        for slab in self.slabs.values():
+            s = classes[slab.size]
+            s["slabs"] += 1
+            s["slots"] += slab.slots
+            s["used"] += slab.used
+        for a, size in self.used_sizes.items():
+            classes[self.slabs[a & self.mask].size]["requested"] += size
+        for s in classes.values():
+            s["occupancy"] = s["used"] / s["slots"] if s["slots"] else 0.0
+
+        slabs = len(self.slabs)
+        slots = sum(s["slots"] for s in classes.values())
+        used = sum(s["used"] for s in classes.values())
+        requested = sum(s["requested"] for s in classes.values())
+        allocated = sum(c * s["used"] for c, s in classes.items())
+        return {
+            "slabs": slabs,
+            "reserved": slabs * self.slab_size,
+            "requested": requested,
+            "occupancy": used / slots if slots else 0.0,
+            "internal_fragmentation": 1 - requested / allocated if allocated else 0.0,
+            "classes": classes,
+        }
+
+
+class AllocationTrace:
+    # a compact binary record of alloc and free calls, 9 bytes per call
+    # blocks are numbered in the order they are allocated and the numbers stand in
+    # for the returned addresses, so a trace can be replayed on any allocator
+    MAGIC = b"BATRACE1"
+    RECORD = struct.Struct("<BII")  # op, block, size
+    ALLOC = 0
+    FREE = 1
+
+    def __init__(self, data: bytes = b"") -> None:
+        self.data = bytearray(data)
+
+    def __len__(self) -> int:
+        return len(self.data) // self.RECORD.size
+
+    def __iter__(self) -> Iterator[tuple[int, int, int]]:
+        return self.RECORD.iter_unpack(self.data)
+
+    def alloc(self, block: int, size: int) -> None:
+        self.data += self.RECORD.pack(self.ALLOC, block, size)
+
+    def free(self, block: int) -> None:
+        self.data += self.RECORD.pack(self.FREE, block, 0)
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as f:
+            f.write(self.MAGIC)
+            f.write(self.data)
+
+    @classmethod
+    def load(cls, path: str) -> AllocationTrace:
+        with open(path, "rb") as f:
+            data = f.read()
+        assert data[: len(cls.MAGIC)] == cls.MAGIC, f"{path} is not a trace file"
+        return cls(data[len(cls.MAGIC) :])
+
+
+class TraceRecorder:
+    # wraps a live allocator and records every alloc and free call into a trace
+    # a failed alloc is recorded too, so replays can see the same out-of-memory point
+    def __init__(self, allocator: Any, trace: Optional[AllocationTrace] = None) -> None:
+        self.allocator = allocator
+        self.trace = trace if trace is not None else AllocationTrace()
+        self.blocks: dict[int, int] = {}  # address to block number
+        self.next_block = 0
+
+    def alloc(self, size: int) -> int:
+        block = self.next_block
+        self.next_block += 1
+        self.trace.alloc(block, size)
+        a = self.allocator.alloc(size)
+        self.blocks[a] = block
+        return a
+
+    def free(self, address: int) -> None:
+        self.trace.free(self.blocks.pop(address))
+        self.allocator.free(address)
+
+
+@dataclass
+class ReplayReport:
+    ops: int
+    seconds: float
+    ops_per_sec: float
+    # peak of the bytes asked for, and of the bytes in the blocks handed out
+    peak_requested: int = 0
+    peak_used: int = 0
+    # for every degree, the share of free memory that is in smaller blocks and
+    # cannot serve a request of that degree, taken at the peak of used memory
+    fragmentation: dict[int, float] = field(default_factory=dict)
+    # positions in the trace of the allocs that ran out of memory, including the ones
+    # that ask for the whole capacity or more
+    oom: list[int] = field(default_factory=list)
+
+
+def _fragmentation(allocator: Any) -> dict[int, float]:
+    free_blocks = getattr(allocator, "free_blocks", None)
+    if free_blocks is None:
+        return {}
+    free_bytes = {d: len(blocks) << d for d, blocks in free_blocks.items()}
+    total = sum(free_bytes.values())
+    result = {}
+    smaller = 0
+    for d in sorted(free_bytes):
+        result[d] = smaller / total if total else 0.0
+        smaller += free_bytes[d]
+    return result
+
+
+def replay(
+    trace: AllocationTrace,
+    new_allocator: Callable[[], Any],
+    capacity: Optional[int] = None,
+) -> ReplayReport:
+    # run the trace twice on fresh allocators, first timed without any bookkeeping,
+    # then again to collect the memory usage, fragmentation and out-of-memory points
+    records = list(trace)
+
+    allocator = new_allocator()
+    # a size that can never fit fails the capacity assert of a BuddyAllocator, it is
+    # counted as out of memory instead of ending the replay; the capacity is taken
+    # from the allocator, or its core, when not given, and not checked if unknown
+    if capacity is None:
+        capacity = getattr(getattr(allocator, "core", allocator), "C", None)
+    if capacity is None:
+        capacity = sys.maxsize
+    addresses: dict[int, int] = {}
+    t0 = time.perf_counter()
+    for op, block, size in records:
+        if op == AllocationTrace.ALLOC:
+            if size >= capacity:
+                continue
+            try:
+                addresses[block] = allocator.alloc(size)
+            except RuntimeError:
+                pass
+        elif block in addresses:
+            allocator.free(addresses.pop(block))
+    seconds = time.perf_counter() - t0
+    report = ReplayReport(
+        len(records), seconds, len(records) / seconds if seconds else 0.0
+    )
+
+    allocator = new_allocator()
+    used_blocks = getattr(allocator, "used_blocks", None)
+    addresses = {}
+    sizes: dict[int, tuple[int, int]] = {}
+    requested = used = 0
+    for i, (op, block, size) in enumerate(records):
+        if op == AllocationTrace.ALLOC:
+            if size >= capacity:
+                report.oom.append(i)
+                continue
+            try:
+                a = allocator.alloc(size)
+            except RuntimeError:
+                report.oom.append(i)
+                continue
+            addresses[block] = a
+            block_size = 1 << used_blocks[a][0] if used_blocks is not None else size
+            sizes[block] = (size, block_size)
+            requested += size
+            used += block_size
+            report.peak_requested = max(report.peak_requested, requested)
+            if used > report.peak_used:
+                report.peak_used = used
+                report.fragmentation = _fragmentation(allocator)
+        elif block in addresses:
+            allocator.free(addresses.pop(block))
+            size, block_size = sizes.pop(block)
+            requested -= size
+            used -= block_size
+    return report
+
+
+def _random_free_trace(
+    ops: int, live: int, size: Callable[[random.Random], int], seed: int
+) -> AllocationTrace:
+    # alloc or free a random live block with equal odds, with up to live blocks
+    rng = random.Random(seed)
+    trace = AllocationTrace()
+    blocks: list[int] = []
+    for block in range(ops):
+        if len(blocks) >= live or (blocks and rng.random() < 0.5):
+            i = rng.randrange(len(blocks))
+            blocks[i], blocks[-1] = blocks[-1], blocks[i]
+            trace.free(blocks.pop())
+        else:
+            trace.alloc(block, size(rng))
+            blocks.append(block)
+    return trace
+
+
+def uniform_trace(
+    ops: int, min_size: int, max_size: int, live: int = 1000, seed: int = 0
+) -> AllocationTrace:
+    # sizes uniform in [min_size, max_size], random blocks are freed
+    return _random_free_trace(
+        ops, live, lambda rng: rng.randint(min_size, max_size), seed
+    )
+
+
+def power_law_trace(
+    ops: int,
+    min_size: int,
+    max_size: int,
+    alpha: float = 1.5,
+    live: int = 1000,
+    seed: int = 0,
+) -> AllocationTrace:
+    # mostly small sizes with a long tail of large ones, random blocks are freed
+    return _random_free_trace(
+        ops,
+        live,
+        lambda rng: min(max_size, int(min_size * rng.paretovariate(alpha))),
+        seed,
+    )
+
+
+def lifo_trace(
+    ops: int, min_size: int, max_size: int, burst: int = 100, seed: int = 0
+) -> AllocationTrace:
+    # bursts of allocs freed in reverse order, like a stack of scratch buffers
+    rng = random.Random(seed)
+    trace = AllocationTrace()
+    blocks: list[int] = []
+    block = 0
+    while len(trace) < ops:
+        for _ in range(rng.randint(1, burst)):
+            trace.alloc(block, rng.randint(min_size, max_size))
+            blocks.append(block)
+            block += 1
+        while blocks:
+            trace.free(blocks.pop())
+    return trace
+
+
+def random_lifetime_trace(
+    ops: int, min_size: int, max_size: int, mean_lifetime: float = 500, seed: int = 0
+) -> AllocationTrace:
+    # one alloc per step, each block is freed after an exponentially distributed
+    # number of steps
+    rng = random.Random(seed)
+    trace = AllocationTrace()
+    expiry: list[tuple[float, int]] = []
+    block = 0
+    while len(trace) < ops:
+        while expiry and expiry[0][0] <= block:
+            trace.free(heapq.heappop(expiry)[1])
+        trace.alloc(block, rng.randint(min_size, max_size))
+        heapq.heappush(expiry, (block + rng.expovariate(1 / mean_lifetime), block))
+        block += 1
+    return trace
 
 
 def test_basic_alloc():
@@ -149,3 +702,380 @@ def test_basic_free():
     assert ba.free_blocks[9] == []
     assert ba.free_blocks[8] == []
     assert ba.free_blocks[7] == []
+
+
+def test_non_power_of_2():
+    ba = BuddyAllocator(1024, 3)
+    a0 = ba.alloc(100)
+    a1 = ba.alloc(129)
+    assert ba.used_blocks[a0][0] == 7
+    assert ba.used_blocks[a1][0] == 8
+    assert a0 != a1
+
+
+def test_churn():
+    import random
+
+    ba = BuddyAllocator(1 << 16, 10)
+    live: dict[int, int] = {}
+    for _ in range(5000):
+        if live and random.random() < 0.5:
+            a = random.choice(list(live))
+            ba.free(a)
+            del live[a]
+        else:
+            size = random.randint(1, 1024)
+            try:
+                a = ba.alloc(size)
+            except RuntimeError:
+                continue
+            # blocks never overlap
+            for b, n in live.items():
+                assert a + size <= b or b + n <= a
+            live[a] = size
+
+        for d, blocks in ba.free_blocks.items():
+            assert len(blocks) == len(ba.free_positions[d])
+            for i, index in enumerate(blocks):
+                assert ba.free_positions[d][index] == i
+
+    for a in live:
+        ba.free(a)
+    assert ba.free_blocks[16] == [0]
+    assert all(not blocks for d, blocks in ba.free_blocks.items() if d < 16)
+
+
+@pytest.mark.parametrize("kind", ["bytearray", "mmap", "file"])
+def test_arena(tmp_path, kind):
+    import mmap
+
+    if kind == "bytearray":
+        arena = bytearray(1024)
+    elif kind == "mmap":
+        arena = mmap.mmap(-1, 1024)
+    else:
+        path = tmp_path / "arena"
+        path.write_bytes(bytes(1024))
+        f = open(path, "r+b")
+        arena = mmap.mmap(f.fileno(), 0)
+
+    ba = BuddyAllocator(1024, 3, arena)
+    v0 = ba.alloc_view(100)
+    v1 = ba.alloc_view(128)
+    assert len(v0) == 100 and len(v1) == 128
+    a1 = ba._view_address(v1) - ba.arena_address
+    assert a1 in ba.used_blocks
+
+    # views write straight into the arena
+    v0[:5] = b"hello"
+    v1[-1] = 0xFF
+    assert bytes(arena[:5]) == b"hello"
+    assert arena[a1 + 127] == 0xFF
+
+    # free by view or by address
+    ba.free(v0)
+    ba.free(a1)
+    assert ba.used_blocks == {}
+    assert ba.free_blocks[10] == [0]
+
+    with pytest.raises(AssertionError):
+        ba.free(v1)
+
+    v0.release()
+    v1.release()
+    ba.close()
+    if kind != "bytearray":
+        arena.flush()
+        arena.close()
+    if kind == "file":
+        f.close()
+        assert path.read_bytes()[:5] == b"hello"
+
+
+def test_arena_errors():
+    with pytest.raises(AssertionError):
+        BuddyAllocator(1024, 3, bytearray(512))
+    with pytest.raises(AssertionError):
+        BuddyAllocator(1024, 3, bytes(1024))
+    with pytest.raises(AssertionError):
+        BuddyAllocator(1024, 3).alloc_view(16)
+
+
+def test_thread_cache():
+    ba = BuddyAllocator(1024, 4)
+    tc = ThreadCachedBuddyAllocator(ba, depth=4, cached_degrees=2)
+    a0 = tc.alloc(64)
+    # a refill takes half a magazine from the core
+    assert len(ba.used_blocks) == 2
+    a1 = tc.alloc(64)
+    assert a0 != a1
+    assert len(ba.used_blocks) == 2
+
+    # large blocks go straight to the core
+    a2 = tc.alloc(512)
+    assert ba.used_blocks[a2][0] == 9
+    tc.free(a2)
+    assert a2 not in ba.used_blocks
+
+    # cached blocks stay allocated in the core until flushed
+    tc.free(a0)
+    tc.free(a1)
+    assert len(ba.used_blocks) == 2
+    tc.flush()
+    assert ba.used_blocks == {}
+    assert ba.free_blocks[10] == [0]
+
+    # a block cached in a magazine cannot be freed again
+    a0 = tc.alloc(64)
+    tc.free(a0)
+    with pytest.raises(AssertionError, match="double free"):
+        tc.free(a0)
+    assert tc.alloc(64) == a0
+    assert tc.alloc(64) != a0
+
+
+def test_thread_cache_threads():
+    import random
+
+    ba = BuddyAllocator(1 << 20, 12)
+    tc = ThreadCachedBuddyAllocator(ba, depth=8)
+    live: list[list[tuple[int, int]]] = []
+
+    def worker(seed: int) -> None:
+        rng = random.Random(seed)
+        blocks: list[tuple[int, int]] = []
+        for _ in range(2000):
+            if blocks and rng.random() < 0.5:
+                a, _ = blocks.pop(rng.randrange(len(blocks)))
+                tc.free(a)
+            else:
+                size = rng.choice([1, 100, 256, 1000, 4096])
+                blocks.append((tc.alloc(size), size))
+        for a, _ in blocks[::2]:
+            tc.free(a)
+        tc.flush()
+        live.append(blocks[1::2])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # no two live blocks overlap
+    ranges = sorted((a, a + size) for blocks in live for a, size in blocks)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end <= start
+
+    for blocks in live:
+        for a, _ in blocks:
+            tc.free(a)
+    tc.flush()
+    assert ba.used_blocks == {}
+    assert ba.free_blocks[20] == [0]
+
+
+def test_thread_cache_thread_exit():
+    import gc
+
+    ba = BuddyAllocator(1 << 16, 8)
+    tc = ThreadCachedBuddyAllocator(ba, depth=8)
+
+    def worker() -> None:
+        # leave blocks in the magazines without flushing
+        for a in [tc.alloc(size) for size in [256, 300, 600, 1000] * 3]:
+            tc.free(a)
+        assert ba.used_blocks
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    gc.collect()
+    # the magazines of the exited threads went back to the core
+    assert ba.used_blocks == {} and tc.cached == set()
+    assert ba.free_blocks[16] == [0]
+
+
+def test_thread_cache_lifetime():
+    import gc
+
+    # the magazines of a thread that outlives the allocator do not keep it alive
+    refs = []
+    for _ in range(3):
+        tc = ThreadCachedBuddyAllocator(BuddyAllocator(1 << 16, 8))
+        tc.free(tc.alloc(256))
+        refs.append(weakref.ref(tc))
+    del tc
+    gc.collect()
+    assert [r() for r in refs] == [None] * 3
+
+
+def test_slab():
+    ba = BuddyAllocator(1 << 16, 12)
+    sa = SlabAllocator(ba, slab_size=1024, size_classes=[24, 48, 200])
+    a0 = sa.alloc(24)
+    a1 = sa.alloc(20)
+    a2 = sa.alloc(48)
+    # objects of one class share a slab, each class gets its own
+    assert a1 == a0 + 24
+    assert a2 & ~1023 != a0 & ~1023
+    assert len(ba.used_blocks) == 2
+    assert all(ba.used_blocks[a][0] == 10 for a in ba.used_blocks)
+
+    # sizes above the largest class go straight to the core
+    a3 = sa.alloc(201)
+    assert ba.used_blocks[a3][0] == 8
+
+    stats = sa.stats()
+    assert stats["slabs"] == 2
+    assert stats["requested"] == 24 + 20 + 48
+    assert stats["internal_fragmentation"] == pytest.approx(1 - 92 / 96)
+    assert stats["classes"][24]["slots"] == 1024 // 24
+    assert stats["classes"][24]["used"] == 2
+    assert stats["classes"][200]["slabs"] == 0
+
+    # the last slab of a class is kept when it empties, others go back to the core
+    sa.free(a0)
+    sa.free(a1)
+    assert len(sa.slabs) == 2
+    blocks = [sa.alloc(200) for _ in range(6)]
+    assert len(sa.partial[200]) == 1
+    for a in blocks[:5]:
+        sa.free(a)
+    assert len(sa.slabs) == 3
+    sa.free(blocks[5])
+    assert len(sa.slabs) == 3
+    assert len(sa.partial[200]) == 1
+
+    with pytest.raises(AssertionError):
+        sa.free(a0)
+
+    sa.free(a2)
+    sa.free(a3)
+    sa.trim()
+    assert sa.slabs == {}
+    assert ba.used_blocks == {}
+    assert ba.free_blocks[16] == [0]
+
+
+def test_slab_churn():
+    import random
+
+    ba = BuddyAllocator(1 << 24, 18)
+    sa = SlabAllocator(ba)
+    live: dict[int, int] = {}
+    for _ in range(10000):
+        if live and random.random() < 0.45:
+            a = random.choice(list(live))
+            sa.free(a)
+            del live[a]
+        else:
+            size = random.choice([8, 24, 48, 200, 1000, 3000])
+            a = sa.alloc(size)
+            assert a not in live
+            live[a] = size
+
+    # no two live objects overlap
+    ranges = sorted((a, a + size) for a, size in live.items())
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end <= start
+
+    for size, partial in sa.partial.items():
+        for i, slab in enumerate(partial):
+            assert slab.position == i and slab.free and slab.size == size
+    stats = sa.stats()
+    assert 0 < stats["occupancy"] <= 1
+    assert stats["requested"] == sum(s for s in live.values() if s <= 1024)
+
+    for a in live:
+        sa.free(a)
+    sa.trim()
+    assert ba.used_blocks == {}
+    assert ba.free_blocks[24] == [0]
+
+
+def test_trace_record_replay(tmp_path):
+    ba = BuddyAllocator(1024, 3)
+    rec = TraceRecorder(ba)
+    a0 = rec.alloc(128)
+    a1 = rec.alloc(512)
+    rec.free(a0)
+    a2 = rec.alloc(256)
+    with pytest.raises(RuntimeError, match=r"Out of memory.*"):
+        rec.alloc(512)
+    rec.free(a1)
+    rec.free(a2)
+    assert list(rec.trace) == [
+        (AllocationTrace.ALLOC, 0, 128),
+        (AllocationTrace.ALLOC, 1, 512),
+        (AllocationTrace.FREE, 0, 0),
+        (AllocationTrace.ALLOC, 2, 256),
+        (AllocationTrace.ALLOC, 3, 512),
+        (AllocationTrace.FREE, 1, 0),
+        (AllocationTrace.FREE, 2, 0),
+    ]
+    assert len(rec.trace.data) == 7 * 9
+
+    path = str(tmp_path / "trace.bin")
+    rec.trace.save(path)
+    trace = AllocationTrace.load(path)
+    assert list(trace) == list(rec.trace)
+
+    report = replay(trace, lambda: BuddyAllocator(1024, 3))
+    assert report.ops == 7
+    assert report.oom == [4]
+    assert report.peak_requested == 512 + 256
+    assert report.peak_used == 512 + 256
+    # at the peak the only free block is 256 bytes, too small for 512 and up
+    assert report.fragmentation == {7: 0.0, 8: 0.0, 9: 1.0, 10: 1.0}
+
+    # sizes of the whole capacity and up are failed allocs, not errors
+    trace = AllocationTrace()
+    trace.alloc(0, 1024)
+    trace.alloc(1, 100)
+    trace.alloc(2, 1 << 20)
+    trace.free(1)
+    trace.free(0)
+    report = replay(trace, lambda: BuddyAllocator(1024, 3))
+    assert report.ops == 5
+    assert report.oom == [0, 2]
+    assert report.peak_requested == 100
+
+    # any object with alloc and free replays, without a capacity nothing is checked
+    class ListAllocator:
+        def __init__(self) -> None:
+            self.blocks: list[Optional[int]] = []
+
+        def alloc(self, size: int) -> int:
+            self.blocks.append(size)
+            return len(self.blocks) - 1
+
+        def free(self, address: int) -> None:
+            self.blocks[address] = None
+
+    report = replay(trace, ListAllocator)
+    assert report.oom == [] and report.peak_requested == 1024 + 100 + (1 << 20)
+    report = replay(trace, ListAllocator, capacity=1024)
+    assert report.oom == [0, 2]
+
+
+def test_trace_generators():
+    for trace in [
+        uniform_trace(2000, 1, 512, live=50),
+        power_law_trace(2000, 16, 4096, live=50),
+        lifo_trace(2000, 1, 512, burst=20),
+        random_lifetime_trace(2000, 1, 512, mean_lifetime=30),
+    ]:
+        allocated = set()
+        for op, block, size in trace:
+            if op == AllocationTrace.ALLOC:
+                assert block not in allocated and size > 0
+                allocated.add(block)
+            else:
+                assert block in allocated
+                allocated.remove(block)
+        report = replay(trace, lambda: BuddyAllocator(1 << 16, 12))
+        assert report.ops == len(trace) >= 2000
+        assert report.peak_used >= report.peak_requested > 0
@@ -1,9 +1,15 @@
 from enum import IntEnum, auto
+from collections import deque
 from dataclasses import dataclass
+from itertools import count
+import heapq
+import sys
+import threading
 from sortedcontainers import SortedKeyList
 from typing import Optional
 
 from loguru import logger
+import pytest
 
 
 # define command
@@ -13,6 +19,7 @@ class Command(IntEnum):
     DISABLE_DEBUG = auto()
     ENABLE_PROFILING = auto()
     DISABLE_PROFILING = auto()
+    EXIT = auto()
     MAX = auto()
 
 
@@ -27,9 +34,15 @@ class Request:
 
 # define request queue
 class RequestQueue:
+    # the priority that is served after all others
+    lowest_priority = sys.maxsize
+
     def __init__(self) -> None:
         self.queue: SortedKeyList[Request] = SortedKeyList(key=lambda x: x.priority)
 
+    def __len__(self) -> int:
+        return len(self.queue)
+
     def add(self, request: Request) -> None:
         self.queue.add(request)
 
@@ -39,6 +52,101 @@ class RequestQueue:
         return None
 
 
+class BucketRequestQueue(RequestQueue):
+    # one deque per priority and a bitmap of the non-empty ones, add and sched are O(1)
+    # priorities must be small integers in range(levels), lowest first, FIFO within one
+    def __init__(self, levels: int = 64) -> None:
+        self.levels = levels
+        self.lowest_priority = levels - 1
+        self.buckets: list[deque[Request]] = [deque() for _ in range(levels)]
+        self.nonempty = 0
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, request: Request) -> None:
+        priority = request.priority
+        assert 0 <= priority < self.levels, f"{priority=} {self.levels=}"
+        self.buckets[priority].append(request)
+        self.nonempty |= 1 << priority
+        self.size += 1
+
+    def sched(self) -> Optional[Request]:
+        if not self.nonempty:
+            return None
+        # the lowest set bit is the lowest non-empty priority
+        priority = (self.nonempty & -self.nonempty).bit_length() - 1
+        bucket = self.buckets[priority]
+        request = bucket.popleft()
+        if not bucket:
+            self.nonempty ^= 1 << priority
+        self.size -= 1
+        return request
+
+
+class HeapRequestQueue(RequestQueue):
+    # a binary heap for priorities of any range, lowest first, add and sched are O(log n)
+    # a sequence number breaks ties so that requests of one priority come out FIFO
+    def __init__(self) -> None:
+        self.heap: list[tuple[int, int, Request]] = []
+        self.sequence = count()
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def add(self, request: Request) -> None:
+        heapq.heappush(self.heap, (request.priority, next(self.sequence), request))
+
+    def sched(self) -> Optional[Request]:
+        if self.heap:
+            return heapq.heappop(self.heap)[2]
+        return None
+
+
+class BlockingRequestQueue(RequestQueue):
+    # a bounded thread-safe queue in front of one of the queues above, the WorkQueue of
+    # src/work_queue_posix.cpp: add blocks while it is full, sched while it is empty
+    def __init__(
+        self, capacity: int = 16, engine: Optional[RequestQueue] = None
+    ) -> None:
+        self.capacity = capacity
+        self.engine = engine if engine is not None else HeapRequestQueue()
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.engine)
+
+    @property
+    def lowest_priority(self) -> int:
+        return self.engine.lowest_priority
+
+    def add(self, request: Request, timeout: Optional[float] = None) -> bool:
+        # wait up to timeout seconds for room, None waits as long as it takes
+        # return False if the queue was still full
+        with self.not_full:
+            if not self.not_full.wait_for(
+                lambda: len(self.engine) < self.capacity, timeout
+            ):
+                return False
+            self.engine.add(request)
+            self.not_empty.notify()
+        return True
+
+    def sched(self, timeout: Optional[float] = None) -> Optional[Request]:
+        # wait up to timeout seconds for a request, None waits as long as it takes
+        # return None if the queue was still empty
+        with self.not_empty:
+            if not self.not_empty.wait_for(lambda: len(self.engine) > 0, timeout):
+                return None
+            request = self.engine.sched()
+            self.not_full.notify()
+        return request
+
+
 # define sender
 class Sender:
     def __init__(self, id: int, request_queue: RequestQueue) -> None:
@@ -55,6 +163,7 @@ class Receiver:
     def __init__(self, id: int, request_queue: RequestQueue) -> None:
         self.id = id
         self.request_queue = request_queue
+        self.executed = 0
 
     def _execute_matmul(self, args: list[int]) -> None:
         pass
@@ -71,10 +180,12 @@ class Receiver:
     def _disable_profiling(self) -> None:
         pass
 
-    def execute_request(self) -> None:
+    def execute_request(self) -> Optional[Request]:
+        # return the request that was executed, None if the queue was empty
         request = self.request_queue.sched()
         if request:
             logger.debug(f"Client {self.id} executing request {request}")
+            self.executed += 1
 
             match request.command:
                 case Command.EXECUTE_MATMUL:
@@ -87,20 +198,144 @@ class Receiver:
                     self._enable_profiling()
                 case Command.DISABLE_PROFILING:
                     self._disable_profiling()
-                case _:
-                    return
+        return request
+
+    def run(self) -> None:
+        # execute requests until an EXIT request, the body of a worker thread
+        # on a queue that does not block it also stops once the queue is empty
+        while True:
+            request = self.execute_request()
+            if request is None or request.command == Command.EXIT:
+                logger.debug(f"Client {self.id} finishes")
+                return
+
+
+# define receiver pool
+class ReceiverPool:
+    # count Receivers, each one serving the queue in its own thread
+    def __init__(
+        self, request_queue: BlockingRequestQueue, count: int, id: int = 0
+    ) -> None:
+        self.request_queue = request_queue
+        self.receivers = [Receiver(id + i, request_queue) for i in range(count)]
+        self.threads = [threading.Thread(target=r.run) for r in self.receivers]
+        for t in self.threads:
+            t.start()
+
+    @property
+    def executed(self) -> int:
+        return sum(r.executed for r in self.receivers)
+
+    def shutdown(self, priority: Optional[int] = None) -> None:
+        # send one EXIT per worker and wait for them, like Cmd::EXIT in the C++
+        # WorkQueue, by default at the lowest priority of the queue, so everything
+        # queued before runs first
+        if priority is None:
+            priority = self.request_queue.lowest_priority
+        for _ in self.receivers:
+            self.request_queue.add(Request(priority, Command.EXIT, []))
+        for t in self.threads:
+            t.join()
 
 
-def test_basic():
-    q = RequestQueue()
+@pytest.mark.parametrize("queue", [RequestQueue, BucketRequestQueue, HeapRequestQueue])
+def test_basic(queue):
+    q = queue()
     tx0 = Sender(10, q)
     tx1 = Sender(11, q)
     rx0 = Receiver(20, q)
     rx1 = Receiver(21, q)
 
-    r = Request()
-    tx0.send_request()
+    tx0.send_request(Request(1, Command.EXECUTE_MATMUL, [4, 4], tx0.id))
+    tx1.send_request(Request(0, Command.ENABLE_DEBUG, [], tx1.id))
+    # the lower priority runs first, whichever receiver takes it
+    assert rx0.execute_request().command == Command.ENABLE_DEBUG
+    assert rx1.execute_request().command == Command.EXECUTE_MATMUL
+    assert rx0.execute_request() is None
+    assert q.sched() is None
+
+
+@pytest.mark.parametrize("queue", [BucketRequestQueue, HeapRequestQueue])
+def test_fifo_within_priority(queue):
+    import random
+
+    q = queue()
+    requests = [
+        Request(random.randrange(8), Command.EXECUTE_MATMUL, [i]) for i in range(2000)
+    ]
+    served = []
+    for i, r in enumerate(requests):
+        q.add(r)
+        # drain a little now and then, so that adds and scheds interleave
+        if i % 7 == 0:
+            served.append(q.sched())
+    while len(q):
+        served.append(q.sched())
+    assert q.sched() is None
+    assert sorted(r.args[0] for r in served) == list(range(2000))
+
+    # replay with a stable sort of what was queued at each sched
+    pending: list[Request] = []
+    order = []
+    for i, r in enumerate(requests):
+        pending.append(r)
+        if i % 7 == 0:
+            pending.sort(key=lambda x: x.priority)
+            order.append(pending.pop(0))
+    pending.sort(key=lambda x: x.priority)
+    assert served == order + pending
+
+    with pytest.raises(AssertionError):
+        BucketRequestQueue(levels=8).add(Request(8, Command.MAX, []))
+
+
+def test_blocking_queue():
+    q = BlockingRequestQueue(capacity=2)
+    assert q.sched(timeout=0.01) is None
+    assert q.add(Request(1, Command.ENABLE_DEBUG, []), timeout=0)
+    assert q.add(Request(0, Command.DISABLE_DEBUG, []), timeout=0)
+    assert not q.add(Request(0, Command.ENABLE_PROFILING, []), timeout=0.01)
+    assert len(q) == 2
+
+    # a full queue makes a producer wait until a consumer takes a request
+    producer = threading.Thread(
+        target=q.add, args=(Request(2, Command.ENABLE_PROFILING, []),)
+    )
+    producer.start()
+    producer.join(timeout=0.05)
+    assert producer.is_alive()
+    assert q.sched().command == Command.DISABLE_DEBUG
+    producer.join()
+    assert q.sched(timeout=0).command == Command.ENABLE_DEBUG
+    assert q.sched(timeout=0).command == Command.ENABLE_PROFILING
+    assert q.sched(timeout=0) is None
+
+
+@pytest.mark.parametrize("engine", [RequestQueue, BucketRequestQueue, HeapRequestQueue])
+def test_receiver_pool(engine):
+    q = BlockingRequestQueue(capacity=8, engine=engine())
+    pool = ReceiverPool(q, 3, id=20)
+    senders = [Sender(10 + i, q) for i in range(4)]
+    producers = [
+        threading.Thread(
+            target=lambda s: [
+                s.send_request(Request(i % 4, Command.EXECUTE_MATMUL, [i], s.id))
+                for i in range(500)
+            ],
+            args=(s,),
+        )
+        for s in senders
+    ]
+    for t in producers:
+        t.start()
+    for t in producers:
+        t.join()
+    pool.shutdown()
+    assert all(not t.is_alive() for t in pool.threads)
+    # every receiver also counts its own EXIT
+    assert pool.executed == 4 * 500 + 3
+    assert len(q) == 0
 
 
 if __name__ == "__main__":
-    test_basic()
+    test_basic(RequestQueue)
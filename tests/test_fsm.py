@@ -1,5 +1,11 @@
 
-from enum import Enum, auto
+from enum import Enum, IntEnum, auto
+from typing import Optional, Union
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, only ThreadStateMachineFleet needs it
+    np = None
 
 class State(Enum):
     INIT = auto()
@@ -8,27 +14,197 @@ class State(Enum):
     WAITING = auto()
     SUSPENDED = auto()
 
+class Trigger(IntEnum):
+    START = 0
+    SCHEDULE = 1
+    WAIT = 2
+    SUSPEND = 3
+
+# the legal transitions: trigger -> (states it is allowed in, state it leads to)
+TRANSITIONS: dict[Trigger, tuple[list[State], State]] = {
+    Trigger.START: ([State.INIT, State.SUSPENDED], State.READY),
+    Trigger.SCHEDULE: ([State.READY], State.RUNNING),
+    Trigger.WAIT: ([State.RUNNING], State.WAITING),
+    Trigger.SUSPEND: ([State.RUNNING, State.READY, State.INIT, State.WAITING], State.SUSPENDED),
+}
+
+def _compile(transitions: dict[Trigger, tuple[list[State], State]]) -> list[int]:
+    # a dense table with one row per state and one column per trigger, every cell
+    # holds the offset of the next state's row, or -1 if the trigger is not allowed
+    states = list(State)
+    width = len(Trigger)
+    table = [-1] * (len(states) * width)
+    for trigger, (sources, target) in transitions.items():
+        for state in sources:
+            table[states.index(state) * width + trigger] = states.index(target) * width
+    return table
+
 class ThreadStateMachine:
+    # the current state is kept as the offset of its row in the compiled table, so a
+    # transition is one list lookup
+    _STATES = list(State)
+    _TRIGGERS = {t.name.lower(): t for t in Trigger}
+    _TABLE = _compile(TRANSITIONS)
+
     def __init__(self) -> None:
         self.state = State.INIT
+
+    @property
+    def state(self) -> State:
+        return self._STATES[self._row // len(Trigger)]
+
+    @state.setter
+    def state(self, state: State) -> None:
+        self._row = self._STATES.index(state) * len(Trigger)
     
     def _check_state(self, trigger: str, possible_states: list[State]):
         if self.state not in possible_states:
             raise RuntimeError(f"{trigger=} {self.state.name=} {possible_states=}")
         
-    def action(self, trigger: str) -> None:
-        match trigger:
-            case "start":
-                self._check_state(trigger, [State.INIT, State.SUSPENDED])
-                self.state = State.READY
-            case "schedule":
-                self._check_state(trigger, [State.READY])
-                self.state = State.RUNNING
-            case "wait":
-                self._check_state(trigger, [State.RUNNING])
-                self.state = State.WAITING
-            case "suspend":
-                self._check_state(trigger, [State.RUNNING, State.READY, State.INIT, State.WAITING])
-                self.state = State.SUSPENDED
-            case _:
-                raise RuntimeError(f"Unsupported trigger={trigger}")
\ No newline at end of file
+    def action(self, trigger: Union[Trigger, str]) -> None:
+        # a Trigger is fastest, names like "start" are looked up first
+        if trigger.__class__ is not Trigger:
+            t = self._TRIGGERS.get(trigger)
+            if t is None:
+                raise RuntimeError(f"Unsupported trigger={trigger}")
+            trigger = t
+        row = self._TABLE[self._row + trigger]
+        if row < 0:
+            self._check_state(trigger.name.lower(), TRANSITIONS[trigger][0])
+        self._row = row
+
+class ThreadStateMachineFleet:
+    # the states of n machines in one numpy array, machine i is in State list(State)[states[i]]
+    # a step applies a trigger to a batch of machines at once with the rules of ThreadStateMachine,
+    # machines for which the trigger is not allowed keep their state and are reported in a mask
+    def __init__(self, n: int) -> None:
+        assert np is not None, "ThreadStateMachineFleet needs numpy"
+        self.states = np.zeros(n, dtype=np.int8)  # all in State.INIT
+        # the compiled table of ThreadStateMachine, with state indices instead of row offsets
+        table = np.array(ThreadStateMachine._TABLE, dtype=np.int8)
+        self._table = np.where(table < 0, -1, table // len(Trigger)).astype(np.int8)
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def state(self, i: int) -> State:
+        return ThreadStateMachine._STATES[self.states[i]]
+
+    def action(self, trigger, index: Optional["np.ndarray"] = None) -> "np.ndarray":
+        # trigger is one Trigger or name, or an array with one Trigger value per machine in index
+        # index is an array of distinct machine indices, or None for all machines
+        # return a bool mask aligned with index, True where the transition was illegal
+        if isinstance(trigger, (Trigger, str)):
+            if trigger.__class__ is not Trigger:
+                t = ThreadStateMachine._TRIGGERS.get(trigger)
+                if t is None:
+                    raise RuntimeError(f"Unsupported trigger={trigger}")
+                trigger = t
+            trigger = int(trigger)
+        else:
+            trigger = np.asarray(trigger)
+            unsupported = (trigger < 0) | (trigger >= len(Trigger))
+            if unsupported.any():
+                raise RuntimeError(f"Unsupported trigger={trigger[unsupported][0]}")
+        if index is not None:
+            index = np.asarray(index)
+        current = self.states if index is None else self.states[index]
+        target = self._table[current.astype(np.intp) * len(Trigger) + trigger]
+        illegal = target < 0
+        if index is None:
+            np.copyto(self.states, target, where=~illegal)
+        elif illegal.any():
+            self.states[index[~illegal]] = target[~illegal]
+        else:
+            self.states[index] = target
+        return illegal
+
+    def errors(self, trigger, index: Optional["np.ndarray"] = None) -> "np.ndarray":
+        # like action, but return the indices of the machines whose transition was illegal
+        illegal = self.action(trigger, index)
+        return np.flatnonzero(illegal) if index is None else np.asarray(index)[illegal]
+
+    def counts(self) -> dict[State, int]:
+        counts = np.bincount(self.states, minlength=len(State))
+        return {state: int(c) for state, c in zip(State, counts)}
+
+
+def test_transitions():
+    import pytest
+
+    for state in State:
+        for trigger in Trigger:
+            possible_states, target = TRANSITIONS[trigger]
+            for t in [trigger, trigger.name.lower()]:
+                fsm = ThreadStateMachine()
+                fsm.state = state
+                if state in possible_states:
+                    fsm.action(t)
+                    assert fsm.state == target
+                else:
+                    message = f"trigger='{trigger.name.lower()}' self.state.name='{state.name}' possible_states={possible_states}"
+                    with pytest.raises(RuntimeError) as e:
+                        fsm.action(t)
+                    assert str(e.value) == message
+                    assert fsm.state == state
+
+    fsm = ThreadStateMachine()
+    for trigger in ["stop", "START", 0, None]:
+        with pytest.raises(RuntimeError, match="Unsupported trigger="):
+            fsm.action(trigger)
+    assert fsm.state == State.INIT
+
+
+def test_fleet():
+    import random
+    import pytest
+
+    if np is None:
+        pytest.skip("needs numpy")
+
+    n = 1000
+    fleet = ThreadStateMachineFleet(n)
+    machines = [ThreadStateMachine() for _ in range(n)]
+    assert fleet.counts() == {state: (n if state == State.INIT else 0) for state in State}
+
+    rng = np.random.default_rng(0)
+    for step in range(200):
+        index = None if step % 10 == 0 else rng.choice(n, size=random.randrange(1, n), replace=False)
+        selected = range(n) if index is None else index
+        if step % 3 == 0:
+            trigger = random.choice(list(Trigger) + [t.name.lower() for t in Trigger])
+            triggers = [ThreadStateMachine._TRIGGERS.get(trigger, trigger)] * len(selected)
+        else:
+            trigger = rng.integers(len(Trigger), size=len(selected))
+            triggers = [Trigger(t) for t in trigger]
+        expected = []
+        for i, t in zip(selected, triggers):
+            try:
+                machines[i].action(t)
+                expected.append(False)
+            except RuntimeError:
+                expected.append(True)
+        illegal = fleet.action(trigger, index)
+        assert illegal.tolist() == expected
+        assert [fleet.state(i) for i in range(n)] == [m.state for m in machines]
+
+    counts = fleet.counts()
+    for state in State:
+        assert counts[state] == sum(m.state == state for m in machines)
+    assert sum(counts.values()) == len(fleet) == n
+
+    # every machine is in INIT, so only the first four can be started
+    fleet = ThreadStateMachineFleet(8)
+    assert fleet.errors(Trigger.START, np.arange(4)).tolist() == []
+    assert fleet.errors("schedule", np.arange(2, 6)).tolist() == [4, 5]
+    assert fleet.errors(Trigger.WAIT).tolist() == [0, 1, 4, 5, 6, 7]
+    assert [fleet.state(i) for i in range(8)] == [State.READY] * 2 + [State.WAITING] * 2 + [State.INIT] * 4
+
+    # a plain list works as index too, also when some transitions are illegal
+    assert fleet.action(Trigger.WAIT, [0, 1]).tolist() == [True, True]
+    assert fleet.errors(Trigger.SCHEDULE, [0, 4]).tolist() == [4]
+    assert fleet.state(0) == State.RUNNING and fleet.state(4) == State.INIT
+
+    for trigger in ["stop", np.array([0, 4]), np.array([-1, 0])]:
+        with pytest.raises(RuntimeError, match="Unsupported trigger="):
+            fleet.action(trigger, np.arange(2))
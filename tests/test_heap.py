@@ -1,94 +1,298 @@
 from __future__ import annotations
-from typing import Any, Iterable
+from typing import Any, Callable, Iterable, Iterator, Optional
+import operator
+import pytest
 
 from loguru import logger
 
 
 class Heap:
     def __init__(self, keys: Iterable[Any], values: Iterable[Any], max_or_min: str = "max") -> None:
-        self.keys = []
-        self.values = []
+        # pair them up with zip, which stops at the shorter one, even if the other is endless
+        pairs = list(zip(keys, values))
+        self.keys = [k for k, _ in pairs]
+        self.values = [v for _, v in pairs]
         self.max_or_min = max_or_min
-        self.func = max if max_or_min == "max" else min
+        # whether the first key belongs above the second one
+        self.higher = operator.gt if max_or_min == "max" else operator.lt
 
-        for k, v in zip(keys, values):
-            self.add(k, v)
+        # bottom-up heapify, sift down every node that has children, O(n) in total
+        for i in reversed(range(len(pairs) // 2)):
+            self._sift_down(i)
 
     def __repr__(self) -> str:
         return self.max_or_min + " " + ", ".join(str(k) for k in self.keys)
-    
-    def _heapify_one_node(self, index: int) -> int:
-        # if changes have not been made, return 0
-        # swapped root with left, return 1
-        # swapped root with right, return 2
-        i = index
-        j = 2 * i + 1
-        k = 2 * i + 2
-
-        ls = [(i, self.keys[i])]
-        if j < len(self.keys):
-            ls.append((j, self.keys[j]))
-        if k < len(self.keys):
-            ls.append((k, self.keys[k]))
-        r, _ = self.func(ls, key=lambda x: x[1])
-        
-        if r == i: # no swapping is needed
-            return 0
-
-        self.keys[i], self.keys[r] = self.keys[r], self.keys[i]
-        self.values[i], self.values[r] = self.values[r], self.values[i]
-        return 1 if r == j else 2
-        
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _sift_up(self, index: int) -> None:
+        # move the node up until its parent is higher, parents are shifted down
+        # into the hole and the node is only written once at the end
+        keys, values, higher = self.keys, self.values, self.higher
+        key, value = keys[index], values[index]
+        while index > 0:
+            parent = (index - 1) >> 1
+            if not higher(key, keys[parent]):
+                break
+            keys[index] = keys[parent]
+            values[index] = values[parent]
+            index = parent
+        keys[index] = key
+        values[index] = value
+
+    def _sift_down(self, index: int) -> None:
+        # move the node down until both children are lower, the higher child is
+        # shifted up into the hole at each level
+        keys, values, higher = self.keys, self.values, self.higher
+        n = len(keys)
+        key, value = keys[index], values[index]
+        child = 2 * index + 1
+        while child < n:
+            if child + 1 < n and higher(keys[child + 1], keys[child]):
+                child += 1
+            if not higher(keys[child], key):
+                break
+            keys[index] = keys[child]
+            values[index] = values[child]
+            index = child
+            child = 2 * index + 1
+        keys[index] = key
+        values[index] = value
+
     def add(self, key: Any, value: Any) -> None:
-        # add the new node to the end
-        i = len(self.keys)
+        # add the new node to the end and sift it up
         self.keys.append(key)
         self.values.append(value)
+        self._sift_up(len(self.keys) - 1)
+
+    def pop(self) -> tuple[Any, Any]:
+        # return key and value of the top node
+        if len(self.keys) == 0:
+            raise RuntimeError("Heap is empty")
+
+        key = self.keys.pop()
+        value = self.values.pop()
+        if len(self.keys) == 0:
+            # it was the only node
+            return key, value
+
+        # move the last node into the root and sift it down
+        result_key, result_value = self.keys[0], self.values[0]
+        self.keys[0] = key
+        self.values[0] = value
+        self._sift_down(0)
+        return result_key, result_value
+
+    def replace(self, key: Any, value: Any) -> tuple[Any, Any]:
+        # pop the top node and add a new one with a single sift
+        if len(self.keys) == 0:
+            raise RuntimeError("Heap is empty")
+        result_key, result_value = self.keys[0], self.values[0]
+        self.keys[0] = key
+        self.values[0] = value
+        self._sift_down(0)
+        return result_key, result_value
+
+    def pushpop(self, key: Any, value: Any) -> tuple[Any, Any]:
+        # add a new node and pop the top one, the new node is returned right away
+        # when it would be the top
+        if len(self.keys) == 0 or not self.higher(self.keys[0], key):
+            return key, value
+        return self.replace(key, value)
 
-        if i == 0:
-            # single node, no need to heapify
-            return
 
-        # heapify stage by stage from the new node
-        while True:
-            # get index of its parent
-            i = (i // 2 - 1) if (i % 2 == 0) else (i // 2)
-            if i < 0: # out of index
+class IndexedHeap(Heap):
+    # a heap whose nodes can be found again, add returns a handle that stays valid
+    # until the node is popped or removed, the nodes built from the iterables get
+    # the handles 0..n-1 in order
+    # handles[i] is the handle of node i and positions maps a handle back to i, the
+    # sifts keep both in sync
+    def __init__(self, keys: Iterable[Any], values: Iterable[Any], max_or_min: str = "max") -> None:
+        pairs = list(zip(keys, values))
+        n = len(pairs)
+        self.handles = list(range(n))
+        self.positions = {h: h for h in range(n)}
+        self.next_handle = n
+        super().__init__([k for k, _ in pairs], [v for _, v in pairs], max_or_min)
+
+    def __contains__(self, handle: int) -> bool:
+        return handle in self.positions
+
+    def get(self, handle: int) -> tuple[Any, Any]:
+        # return key and value of a node
+        assert handle in self.positions, f"{handle=}"
+        i = self.positions[handle]
+        return self.keys[i], self.values[i]
+
+    def _sift_up(self, index: int) -> None:
+        keys, values, higher = self.keys, self.values, self.higher
+        handles, positions = self.handles, self.positions
+        key, value, handle = keys[index], values[index], handles[index]
+        while index > 0:
+            parent = (index - 1) >> 1
+            if not higher(key, keys[parent]):
                 break
-            # heapify node
-            r = self._heapify_one_node(i)
-            if r == 0: # no changes, early exit
+            keys[index] = keys[parent]
+            values[index] = values[parent]
+            handles[index] = handles[parent]
+            positions[handles[index]] = index
+            index = parent
+        keys[index] = key
+        values[index] = value
+        handles[index] = handle
+        positions[handle] = index
+
+    def _sift_down(self, index: int) -> None:
+        keys, values, higher = self.keys, self.values, self.higher
+        handles, positions = self.handles, self.positions
+        n = len(keys)
+        key, value, handle = keys[index], values[index], handles[index]
+        child = 2 * index + 1
+        while child < n:
+            if child + 1 < n and higher(keys[child + 1], keys[child]):
+                child += 1
+            if not higher(keys[child], key):
                 break
-        logger.debug(repr(self))
+            keys[index] = keys[child]
+            values[index] = values[child]
+            handles[index] = handles[child]
+            positions[handles[index]] = index
+            index = child
+            child = 2 * index + 1
+        keys[index] = key
+        values[index] = value
+        handles[index] = handle
+        positions[handle] = index
+
+    def add(self, key: Any, value: Any) -> int:
+        # add the new node and return its handle
+        handle = self.next_handle
+        self.next_handle += 1
+        self.handles.append(handle)
+        super().add(key, value)
+        return handle
 
     def pop(self) -> tuple[Any, Any]:
-        # return key and value of the top node
         if len(self.keys) == 0:
             raise RuntimeError("Heap is empty")
+        return self._remove_at(0)
 
-        result_key = self.keys.pop(0)
-        result_value = self.values.pop(0)
-
-        if len(self.keys) <= 1:
-            # single node, no need to heapify
-            return result_key, result_value
-
-        self.keys.insert(0, self.keys.pop(-1))
-        self.values.insert(0, self.values.pop(-1))
-        
-        # heapify stage by stage from the root node
-        i = 0
-        while True:
-            r = self._heapify_one_node(i)
-            if r == 0: # no changes, early exit
-                break
-            i = i * 2 + r
-            assert i < len(self.keys)
+    def update(self, handle: int, key: Any) -> None:
+        # change the key of a node and move it up or down to its new place
+        assert handle in self.positions, f"{handle=}"
+        i = self.positions[handle]
+        old = self.keys[i]
+        self.keys[i] = key
+        if self.higher(key, old):
+            self._sift_up(i)
+        else:
+            self._sift_down(i)
+
+    def remove(self, handle: int) -> tuple[Any, Any]:
+        # remove a node, return its key and value
+        assert handle in self.positions, f"{handle=}"
+        return self._remove_at(self.positions[handle])
 
-        logger.debug(repr(self))
+    def _remove_at(self, index: int) -> tuple[Any, Any]:
+        # move the last node into the hole, it can belong above or below it
+        keys, values, handles = self.keys, self.values, self.handles
+        key, value, handle = keys.pop(), values.pop(), handles.pop()
+        if index == len(keys):
+            # it was the last node
+            del self.positions[handle]
+            return key, value
+
+        result_key, result_value = keys[index], values[index]
+        del self.positions[handles[index]]
+        keys[index] = key
+        values[index] = value
+        handles[index] = handle
+        if self.higher(key, result_key):
+            self._sift_up(index)
+        else:
+            self._sift_down(index)
         return result_key, result_value
 
-    
+
+def merge(
+    *iterables: Iterable[Any], key: Optional[Callable[[Any], Any]] = None, max_or_min: str = "min"
+) -> Iterator[Any]:
+    # lazily merge inputs that are each sorted ascending for "min" or descending for
+    # "max", the heap only holds the head of every input, equal items come out in
+    # the order of the inputs
+    # heap keys are (key, input) for "min" and (key, -input) for "max", so that ties
+    # go to the first input either way
+    sign = 1 if max_or_min == "min" else -1
+    hp = Heap([], [], max_or_min=max_or_min)
+    for i, iterable in enumerate(iterables):
+        it = iter(iterable)
+        for item in it:
+            hp.add((item if key is None else key(item), sign * i), (item, it))
+            break
+
+    while len(hp) > 1:
+        (_, i), (item, it) = hp.keys[0], hp.values[0]
+        yield item
+        for item in it:
+            hp.replace((item if key is None else key(item), i), (item, it))
+            break
+        else:
+            hp.pop()
+    if len(hp):
+        # a single input is left, no need to go through the heap
+        _, (item, it) = hp.pop()
+        yield item
+        yield from it
+
+
+def _top(
+    n: int, iterable: Iterable[Any], key: Optional[Callable[[Any], Any]], max_or_min: str
+) -> list[Any]:
+    # keep the best n items so far in a heap of the opposite orientation, so its top
+    # is the worst of them and is replaced whenever a better item comes along
+    # heap keys are (key, order) with the order signed so that among equal keys the
+    # earlier item counts as better and stays
+    if n <= 0:
+        return []
+    sign = -1 if max_or_min == "max" else 1
+    hp = Heap([], [], max_or_min="min" if max_or_min == "max" else "max")
+    items = enumerate(iterable)
+    for i, item in items:
+        hp.add((item if key is None else key(item), sign * i), item)
+        if len(hp) == n:
+            break
+
+    # a later item with a key equal to the worst one is worse, so only the bare
+    # keys need to be compared and most items are dropped right away
+    higher = hp.higher
+    worst = hp.keys[0][0] if len(hp) else None
+    for i, item in items:
+        k = item if key is None else key(item)
+        if higher(worst, k):
+            hp.replace((k, sign * i), item)
+            worst = hp.keys[0][0]
+
+    # drain the heap worst first and reverse it
+    result = [hp.pop()[1] for _ in range(len(hp))]
+    result.reverse()
+    return result
+
+
+def nlargest(
+    n: int, iterable: Iterable[Any], key: Optional[Callable[[Any], Any]] = None
+) -> list[Any]:
+    # the n largest items, largest first, in O(N log n) time and O(n) memory
+    return _top(n, iterable, key, "max")
+
+
+def nsmallest(
+    n: int, iterable: Iterable[Any], key: Optional[Callable[[Any], Any]] = None
+) -> list[Any]:
+    # the n smallest items, smallest first, in O(N log n) time and O(n) memory
+    return _top(n, iterable, key, "min")
+
+
 def _test(ls: list[int], max_or_min: str):
     hp = Heap(ls, [str(x) for x in ls], max_or_min=max_or_min)
     logger.debug(repr(hp))
@@ -116,8 +320,187 @@ def test_random():
         _test(ls, "min")
     
 
+def test_heapify():
+    import itertools
+    import random
+
+    for n in [0, 1, 2, 3, 10, 100, 1000]:
+        ls = [random.randint(0, 100) for _ in range(n)]
+        for max_or_min in ["max", "min"]:
+            hp = Heap(ls, [str(x) for x in ls], max_or_min=max_or_min)
+            assert len(hp) == n
+            for i in range(1, n):
+                assert not hp.higher(hp.keys[i], hp.keys[(i - 1) // 2])
+                assert hp.values[i] == str(hp.keys[i])
+
+    # unpaired keys are dropped, and an endless iterable stops at the other one
+    assert len(Heap([1, 2, 3], ["1", "2"])) == 2
+    hp = Heap([3, 1, 2], itertools.repeat(None), max_or_min="min")
+    assert [hp.pop() for _ in range(len(hp))] == [(1, None), (2, None), (3, None)]
+    hp = IndexedHeap(itertools.count(), ["a", "b"])
+    assert len(hp) == 2 and hp.get(1) == (1, "b")
+
+
+def test_add_pop():
+    import heapq
+    import random
+
+    hp = Heap([], [], max_or_min="min")
+    ref = []
+    for _ in range(2000):
+        if ref and random.random() < 0.4:
+            assert hp.pop()[0] == heapq.heappop(ref)
+        else:
+            k = random.randint(0, 100)
+            hp.add(k, str(k))
+            heapq.heappush(ref, k)
+        assert len(hp) == len(ref)
+    while ref:
+        k, v = hp.pop()
+        assert k == heapq.heappop(ref) and v == str(k)
+
+    with pytest.raises(RuntimeError, match="Heap is empty"):
+        hp.pop()
+
+
+def test_replace_pushpop():
+    hp = Heap([3, 1, 2], ["3", "1", "2"], max_or_min="min")
+    assert hp.replace(5, "5") == (1, "1")
+    assert hp.pushpop(0, "0") == (0, "0")
+    assert hp.pushpop(4, "4") == (2, "2")
+    assert [hp.pop()[0] for _ in range(len(hp))] == [3, 4, 5]
+    assert hp.pushpop(1, "1") == (1, "1")
+    with pytest.raises(RuntimeError, match="Heap is empty"):
+        hp.replace(1, "1")
+
+
+def test_merge():
+    import heapq
+    import random
+
+    runs = [
+        sorted(random.randint(0, 50) for _ in range(random.randint(0, 30)))
+        for _ in range(8)
+    ]
+    assert list(merge(*runs)) == sorted(x for run in runs for x in run)
+    assert list(merge(*[run[::-1] for run in runs], max_or_min="max")) == sorted(
+        (x for run in runs for x in run), reverse=True
+    )
+    assert list(merge()) == []
+    assert list(merge([], [1, 2])) == [1, 2]
+
+    # equal keys come out in the order of the inputs, like heapq.merge
+    key = lambda r: r[0]
+    records = [sorted(((random.randint(0, 5), i, j) for j in range(20)), key=key) for i in range(5)]
+    assert list(merge(*records, key=key)) == list(heapq.merge(*records, key=key))
+
+    # lazy, only the heads are taken from unbounded inputs
+    import itertools
+
+    evens = itertools.count(0, 2)
+    odds = itertools.count(1, 2)
+    assert list(itertools.islice(merge(evens, odds), 10)) == list(range(10))
+
+
+def test_nlargest_nsmallest():
+    import heapq
+    import itertools
+    import random
+
+    for n in [0, 1, 5, 100]:
+        ls = [random.randint(0, 20) for _ in range(50)]
+        assert nlargest(n, ls) == heapq.nlargest(n, ls)
+        assert nsmallest(n, ls) == heapq.nsmallest(n, ls)
+
+        pairs = list(enumerate(ls))
+        key = lambda p: p[1]
+        assert nlargest(n, pairs, key=key) == heapq.nlargest(n, pairs, key=key)
+        assert nsmallest(n, iter(pairs), key=key) == heapq.nsmallest(n, pairs, key=key)
+
+    assert nsmallest(3, itertools.islice(itertools.count(100, -1), 1000)) == [-899, -898, -897]
+
+
+def _check_indexed(hp: IndexedHeap, ref: dict[int, int]):
+    assert len(hp) == len(hp.handles) == len(hp.positions) == len(ref)
+    for i, h in enumerate(hp.handles):
+        assert hp.positions[h] == i
+        assert hp.keys[i] == ref[h] and hp.values[i] == h
+    for i in range(1, len(hp)):
+        assert not hp.higher(hp.keys[i], hp.keys[(i - 1) // 2])
+
+
+def test_indexed_heap():
+    import random
+
+    for max_or_min in ["max", "min"]:
+        ls = [random.randint(0, 100) for _ in range(50)]
+        hp = IndexedHeap(ls, range(50), max_or_min=max_or_min)
+        ref = dict(enumerate(ls))
+        _check_indexed(hp, ref)
+
+        for _ in range(2000):
+            r = random.random()
+            if r < 0.3:
+                k = random.randint(0, 100)
+                h = hp.add(k, hp.next_handle)
+                ref[h] = k
+            elif ref and r < 0.6:
+                h = random.choice(list(ref))
+                ref[h] = random.randint(0, 100)
+                hp.update(h, ref[h])
+            elif ref and r < 0.8:
+                h = random.choice(list(ref))
+                assert hp.remove(h) == (ref.pop(h), h)
+                assert h not in hp
+            elif ref:
+                k, h = hp.pop()
+                assert k == (max if max_or_min == "max" else min)(ref.values())
+                assert ref.pop(h) == k
+            _check_indexed(hp, ref)
+
+    with pytest.raises(AssertionError):
+        hp.update(hp.next_handle, 0)
+
+
+def test_indexed_heap_dijkstra():
+    import heapq
+    import random
+
+    n = 200
+    edges = {
+        u: [(random.randrange(n), random.randint(1, 20)) for _ in range(5)]
+        for u in range(n)
+    }
+
+    # decrease-key on an indexed heap
+    dist = {0: 0}
+    hp = IndexedHeap([], [], max_or_min="min")
+    handles = {0: hp.add(0, 0)}
+    while len(hp):
+        d, u = hp.pop()
+        for v, w in edges[u]:
+            if v not in dist or d + w < dist[v]:
+                dist[v] = d + w
+                if v in handles and handles[v] in hp:
+                    hp.update(handles[v], d + w)
+                elif v not in handles:
+                    handles[v] = hp.add(d + w, v)
+
+    # reference with heapq and lazy deletion
+    ref = {0: 0}
+    queue = [(0, 0)]
+    while queue:
+        d, u = heapq.heappop(queue)
+        if d > ref[u]:
+            continue
+        for v, w in edges[u]:
+            if v not in ref or d + w < ref[v]:
+                ref[v] = d + w
+                heapq.heappush(queue, (d + w, v))
+    assert dist == ref
+
+
 if __name__ == "__main__":
     import sys
-    import pytest
     # Exit with the pytest's exit code
     sys.exit(pytest.main([__file__, "-s"]))
\ No newline at end of file
@@ -1,44 +1,267 @@
-def mergesort(arr, left_index=0, right_index=-1):
+from bisect import bisect_left, bisect_right
+from typing import Any, Callable, Iterable, Iterator, Optional
+import heapq
+import itertools
+import os
+import struct
+import sys
+import tempfile
+
+# runs shorter than this are extended with binary insertion sort before merging
+MIN_RUN = 32
+# records packed or unpacked at a time when runs are written to or read from disk
+IO_BATCH = 1 << 14
+
+
+def mergesort(
+    arr: list,
+    left_index: int = 0,
+    right_index: int = -1,
+    key: Optional[Callable[[Any], Any]] = None,
+    reverse: bool = False,
+) -> None:
+    # stable sort of arr[left_index : right_index + 1] in place, right_index -1 is
+    # the end, items are only compared with <
+    # a bottom-up natural mergesort: the range is cut into the ascending runs it
+    # already has, short runs are extended with insertion sort, and neighbouring runs
+    # are merged pass by pass through one scratch buffer, so sorted or nearly sorted
+    # input takes close to linear time
     if right_index == -1:
         right_index = len(arr) - 1
 
-    print(f"{left_index=}, {right_index=}")
-
     if left_index >= right_index:
         return
 
-    if left_index == right_index - 1:
-        if arr[left_index] > arr[right_index]:
-            arr[left_index], arr[right_index] = arr[right_index], arr[left_index]
+    if key is not None:
+        # sort (key, position) pairs, positions are unique so the items themselves
+        # are never compared, they are negated when reversed so that the earlier of
+        # two equal keys still comes first
+        items = arr[left_index : right_index + 1]
+        sign = -1 if reverse else 1
+        pairs = [(key(x), sign * i) for i, x in enumerate(items)]
+        mergesort(pairs, reverse=reverse)
+        arr[left_index : right_index + 1] = [items[sign * i] for _, i in pairs]
         return
 
-    # partition
-    mid_index = (left_index + right_index) // 2
-    mergesort(arr, left_index, mid_index)
-    mergesort(arr, mid_index + 1, right_index)
-
-    # merge
-    left_arr = arr[left_index : mid_index + 1]
-    right_arr = arr[mid_index + 1 : right_index + 1]
-    i = j = 0
-    k = left_index
-
-    while i < len(left_arr) and j < len(right_arr):
-        if left_arr[i] < right_arr[j]:
-            arr[k] = left_arr[i]
-            i += 1
-            k += 1
-        else:
-            arr[k] = right_arr[j]
-            j += 1
+    if reverse:
+        # like list.sort, reversing before and after a stable ascending sort gives a
+        # stable descending one
+        arr[left_index : right_index + 1] = arr[left_index : right_index + 1][::-1]
+    _natural_mergesort(arr, left_index, right_index + 1)
+    if reverse:
+        arr[left_index : right_index + 1] = arr[left_index : right_index + 1][::-1]
+
+
+def _natural_mergesort(arr: list, lo: int, hi: int) -> None:
+    # sort arr[lo:hi]
+    # runs[i] is where the i-th run starts, the last entry is hi
+    runs = []
+    start = lo
+    while start < hi:
+        end = _run_end(arr, start, hi)
+        if end - start < MIN_RUN:
+            end = min(hi, start + MIN_RUN)
+            _insertion_sort(arr, start, end)
+        runs.append(start)
+        start = end
+    runs.append(hi)
+
+    # the smaller of two runs is moved out of the way while they are merged, and
+    # it is never longer than half of the range
+    # the copies in and out of buf still build one temporary slice per merge, and
+    # insertion sort one per insertion, slice copies run in C and beat index loops
+    buf = [None] * ((hi - lo) // 2 + 1)
+    while len(runs) > 2:
+        merged = []
+        for i in range(0, len(runs) - 2, 2):
+            _merge(arr, buf, runs[i], runs[i + 1], runs[i + 2])
+            merged.append(runs[i])
+        if len(runs) % 2 == 0:
+            # an odd number of runs, the last one waits for the next pass
+            merged.append(runs[-2])
+        merged.append(hi)
+        runs = merged
+
+
+def _run_end(arr: list, start: int, hi: int) -> int:
+    # the end of the run starting at start, a strictly descending run is reversed in
+    # place, equal items would swap places otherwise
+    end = start + 1
+    if end == hi:
+        return end
+    if arr[end] < arr[start]:
+        while end + 1 < hi and arr[end + 1] < arr[end]:
+            end += 1
+        end += 1
+        arr[start:end] = arr[start:end][::-1]
+        return end
+    while end + 1 < hi and not arr[end + 1] < arr[end]:
+        end += 1
+    return end + 1
+
+
+def _insertion_sort(arr: list, lo: int, hi: int) -> None:
+    # binary insertion sort of arr[lo:hi], equal items keep their order
+    for i in range(lo + 1, hi):
+        x = arr[i]
+        pos = bisect_right(arr, x, lo, i)
+        if pos < i:
+            arr[pos + 1 : i + 1] = arr[pos:i]
+            arr[pos] = x
+
+
+def _merge(arr: list, buf: list, lo: int, mid: int, hi: int) -> None:
+    # merge the sorted runs arr[lo:mid] and arr[mid:hi]
+    # items of the left run that are not above the first of the right run, and items
+    # of the right run that are not below the last of the left run, stay where they
+    # are, so runs that are already in order cost two binary searches
+    lo = bisect_right(arr, arr[mid], lo, mid)
+    if lo == mid:
+        return
+    hi = bisect_left(arr, arr[mid - 1], mid, hi)
+
+    if mid - lo <= hi - mid:
+        # move the left run out and merge from the front
+        n = mid - lo
+        buf[:n] = arr[lo:mid]
+        i, j, k = 0, mid, lo
+        while i < n and j < hi:
+            if arr[j] < buf[i]:
+                arr[k] = arr[j]
+                j += 1
+            else:
+                arr[k] = buf[i]
+                i += 1
             k += 1
+        if i < n:
+            arr[k : k + n - i] = buf[i:n]
+    else:
+        # move the right run out and merge from the back
+        n = hi - mid
+        buf[:n] = arr[mid:hi]
+        i, j, k = n - 1, mid - 1, hi - 1
+        while i >= 0 and j >= lo:
+            if buf[i] < arr[j]:
+                arr[k] = arr[j]
+                j -= 1
+            else:
+                arr[k] = buf[i]
+                i -= 1
+            k -= 1
+        if i >= 0:
+            arr[lo : lo + i + 1] = buf[: i + 1]
+
+
+def external_sort(
+    records: Iterable[Any],
+    fmt: str = "<d",
+    memory_budget: int = 64 << 20,
+    fan_in: int = 64,
+    tmp_dir: Optional[str] = None,
+) -> Iterator[Any]:
+    # lazily yield the records of a stream of any length in sorted order
+    # records are numbers for a single field format like "<d" or "<q", and tuples of
+    # the fields otherwise, e.g. "<qd", which are sorted field by field
+    # runs that fit in memory_budget bytes are sorted and spilled to temporary files
+    # as packed structs, then merged fan_in at a time, with reads of
+    # memory_budget / (fan_in + 1) bytes per run, until the last merge feeds the
+    # output, so the memory use does not grow with the input
+    assert fan_in >= 2, f"{fan_in=}"
+    record = struct.Struct(fmt)
+    assert record.size > 0, f"{fmt=}"
+    fields = len(record.unpack(bytes(record.size)))
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmp:
+        paths = _spill_runs(iter(records), record, fields, memory_budget, tmp)
+        read_size = max(record.size, memory_budget // (fan_in + 1))
+        read_size -= read_size % record.size
+
+        # merge the runs fan_in at a time into longer ones until one merge is left
+        passes = 0
+        while len(paths) > fan_in:
+            passes += 1
+            merged = []
+            for i in range(0, len(paths), fan_in):
+                group = paths[i : i + fan_in]
+                path = os.path.join(tmp, f"merge{passes}-{len(merged)}")
+                runs = [_read_run(p, record, fields, read_size) for p in group]
+                _write_run(path, record, fields, heapq.merge(*runs))
+                for p in group:
+                    os.remove(p)
+                merged.append(path)
+            paths = merged
+
+        runs = [_read_run(p, record, fields, read_size) for p in paths]
+        yield from heapq.merge(*runs)
+
 
-    if i < len(left_arr):
-        arr[k : k + len(left_arr) - i] = left_arr[i:]
-    if j < len(right_arr):
-        arr[k : k + len(right_arr) - j] = right_arr[j:]
+def _record_cost(record: Any) -> int:
+    # rough bytes a record takes in a list
+    if isinstance(record, tuple):
+        return 8 + sys.getsizeof(record) + sum(sys.getsizeof(x) for x in record)
+    return 8 + sys.getsizeof(record)
 
-    print(f"{arr=}")
+
+def _spill_runs(
+    records: Iterator[Any],
+    record: struct.Struct,
+    fields: int,
+    memory_budget: int,
+    tmp: str,
+) -> list[str]:
+    # cut the stream into sorted runs of at most memory_budget bytes, one file each
+    paths: list[str] = []
+    for first in records:
+        run_length = max(1, memory_budget // _record_cost(first))
+        run = [first]
+        run.extend(itertools.islice(records, run_length - 1))
+        run.sort()
+        path = os.path.join(tmp, f"run{len(paths)}")
+        _write_run(path, record, fields, run)
+        paths.append(path)
+    return paths
+
+
+def _write_run(
+    path: str, record: struct.Struct, fields: int, records: Iterable[Any]
+) -> None:
+    # pack IO_BATCH records at a time, with a single struct call for each batch
+    # native formats align every field, and a batch would put padding between
+    # records that the record.size stride of _read_run does not expect, so those
+    # are packed one record at a time
+    fmt = record.format.lstrip("@=<>!")
+    order = record.format[: len(record.format) - len(fmt)]
+    it = iter(records)
+    with open(path, "wb") as f:
+        while True:
+            batch = list(itertools.islice(it, IO_BATCH))
+            if not batch:
+                break
+            if order in ("", "@"):
+                pack = record.pack
+                if fields > 1:
+                    f.write(b"".join([pack(*r) for r in batch]))
+                else:
+                    f.write(b"".join([pack(x) for x in batch]))
+                continue
+            if fields > 1:
+                batch = list(itertools.chain.from_iterable(batch))
+            f.write(struct.pack(f"{order}{fmt * (len(batch) // fields)}", *batch))
+
+
+def _read_run(
+    path: str, record: struct.Struct, fields: int, read_size: int
+) -> Iterator[Any]:
+    # yield the records of a run file, reading read_size bytes at a time
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(read_size)
+            if not chunk:
+                return
+            if fields == 1:
+                for (x,) in record.iter_unpack(chunk):
+                    yield x
+            else:
+                yield from record.iter_unpack(chunk)
 
 
 def test_mergesort():
@@ -47,8 +270,91 @@ def test_mergesort():
     assert arr == [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
 
 
+def test_mergesort_distributions():
+    import random
+
+    n = 5000
+    for arr in [
+        [random.random() for _ in range(n)],
+        list(range(n)),
+        list(range(n, 0, -1)),
+        [7] * n,
+        [random.randrange(4) for _ in range(n)],
+        list(range(n // 2)) + list(range(n // 2, 0, -1)),
+        [i % 100 for i in range(n)],
+        [i + random.randrange(10) for i in range(n)],
+        [],
+        [1],
+        [2, 1],
+    ]:
+        for reverse in [False, True]:
+            expected = sorted(arr, reverse=reverse)
+            result = list(arr)
+            mergesort(result, reverse=reverse)
+            assert result == expected
+
+
+def test_mergesort_stable():
+    import random
+
+    # equal keys keep their order, also when reversed
+    records = [(random.randrange(10), i) for i in range(2000)]
+    for reverse in [False, True]:
+        expected = sorted(records, key=lambda r: r[0], reverse=reverse)
+        result = list(records)
+        mergesort(result, key=lambda r: r[0], reverse=reverse)
+        assert result == expected
+
+    # without a key, items that compare equal are not reordered either
+    class Item:
+        def __init__(self, k, i):
+            self.k, self.i = k, i
+
+        def __lt__(self, other):
+            return self.k < other.k
+
+    items = [Item(random.randrange(10), i) for i in range(2000)]
+    for reverse in [False, True]:
+        expected = sorted(items, reverse=reverse)
+        result = list(items)
+        mergesort(result, reverse=reverse)
+        assert [x.i for x in result] == [x.i for x in expected]
+
+    arr = [5, 4, 3, 2, 1, 0]
+    mergesort(arr, 1, 4)
+    assert arr == [5, 1, 2, 3, 4, 0]
+    mergesort(arr, 1, 4, reverse=True)
+    assert arr == [5, 4, 3, 2, 1, 0]
+
+
+def test_external_sort(tmp_path):
+    import random
+
+    data = [random.random() for _ in range(10_000)]
+    # a budget of a few hundred records and a fan-in of 3 make several merge passes
+    result = list(
+        external_sort(iter(data), memory_budget=10_000, fan_in=3, tmp_dir=tmp_path)
+    )
+    assert result == sorted(data)
+    assert list(tmp_path.iterdir()) == []
+
+    records = [(random.randrange(100), random.random()) for _ in range(5000)]
+    result = list(external_sort(records, "<qd", memory_budget=20_000, fan_in=4))
+    assert result == sorted(records)
+
+    # native formats pad between fields, "dI" is 12 bytes but "dIdI" is 28
+    records = [(random.random(), random.randrange(1 << 32)) for _ in range(5000)]
+    for fmt in ["dI", "@dI", "Id"]:
+        data = records if fmt != "Id" else [(i, d) for d, i in records]
+        result = list(external_sort(data, fmt, memory_budget=20_000, fan_in=4))
+        assert result == sorted(data)
+
+    # one run, no spilled merges
+    assert list(external_sort([3.0, 1.0, 2.0])) == [1.0, 2.0, 3.0]
+    assert list(external_sort([])) == []
+
+
 if __name__ == "__main__":
-    import sys
     import pytest
 
     # Exit with the pytest's exit code
@@ -0,0 +1,160 @@
+from concurrent.futures import Executor, ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Optional
+import os
+import pytest
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, only parallel_sort needs it
+    np = None
+
+# inputs smaller than this are sorted in the calling process
+MIN_PARALLEL = 1 << 16
+
+
+def _attach(name: str, dtype: str, n: int) -> tuple[shared_memory.SharedMemory, Any]:
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray((n,), dtype=dtype, buffer=shm.buf)
+
+
+def _sort_run(name: str, dtype: str, n: int, lo: int, hi: int) -> None:
+    # sort arr[lo:hi] in place in the shared buffer
+    shm, arr = _attach(name, dtype, n)
+    arr[lo:hi].sort(kind="stable")
+    del arr
+    shm.close()
+
+
+def _merge_runs(
+    src_name: str, dst_name: str, dtype: str, n: int, lo: int, mid: int, hi: int
+) -> None:
+    # merge the sorted runs src[lo:mid] and src[mid:hi] into dst[lo:hi]
+    # every item lands at its own index plus the number of items of the other run
+    # that go before it, equal items of the left run go first
+    src_shm, src = _attach(src_name, dtype, n)
+    dst_shm, dst = _attach(dst_name, dtype, n)
+    left, right = src[lo:mid], src[mid:hi]
+    out = dst[lo:hi]
+    out[np.searchsorted(right, left, side="left") + np.arange(len(left))] = left
+    out[np.searchsorted(left, right, side="right") + np.arange(len(right))] = right
+    del src, dst, left, right, out
+    src_shm.close()
+    dst_shm.close()
+
+
+def sort_pool(workers: int) -> ProcessPoolExecutor:
+    # a pool to pass to parallel_sort, the resource tracker is started first so that
+    # the workers share it, otherwise every worker starts its own one when it attaches
+    # shared memory, and that one unlinks the segments with a warning when the
+    # worker exits
+    resource_tracker.ensure_running()
+    return ProcessPoolExecutor(max_workers=workers)
+
+
+def parallel_sort(
+    data: Any,
+    workers: Optional[int] = None,
+    executor: Optional[Executor] = None,
+    min_size: int = MIN_PARALLEL,
+) -> Any:
+    # return a sorted copy of a 1-d numeric array, or of anything np.asarray takes
+    # the input is copied once into shared memory and cut into one run per worker,
+    # the workers sort the runs in place and then merge them pairwise, round by round
+    # between two shared buffers, so no chunk is ever pickled
+    # the sort is stable, a pool of workers processes is started unless an executor,
+    # e.g. from sort_pool, is given
+    assert np is not None, "parallel_sort needs numpy"
+    arr = np.asarray(data)
+    assert arr.ndim == 1, f"{arr.shape=}"
+    workers = workers or os.cpu_count() or 1
+    n = len(arr)
+    if workers == 1 or n < max(min_size, 2):
+        return np.sort(arr, kind="stable")
+
+    size = max(arr.nbytes, 1)
+    shms = [shared_memory.SharedMemory(create=True, size=size) for _ in range(2)]
+    pool = executor or sort_pool(workers)
+    try:
+        src_shm, dst_shm = shms
+        src = np.ndarray((n,), dtype=arr.dtype, buffer=src_shm.buf)
+        src[:] = arr
+        del src
+        dtype = arr.dtype.str
+
+        bounds = [n * i // workers for i in range(workers + 1)]
+        runs = list(zip(bounds, bounds[1:]))
+        futures = [
+            pool.submit(_sort_run, src_shm.name, dtype, n, lo, hi) for lo, hi in runs
+        ]
+        for f in futures:
+            f.result()
+
+        while len(runs) > 1:
+            # merge runs 0+1, 2+3, ... a last odd run is merged with an empty one,
+            # which copies it over
+            merged = []
+            futures = []
+            for i in range(0, len(runs), 2):
+                lo, mid = runs[i]
+                hi = runs[i + 1][1] if i + 1 < len(runs) else mid
+                futures.append(
+                    pool.submit(
+                        _merge_runs, src_shm.name, dst_shm.name, dtype, n, lo, mid, hi
+                    )
+                )
+                merged.append((lo, hi))
+            for f in futures:
+                f.result()
+            runs = merged
+            src_shm, dst_shm = dst_shm, src_shm
+
+        src = np.ndarray((n,), dtype=arr.dtype, buffer=src_shm.buf)
+        result = src.copy()
+        del src
+        return result
+    finally:
+        if executor is None:
+            pool.shutdown()
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+
+@pytest.mark.skipif(np is None, reason="needs numpy")
+def test_parallel_sort():
+    rng = np.random.default_rng(0)
+    for data in [
+        rng.random(10_000),
+        rng.integers(0, 10, 10_001, dtype=np.int32),
+        np.arange(5000, 0, -1, dtype=np.int64),
+        np.zeros(3, dtype=np.float32),
+        np.array([], dtype=np.float64),
+    ]:
+        with sort_pool(2) as pool:
+            for workers in [1, 2, 3, 8]:
+                result = parallel_sort(data, workers, executor=pool, min_size=0)
+                assert result.dtype == data.dtype
+                assert np.array_equal(result, np.sort(data))
+
+    # the input is not touched, and plain lists work too
+    data = list(rng.integers(0, 1000, 1000))
+    copy = list(data)
+    assert parallel_sort(data, 2, min_size=0).tolist() == sorted(copy)
+    assert data == copy
+
+
+@pytest.mark.skipif(np is None, reason="needs numpy")
+def test_parallel_sort_stable():
+    # equal keys keep their order, seen through the raw bits of -0.0 and 0.0
+    data = np.array([0.0, -0.0] * 500 + [1.0, -1.0] * 500)
+    result = parallel_sort(data, 4, min_size=0)
+    expected = np.sort(data, kind="stable")
+    assert np.array_equal(np.signbit(result), np.signbit(expected))
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Exit with the pytest's exit code
+    sys.exit(pytest.main([__file__, "-s"]))
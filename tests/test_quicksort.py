@@ -1,33 +1,137 @@
-def quicksort(arr, left_index=0, right_index=-1):
+from typing import Any, Callable, Optional
+
+# ranges of up to this many items are finished with insertion sort
+INSERTION_CUTOFF = 16
+# ranges of at least this many items take the pivot from a ninther
+NINTHER_CUTOFF = 128
+
+
+def quicksort(
+    arr: list,
+    left_index: int = 0,
+    right_index: int = -1,
+    key: Optional[Callable[[Any], Any]] = None,
+) -> None:
+    # sort arr[left_index : right_index + 1] in place, right_index -1 is the end
+    # introsort: quicksort with a median-of-3 or ninther pivot and three-way
+    # partitioning, insertion sort for small ranges, and heapsort once the
+    # recursion gets deeper than 2 log2(n), so the worst case is O(n log n)
+    # items are only compared with <
     if right_index == -1:
         right_index = len(arr) - 1
 
     if left_index >= right_index:
         return
 
-    # select pivot
-    pivot = arr[right_index]
+    if key is not None:
+        # sort (key, position) pairs, positions are unique so the items themselves
+        # are never compared, and equal keys keep their order
+        items = arr[left_index : right_index + 1]
+        pairs = [(key(x), i) for i, x in enumerate(items)]
+        _introsort(pairs, 0, len(pairs) - 1, 2 * len(pairs).bit_length())
+        arr[left_index : right_index + 1] = [items[i] for _, i in pairs]
+        return
+
+    n = right_index - left_index + 1
+    _introsort(arr, left_index, right_index, 2 * n.bit_length())
+
+
+def _introsort(arr: list, lo: int, hi: int, depth: int) -> None:
+    while hi - lo >= INSERTION_CUTOFF:
+        if depth == 0:
+            _heapsort(arr, lo, hi)
+            return
+        depth -= 1
+
+        pivot = _pivot(arr, lo, hi)
 
-    # sort pivot
-    j = left_index
-    i = j - 1
+        # three-way partition: arr[lo:lt] < pivot, arr[lt:i] == pivot,
+        # arr[gt + 1 : hi + 1] > pivot, and arr[i : gt + 1] is not looked at yet
+        lt = i = lo
+        gt = hi
+        while i <= gt:
+            x = arr[i]
+            if x < pivot:
+                arr[i] = arr[lt]
+                arr[lt] = x
+                lt += 1
+                i += 1
+            elif pivot < x:
+                arr[i] = arr[gt]
+                arr[gt] = x
+                gt -= 1
+            else:
+                i += 1
 
-    while True:
-        if arr[j] >= pivot:
-            j += 1
+        # recurse into the smaller side and loop on the larger one, so the stack
+        # never gets deeper than log2(n)
+        if lt - lo < hi - gt:
+            _introsort(arr, lo, lt - 1, depth)
+            lo = gt + 1
         else:
-            i += 1
-            arr[i], arr[j] = arr[j], arr[i]
-            j += 1
+            _introsort(arr, gt + 1, hi, depth)
+            hi = lt - 1
+
+    _insertion_sort(arr, lo, hi)
+
+
+def _median3(a: Any, b: Any, c: Any) -> Any:
+    if a < b:
+        if b < c:
+            return b
+        return c if a < c else a
+    if a < c:
+        return a
+    return c if b < c else b
+
+
+def _pivot(arr: list, lo: int, hi: int) -> Any:
+    # median of the first, middle and last items, or for large ranges Tukey's
+    # ninther, the median of the medians of three evenly spaced triples
+    mid = (lo + hi) // 2
+    if hi - lo + 1 < NINTHER_CUTOFF:
+        return _median3(arr[lo], arr[mid], arr[hi])
+    step = (hi - lo + 1) // 8
+    return _median3(
+        _median3(arr[lo], arr[lo + step], arr[lo + 2 * step]),
+        _median3(arr[mid - step], arr[mid], arr[mid + step]),
+        _median3(arr[hi - 2 * step], arr[hi - step], arr[hi]),
+    )
+
+
+def _insertion_sort(arr: list, lo: int, hi: int) -> None:
+    for i in range(lo + 1, hi + 1):
+        x = arr[i]
+        j = i - 1
+        while j >= lo and x < arr[j]:
+            arr[j + 1] = arr[j]
+            j -= 1
+        arr[j + 1] = x
 
-        if j == right_index:
-            i += 1
-            arr[i], arr[j] = arr[j], arr[i]
-            break
 
-    # partition
-    quicksort(arr, left_index, i - 1)
-    quicksort(arr, i + 1, right_index)
+def _heapsort(arr: list, lo: int, hi: int) -> None:
+    # max heap over arr[lo : hi + 1], node i has the children 2i+1 and 2i+2
+    # counted from lo
+    n = hi - lo + 1
+    for i in reversed(range(n // 2)):
+        _sift_down(arr, lo, i, n)
+    for end in range(n - 1, 0, -1):
+        arr[lo], arr[lo + end] = arr[lo + end], arr[lo]
+        _sift_down(arr, lo, 0, end)
+
+
+def _sift_down(arr: list, lo: int, i: int, n: int) -> None:
+    x = arr[lo + i]
+    child = 2 * i + 1
+    while child < n:
+        if child + 1 < n and arr[lo + child] < arr[lo + child + 1]:
+            child += 1
+        if not x < arr[lo + child]:
+            break
+        arr[lo + i] = arr[lo + child]
+        i = child
+        child = 2 * i + 1
+    arr[lo + i] = x
 
 
 def test_quicksort():
@@ -36,6 +140,63 @@ def test_quicksort():
     assert arr == [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
 
 
+def test_quicksort_distributions():
+    import random
+
+    n = 5000
+    for arr in [
+        [random.random() for _ in range(n)],
+        list(range(n)),
+        list(range(n, 0, -1)),
+        [7] * n,
+        [random.randrange(4) for _ in range(n)],
+        list(range(n // 2)) + list(range(n // 2, 0, -1)),
+        [i % 100 for i in range(n)],
+        [],
+        [1],
+        [2, 1],
+    ]:
+        expected = sorted(arr)
+        quicksort(arr)
+        assert arr == expected
+
+
+def test_quicksort_subrange_and_key():
+    import random
+
+    arr = [5, 4, 3, 2, 1, 0]
+    quicksort(arr, 1, 4)
+    assert arr == [5, 1, 2, 3, 4, 0]
+
+    # equal keys keep their order
+    words = [random.choice("abcdef") * random.randint(1, 5) for _ in range(1000)]
+    expected = sorted(words, key=len)
+    quicksort(words, key=len)
+    assert words == expected
+
+    records = [(random.randrange(10), i) for i in range(1000)]
+    expected = (
+        records[:100] + sorted(records[100:900], key=lambda r: -r[0]) + records[900:]
+    )
+    quicksort(records, 100, 899, key=lambda r: -r[0])
+    assert records == expected
+
+
+def test_heapsort_fallback():
+    import random
+
+    # a depth limit of 0 goes straight to heapsort
+    arr = [random.randrange(100) for _ in range(1000)]
+    expected = sorted(arr)
+    _introsort(arr, 0, len(arr) - 1, 0)
+    assert arr == expected
+
+    arr = [random.randrange(100) for _ in range(1000)]
+    expected = arr[:10] + sorted(arr[10:990]) + arr[990:]
+    _heapsort(arr, 10, 989)
+    assert arr == expected
+
+
 if __name__ == "__main__":
     import sys
     import pytest